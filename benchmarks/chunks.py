@@ -2,6 +2,8 @@
 
 import time
 
+from itertools import product
+
 from bravo.chunk import Chunk
 from bravo.ibravo import ITerrainGenerator
 from bravo.plugin import retrieve_plugins
@@ -27,13 +29,47 @@ def repeated_seeds(i, p):
     chunk = Chunk(i, i)
     p.populate(chunk, 0)
 
+@timed
+def regenerate(chunk):
+    chunk.regenerate()
+
+# A six-block cube of leaves, about the size of a tree's canopy.
+canopy = list(product(range(5, 11), range(66, 72), range(5, 11)))
+
+def floored_chunk():
+    chunk = Chunk(0, 0)
+    for x, z in product(range(16), repeat=2):
+        chunk.set_block_column(x, z, [1] * 64 + [0] * 192)
+    chunk.regenerate()
+    chunk.populated = True
+    return chunk
+
+@timed
+def canopy_blocks(chunk):
+    for coords in canopy:
+        chunk.set_block(coords, 18)
+
+@timed
+def canopy_batch(chunk):
+    with chunk.batch():
+        for coords in canopy:
+            chunk.set_block(coords, 18)
+
 plugins = retrieve_plugins(ITerrainGenerator)
 
 def empty_bench():
     l = [empty_chunk(i) for i in xrange(25)]
     return "chunk_baseline", l
 
-benchmarks = [empty_bench]
+def canopy_bench():
+    l = [canopy_blocks(floored_chunk()) for i in xrange(5)]
+    return "chunk_canopy", l
+
+def canopy_batch_bench():
+    l = [canopy_batch(floored_chunk()) for i in xrange(5)]
+    return "chunk_canopy_batch", l
+
+benchmarks = [empty_bench, canopy_bench, canopy_batch_bench]
 for name, plugin in plugins.items():
     def seq(name=name, plugin=plugin):
         l = [sequential_seeded(i, plugin) for i in xrange(25)]
@@ -42,5 +78,12 @@ for name, plugin in plugins.items():
     def rep(name=name, plugin=plugin):
         l = [repeated_seeds(i, plugin) for i in xrange(25)]
         return ("chunk_%s_repeated" % name), l
+
+    def regen(name=name, plugin=plugin):
+        chunk = Chunk(0, 0)
+        plugin.populate(chunk, 0)
+        l = [regenerate(chunk) for i in xrange(25)]
+        return ("chunk_%s_regenerate" % name), l
     benchmarks.append(seq)
     benchmarks.append(rep)
+    benchmarks.append(regen)
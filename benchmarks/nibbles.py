@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+"""
+Per-chunk cost of nibble packing and array segmenting.
+
+A full chunk has sixteen sections, each with three 2048-byte nibble arrays:
+metadata, skylight, and block light. The "old" benchmarks use the original
+per-element implementations, kept here for comparison; the others use the
+current kernels, both with and without NumPy.
+"""
+
+import time
+
+from array import array
+from random import randint
+
+from bravo import chunk
+from bravo.chunk import segment_array
+from bravo.utilities import bits
+from bravo.utilities.bits import grouper, pack_nibbles, unpack_nibbles
+
+def old_unpack_nibbles(l):
+    data = array("B")
+    for d in l:
+        i = ord(d)
+        data.append(i & 0xf)
+        data.append(i >> 4)
+    return data
+
+def old_pack_nibbles(a):
+    packed = array("B",
+                   (((y & 0xf) << 4) | (x & 0xf) for x, y in grouper(2, a)))
+    return packed.tostring()
+
+def old_segment_array(a):
+    l = [array(a.typecode) for chaff in range(16)]
+    index = 0
+
+    for i in range(0, len(a), 16):
+        l[index].extend(a[i:i + 16])
+        index = (index + 1) % 16
+
+    return l
+
+def timed(f):
+    def wrapped(*args, **kwargs):
+        before = time.time()
+        f(*args, **kwargs)
+        return (time.time() - before) * 1000
+    return wrapped
+
+packed = [array("B", [randint(0, 255) for i in range(2048)]).tostring()
+          for chaff in range(16 * 3)]
+unpacked = [unpack_nibbles(s) for s in packed]
+lightmap = array("B", [randint(0, 15) for i in range(16 * 16 * 256)])
+
+@timed
+def unpack_chunk(f):
+    for s in packed:
+        f(s)
+
+@timed
+def pack_chunk(f):
+    for a in unpacked:
+        f(a)
+
+@timed
+def segment_chunk(f):
+    f(lightmap)
+
+def without_numpy(f):
+    def wrapped(*args, **kwargs):
+        saved = bits.numpy, chunk.numpy
+        bits.numpy = chunk.numpy = None
+        try:
+            return f(*args, **kwargs)
+        finally:
+            bits.numpy, chunk.numpy = saved
+    return wrapped
+
+cases = [
+    ("unpack", unpack_chunk, old_unpack_nibbles, unpack_nibbles),
+    ("pack", pack_chunk, old_pack_nibbles, pack_nibbles),
+    ("segment", segment_chunk, old_segment_array, segment_array),
+]
+
+benchmarks = []
+for name, bench, old, new in cases:
+    def bench_old(name=name, bench=bench, old=old):
+        l = [bench(old) for i in xrange(25)]
+        return ("nibbles_%s_old" % name), l
+
+    def bench_new(name=name, bench=bench, new=new):
+        l = [bench(new) for i in xrange(25)]
+        return ("nibbles_%s" % name), l
+
+    @without_numpy
+    def bench_pure(name=name, bench=bench, new=new):
+        l = [bench(new) for i in xrange(25)]
+        return ("nibbles_%s_pure" % name), l
+
+    benchmarks.extend([bench_old, bench_new, bench_pure])
+
+if __name__ == "__main__":
+    for benchmark in benchmarks:
+        name, l = benchmark()
+        print "%s: %.3fms per chunk" % (name, sum(l) / len(l))
@@ -0,0 +1,96 @@
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
+
+class ChunkPacketCache(object):
+    """
+    A cache of encoded chunk packets.
+
+    Encoding a chunk packet means packing and compressing the entire chunk,
+    which is expensive, and every player which loads a chunk needs the same
+    packet. This cache keeps the most recently used packets, keyed by chunk
+    coordinates, along with the version of the chunk they were made from; a
+    cached packet is only handed out while its chunk is still at that
+    version.
+
+    The cache is bounded by the total size of the packets in it. The least
+    recently used packets are evicted first.
+
+    :ivar int hits: the number of packets served from the cache
+    :ivar int misses: the number of packets which had to be encoded
+    :ivar int evictions: the number of packets evicted to make room
+    """
+
+    def __init__(self, limit):
+        """
+        :param int limit: the maximum size of the cache, in bytes; zero
+            disables caching entirely
+        """
+
+        self.limit = limit
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._packets = OrderedDict()
+
+    def __len__(self):
+        return len(self._packets)
+
+    def packet_for(self, chunk):
+        """
+        Get a chunk packet for a chunk, encoding it if necessary.
+
+        :param `Chunk` chunk: the chunk
+        :returns: the chunk packet, as a string
+        """
+
+        key = chunk.x, chunk.z
+
+        entry = self._packets.pop(key, None)
+        if entry is not None:
+            version, packet = entry
+            if version == chunk.version:
+                # Put it back at the most recently used end.
+                self._packets[key] = entry
+                self.hits += 1
+                return packet
+            self.size -= len(packet)
+
+        self.misses += 1
+
+        version = chunk.version
+        packet = chunk.save_to_packet()
+
+        if len(packet) <= self.limit:
+            self._packets[key] = version, packet
+            self.size += len(packet)
+            self._evict()
+
+        return packet
+
+    def discard(self, chunk):
+        """
+        Drop any packet cached for a chunk.
+        """
+
+        entry = self._packets.pop((chunk.x, chunk.z), None)
+        if entry is not None:
+            self.size -= len(entry[1])
+
+    def clear(self):
+        """
+        Drop every packet in the cache.
+        """
+
+        self._packets.clear()
+        self.size = 0
+
+    def _evict(self):
+        while self.size > self.limit:
+            key, (version, packet) = self._packets.popitem(last=False)
+            self.size -= len(packet)
+            self.evictions += 1
@@ -9,7 +9,9 @@ from twisted.internet.task import LoopingCall
 from twisted.python import log
 from zope.interface import implements
 
+from bravo.beta.cache import ChunkPacketCache
 from bravo.beta.packets import make_packet
+from bravo.beta.prefetch import ChunkPrefetcher
 from bravo.beta.protocol import BravoProtocol, KickedProtocol
 from bravo.entity import entities
 from bravo.ibravo import (ISortedPlugin, IAutomaton, ITerrainGenerator,
@@ -48,6 +50,12 @@ class BravoFactory(Factory):
 
     interfaces = []
 
+    stopping = None
+    """
+    A ``Deferred`` which fires once the world has been saved, after the
+    factory has been stopped.
+    """
+
     def __init__(self, config, name):
         """
         Create a factory and world.
@@ -78,6 +86,19 @@ class BravoFactory(Factory):
         self.limitPerIP = self.config.getintdefault(self.config_name,
                                                       "limitPerIP", 0)
 
+        # Chunk packets are shared between all players; the size of the cache
+        # is configured in KiB.
+        packet_cache = self.config.getintdefault(self.config_name,
+                                                 "packet_cache", 4096)
+        self.chunk_packets = ChunkPacketCache(packet_cache * 1024)
+
+        # Chunks are loaded ahead of fast players; see ChunkPrefetcher.
+        lookahead = self.config.getintdefault(self.config_name, "prefetch", 4)
+        limit = self.config.getintdefault(self.config_name, "prefetch_limit",
+                                          8)
+        self.prefetcher = ChunkPrefetcher(self.world, self.chunk_packets,
+                                          lookahead, limit)
+
         self.vane = WeatherVane(self)
 
     def startFactory(self):
@@ -131,10 +152,17 @@ class BravoFactory(Factory):
         # world.
         self.world.time = self.time
 
-        # And now stop the world.
-        self.world.stop()
+        # And now stop the world. Saving finishes later, so let whoever is
+        # stopping us wait for it.
+        self.stopping = self.world.stop()
+
+        @self.stopping.addCallback
+        def saved(none):
+            log.msg("World data saved!")
 
-        log.msg("World data saved!")
+        self.stopping.addErrback(log.err, "Couldn't save world data")
+
+        return self.stopping
 
     def buildProtocol(self, addr):
         """
@@ -496,7 +524,12 @@ class BravoFactory(Factory):
         """
 
         if chunk.is_damaged():
-            packet = chunk.get_damage_packet()
+            if chunk.all_damaged:
+                # The whole chunk is being resent, so share the packet with
+                # anybody else who needs the chunk.
+                packet = self.chunk_packets.packet_for(chunk)
+            else:
+                packet = chunk.get_damage_packet()
             for player in self.protocols.itervalues():
                 if (chunk.x, chunk.z) in player.chunks:
                     player.transport.write(packet)
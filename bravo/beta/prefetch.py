@@ -0,0 +1,242 @@
+from collections import deque
+
+from twisted.internet.defer import CancelledError
+from twisted.python import log
+
+from bravo.utilities.maths import circling, sorted_by_distance
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
+
+PRIORITY = 1 << 16
+"""
+The priority which chunks are prefetched at.
+
+Players' own chunks are scheduled by their squared distance from the player,
+which never comes near this, so prefetches wait behind every chunk which
+somebody actually needs.
+"""
+
+class ChunkPrefetcher(object):
+    """
+    Loads chunks ahead of fast players.
+
+    Players only ask for chunks once they've moved within sight of them, which
+    is too late for players who are moving quickly, in minecarts or flying;
+    they outrun their chunks. The prefetcher keeps a short trail of where each
+    player has been, guesses from it where they'll be a few seconds later,
+    and warms the world's chunk cache, and the packet cache, with the chunks
+    they'll be able to see from there.
+
+    Prefetching is held to a budget: only a few chunks are prefetched at
+    once, and they wait behind every other chunk request in the world's
+    scheduler. Players who are walking can't outrun their chunks, so they
+    aren't prefetched for at all.
+
+    A prefetched chunk is used if a player asks for it before it expires, and
+    wasted otherwise.
+
+    :ivar int prefetched: the number of chunks prefetched
+    :ivar int used: the number of prefetched chunks which players asked for
+    :ivar int wasted: the number of prefetched chunks which nobody asked for
+    :ivar int cancelled: the number of prefetches cancelled because their
+        players turned away
+    """
+
+    def __init__(self, world, packets=None, lookahead=4, limit=8, speed=6,
+                 expiry=30, window=2):
+        """
+        :param `World` world: the world to load chunks from
+        :param `ChunkPacketCache` packets: the packet cache to warm, if any
+        :param float lookahead: how far ahead, in seconds, to guess where
+            players will be; zero disables prefetching
+        :param int limit: the most chunks to prefetch at once
+        :param float speed: the slowest speed, in blocks per second, which
+            players are prefetched for
+        :param float expiry: how long, in seconds, prefetched chunks have to
+            be asked for before they're counted as wasted
+        :param float window: how much of each player's trail, in seconds, to
+            guess their velocity from
+        """
+
+        self.world = world
+        self.packets = packets
+        self.lookahead = lookahead
+        self.limit = limit
+        self.speed = speed
+        self.expiry = expiry
+        self.window = window
+
+        self.prefetched = 0
+        self.used = 0
+        self.wasted = 0
+        self.cancelled = 0
+
+        self._trails = {}
+        self._pending = {}
+        self._warm = OrderedDict()
+
+    @property
+    def accuracy(self):
+        """
+        The fraction of prefetched chunks which were used, out of those which
+        have been either used or wasted.
+        """
+
+        judged = self.used + self.wasted
+        return self.used / float(judged) if judged else 0.0
+
+    @property
+    def pending(self):
+        """
+        The number of chunks being prefetched.
+        """
+
+        return len(self._pending)
+
+    def velocity(self, who):
+        """
+        Guess a player's velocity from their trail.
+
+        :returns: a tuple of the X and Z velocities, in blocks per second, or
+            None if there isn't enough of a trail yet
+        """
+
+        trail = self._trails.get(who)
+        if not trail or len(trail) < 2:
+            return None
+
+        (t1, x1, z1), (t2, x2, z2) = trail[0], trail[-1]
+        if t2 <= t1:
+            return None
+
+        return (x2 - x1) / (t2 - t1), (z2 - z1) / (t2 - t1)
+
+    def predict(self, who, radius):
+        """
+        Work out which chunks a player will need soon.
+
+        :param int radius: how far the player can see, in chunks
+        :returns: a list of chunk coordinates, nearest to the player first,
+            which the player will be able to see after ``lookahead`` seconds
+            but can't see yet
+        """
+
+        velocity = self.velocity(who)
+        if velocity is None:
+            return []
+
+        vx, vz = velocity
+        if vx ** 2 + vz ** 2 < self.speed ** 2:
+            return []
+
+        t, x, z = self._trails[who][-1]
+        bigx, bigz = int(x // 16), int(z // 16)
+        aheadx = int((x + vx * self.lookahead) // 16)
+        aheadz = int((z + vz * self.lookahead) // 16)
+
+        seen = set(circling(bigx, bigz, radius))
+        ahead = [key for key in circling(aheadx, aheadz, radius)
+                 if key not in seen]
+        return sorted_by_distance(ahead, bigx, bigz)
+
+    def moved(self, who, position, radius):
+        """
+        Note where a player is, and prefetch ahead of them.
+
+        :param who: the player; anything hashable will do
+        :param `Position` position: where the player is
+        :param int radius: how far the player can see, in chunks
+        """
+
+        if not self.lookahead:
+            return
+
+        now = self.world.clock.seconds()
+        x, y, z = position.to_player()
+
+        trail = self._trails.setdefault(who, deque())
+        trail.append((now, x, z))
+        while now - trail[0][0] > self.window:
+            trail.popleft()
+
+        self._expire(now)
+
+        wanted = self.predict(who, radius)
+
+        # Stop prefetching whatever this player has turned away from.
+        keep = set(wanted)
+        for key, (owner, d) in self._pending.items():
+            if owner is who and key not in keep:
+                d.cancel()
+
+        x, z = position.to_chunk()
+        for key in wanted:
+            if len(self._pending) >= self.limit:
+                break
+            if key in self._pending or key in self._warm:
+                continue
+            distance = (key[0] - x) ** 2 + (key[1] - z) ** 2
+            self._prefetch(who, key, PRIORITY + distance)
+
+    def claim(self, x, z):
+        """
+        Note that a player has asked for a chunk.
+        """
+
+        key = x, z
+        if key in self._pending:
+            # The player's request and ours are the same request now, so let
+            # it carry on.
+            del self._pending[key]
+            self.used += 1
+        elif key in self._warm:
+            del self._warm[key]
+            self.used += 1
+
+    def forget(self, who):
+        """
+        Stop prefetching for a player.
+        """
+
+        self._trails.pop(who, None)
+        for key, (owner, d) in self._pending.items():
+            if owner is who:
+                d.cancel()
+
+    def _prefetch(self, who, key, priority):
+        d = self.world.schedule_chunk(key[0], key[1], priority)
+        if d.called:
+            # Already in memory; nothing to do.
+            return
+
+        self.prefetched += 1
+        self._pending[key] = who, d
+        d.addCallbacks(self._loaded, self._failed, callbackArgs=(key,),
+                       errbackArgs=(key,))
+
+    def _loaded(self, chunk, key):
+        if self._pending.pop(key, None) is None:
+            # Somebody already asked for it.
+            return
+
+        self._warm[key] = self.world.clock.seconds()
+        if self.packets is not None and self.packets.limit:
+            self.packets.packet_for(chunk)
+
+    def _failed(self, failure, key):
+        self._pending.pop(key, None)
+        if failure.check(CancelledError):
+            self.cancelled += 1
+        else:
+            log.err(failure, "Couldn't prefetch chunk %d, %d" % key)
+
+    def _expire(self, now):
+        while self._warm:
+            key, when = next(self._warm.iteritems())
+            if now - when < self.expiry:
+                break
+            del self._warm[key]
+            self.wasted += 1
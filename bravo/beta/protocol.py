@@ -6,11 +6,10 @@ from time import time
 from urlparse import urlunparse
 
 from twisted.internet import reactor
-from twisted.internet.defer import (DeferredList, inlineCallbacks,
-                                    maybeDeferred, succeed)
+from twisted.internet.defer import (CancelledError, DeferredList,
+                                    inlineCallbacks, maybeDeferred, succeed)
 from twisted.internet.protocol import Protocol, connectionDone
-from twisted.internet.task import cooperate, deferLater, LoopingCall
-from twisted.internet.task import TaskDone, TaskFailed
+from twisted.internet.task import deferLater, LoopingCall
 from twisted.protocols.policies import TimeoutMixin
 from twisted.python import log
 from twisted.web.client import getPage
@@ -68,6 +67,7 @@ class BetaServerProtocol(object, Protocol, TimeoutMixin):
 
     def __init__(self):
         self.chunks = dict()
+        self.chunk_requests = dict()
         self.windows = {}
         self.wid = 1
 
@@ -701,8 +701,6 @@ class BravoProtocol(BetaServerProtocol):
     something very much like it.
     """
 
-    chunk_tasks = None
-
     time_loop = None
 
     eid = 0
@@ -1313,12 +1311,21 @@ class BravoProtocol(BetaServerProtocol):
 
         log.msg("Disabling chunk %d, %d" % key)
 
+        if key in self.chunk_requests:
+            # We never got the chunk, so there's nothing to clear on the
+            # client; just stop waiting on it.
+            self.chunk_requests.pop(key).cancel()
+            self.factory.world.release_chunk(x, z)
+            return
+
         if key not in self.chunks:
             log.msg("...But the chunk wasn't loaded!")
             return
 
-        # Remove the chunk from cache.
+        # Remove the chunk from cache, and let the world know that we're done
+        # with it.
         chunk = self.chunks.pop(key)
+        self.factory.world.release_chunk(x, z)
 
         eids = [e.eid for e in chunk.entities]
 
@@ -1328,37 +1335,56 @@ class BravoProtocol(BetaServerProtocol):
         self.write_packet("chunk", x=x, z=z, continuous=False, primary=0x0,
                 add=0x0, data="")
 
-    def enable_chunk(self, x, z):
+    def enable_chunk(self, x, z, priority=0):
         """
         Request a chunk.
 
         This function will asynchronously obtain the chunk, and send it on the
         wire.
 
+        :param priority: how urgently the chunk is needed, for the world's
+            scheduler; lower is sooner
         :returns: `Deferred` that will be fired when the chunk is obtained,
                   with no arguments
         """
 
         log.msg("Enabling chunk %d, %d" % (x, z))
 
-        if (x, z) in self.chunks:
+        key = x, z
+
+        if key in self.chunks or key in self.chunk_requests:
             log.msg("...But the chunk was already loaded!")
             return succeed(None)
 
-        d = self.factory.world.request_chunk(x, z)
+        # Keep the chunk in memory for as long as we can see it. Taking the
+        # ticket now, rather than once the chunk shows up, lets the world
+        # know that somebody is waiting on the chunk.
+        self.factory.world.acquire_chunk(x, z)
+
+        d = self.factory.world.schedule_chunk(x, z, priority)
+        self.chunk_requests[key] = d
 
         @d.addCallback
         def cb(chunk):
-            self.chunks[x, z] = chunk
-            return chunk
-        d.addCallback(self.send_chunk)
+            if self.chunk_requests.pop(key, None) is None:
+                # We moved away while it was loading, and already gave back
+                # our ticket.
+                return
+            self.chunks[key] = chunk
+            self.send_chunk(chunk)
+
+        @d.addErrback
+        def eb(failure):
+            if self.chunk_requests.pop(key, None) is not None:
+                self.factory.world.release_chunk(x, z)
+            failure.trap(CancelledError)
 
         return d
 
     def send_chunk(self, chunk):
         log.msg("Sending chunk %d, %d" % (chunk.x, chunk.z))
 
-        packet = chunk.save_to_packet()
+        packet = self.factory.chunk_packets.packet_for(chunk)
         self.transport.write(packet)
 
         for entity in chunk.entities:
@@ -1433,30 +1459,31 @@ class BravoProtocol(BetaServerProtocol):
         radius = distances.get(self.settings.distance, 8)
 
         new = set(circling(x, z, radius))
-        old = set(self.chunks.iterkeys())
+        old = set(self.chunks) | set(self.chunk_requests)
         added = new - old
         discarded = old - new
 
-        # Perhaps some explanation is in order.
-        # The cooperate() function iterates over the iterable it is fed,
-        # without tying up the reactor, by yielding after each iteration. The
-        # inner part of the generator expression generates all of the chunks
-        # around the currently needed chunk, and it sorts them by distance to
-        # the current chunk. The end result is that we load chunks one-by-one,
-        # nearest to furthest, without stalling other clients.
-        if self.chunk_tasks:
-            for task in self.chunk_tasks:
-                try:
-                    task.stop()
-                except (TaskDone, TaskFailed):
-                    pass
-
-        to_enable = sorted_by_distance(added, x, z)
-
-        self.chunk_tasks = [
-            cooperate(self.enable_chunk(i, j) for i, j in to_enable),
-            cooperate(self.disable_chunk(i, j) for i, j in discarded),
-        ]
+        def distance(key):
+            return (key[0] - x) ** 2 + (key[1] - z) ** 2
+
+        for i, j in discarded:
+            self.disable_chunk(i, j)
+
+        # Every chunk goes through the world's scheduler, which loads chunks
+        # nearest first, across every player, a few at a time, without
+        # stalling other clients. Chunks which we're still waiting on have
+        # gotten nearer or further away.
+        scheduler = self.factory.world.scheduler
+        for key, d in self.chunk_requests.iteritems():
+            scheduler.prioritize(d, distance(key))
+
+        prefetcher = self.factory.prefetcher
+        for i, j in sorted_by_distance(added, x, z):
+            prefetcher.claim(i, j)
+            self.enable_chunk(i, j, distance((i, j)))
+
+        # And get a head start on the chunks we're headed for.
+        prefetcher.moved(self, self.location.pos, radius)
 
     def update_time(self):
         time = int(self.factory.time)
@@ -1489,6 +1516,19 @@ class BravoProtocol(BetaServerProtocol):
             self.factory.chat("%s has left the game." % self.username)
 
         self.factory.teardown_protocol(self)
+        self.factory.prefetcher.forget(self)
+
+        # Stop waiting on the chunks which haven't shown up yet, as in
+        # disable_chunk(), and let go of all of our chunks.
+        requests = self.chunk_requests.items()
+        self.chunk_requests.clear()
+        for (x, z), d in requests:
+            d.cancel()
+            self.factory.world.release_chunk(x, z)
+
+        for x, z in self.chunks:
+            self.factory.world.release_chunk(x, z)
+        self.chunks.clear()
 
         # We are now torn down. After this point, there will be no more
         # factory stuff, just our own personal stuff.
@@ -1497,9 +1537,3 @@ class BravoProtocol(BetaServerProtocol):
         if self.time_loop:
             self.time_loop.stop()
 
-        if self.chunk_tasks:
-            for task in self.chunk_tasks:
-                try:
-                    task.stop()
-                except (TaskDone, TaskFailed):
-                    pass
@@ -1,15 +1,34 @@
 from array import array
+from contextlib import contextmanager
+from copy import copy, deepcopy
 from functools import wraps
-from itertools import product
-from struct import pack
+from itertools import count
+from numbers import Integral
+import sys
 from warnings import warn
 
-from bravo.blocks import blocks, glowing_blocks
+from bravo.blocks import blocks
 from bravo.beta.packets import make_packet
-from bravo.geometry.section import Section
-from bravo.utilities.bits import pack_nibbles
-from bravo.utilities.coords import CHUNK_HEIGHT, XZ, iterchunk
-from bravo.utilities.maths import clamp
+from bravo.geometry.damage import Damage
+from bravo.geometry.section import Section, column_tops, filled
+from bravo.lighting import Lighting
+from bravo.utilities.coords import CHUNK_HEIGHT, XZ
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# The widest array typecode which evenly divides a run of sixteen bytes.
+WORD = "L" if array("L").itemsize == 8 else "I"
+
+# An array typecode for unsigned 32-bit integers.
+UINT32 = "I" if array("I").itemsize == 4 else "L"
+
+# Chunk versions are drawn from a single counter, so that no two states of
+# any chunks, even chunks which were unloaded and loaded again, share a
+# version.
+versions = count()
 
 class ChunkWarning(Warning):
     """
@@ -58,129 +77,80 @@ def segment_array(a):
     Chop up a chunk-sized array into sixteen components.
 
     The chops are done in order to produce the smaller chunks preferred by
-    modern clients.
-    """
-
-    l = [array(a.typecode) for chaff in range(16)]
-    index = 0
-
-    for i in range(0, len(a), 16):
-        l[index].extend(a[i:i + 16])
-        index = (index + 1) % 16
-
-    return l
-
-def make_glows():
-    """
-    Set up glow tables.
-
-    These tables provide glow maps for illuminated points.
-    """
-
-    glow = [None] * 16
-    for i in range(16):
-        dim = 2 * i + 1
-        glow[i] = array("b", [0] * (dim**3))
-        for x, y, z in product(xrange(dim), repeat=3):
-            distance = abs(x - i) + abs(y - i) + abs(z - i)
-            glow[i][(x * dim + y) * dim + z] = i + 1 - distance
-        glow[i] = array("B", [clamp(x, 0, 15) for x in glow[i]])
-    return glow
-
-glow = make_glows()
-
-def composite_glow(target, strength, x, y, z):
-    """
-    Composite a light source onto a lightmap.
-
-    The exact operation is not quite unlike an add.
-    """
-
-    ambient = glow[strength]
-
-    xbound, zbound, ybound = 16, CHUNK_HEIGHT, 16
-
-    sx = x - strength
-    sy = y - strength
-    sz = z - strength
-
-    ex = x + strength
-    ey = y + strength
-    ez = z + strength
-
-    si, sj, sk = 0, 0, 0
-    ei, ej, ek = strength * 2, strength * 2, strength * 2
+    modern clients. Every run of sixteen entries goes to the next component
+    in turn, wrapping around after the sixteenth.
 
-    if sx < 0:
-        sx, si = 0, -sx
-
-    if sy < 0:
-        sy, sj = 0, -sy
-
-    if sz < 0:
-        sz, sk = 0, -sz
-
-    if ex > xbound:
-        ex, ei = xbound, ei - ex + xbound
-
-    if ey > ybound:
-        ey, ej = ybound, ej - ey + ybound
-
-    if ez > zbound:
-        ez, ek = zbound, ek - ez + zbound
-
-    adim = 2 * strength + 1
-
-    # Composite! Apologies for the loops.
-    for (tx, ax) in zip(range(sx, ex), range(si, ei)):
-        for (tz, az) in zip(range(sz, ez), range(sk, ek)):
-            for (ty, ay) in zip(range(sy, ey), range(sj, ej)):
-                ambient_index = (ax * adim + az) * adim + ay
-                target[ci(tx, ty, tz)] += ambient[ambient_index]
-
-def iter_neighbors(coords):
-    """
-    Iterate over the chunk-local coordinates surrounding the given
-    coordinates.
-
-    All coordinates are chunk-local.
-
-    Coordinates which are not valid chunk-local coordinates will not be
-    generated.
+    The chopping is done for the whole array at once, with NumPy if it is
+    available, and with strided slices over whole machine words otherwise.
     """
 
-    x, z, y = coords
-
-    for dx, dz, dy in (
-        (1, 0, 0),
-        (-1, 0, 0),
-        (0, 1, 0),
-        (0, -1, 0),
-        (0, 0, 1),
-        (0, 0, -1)):
-        nx = x + dx
-        nz = z + dz
-        ny = y + dy
-
-        if not (0 <= nx < 16 and
-            0 <= nz < 16 and
-            0 <= ny < CHUNK_HEIGHT):
-            continue
-
-        yield nx, nz, ny
+    if not a or len(a) % 256:
+        # Empty and ragged arrays can't be chopped in bulk; do it a run at a
+        # time.
+        l = [array(a.typecode) for chaff in range(16)]
+        for index, i in enumerate(range(0, len(a), 16)):
+            l[index % 16].extend(a[i:i + 16])
+        return l
+
+    # Each run of sixteen entries is this many bytes long.
+    run = 16 * a.itemsize
+
+    if numpy is not None:
+        # Move whole 64-bit words; moving single bytes is far slower.
+        words = numpy.frombuffer(a, dtype=numpy.uint64)
+        runs = words.reshape(-1, 16, run // 8)
+        s = runs.transpose(1, 0, 2).tostring()
+        size = len(s) // 16
+        return [array(a.typecode, s[i:i + size])
+                for i in range(0, len(s), size)]
+
+    # Reinterpret the array as words, so that every run is a few words, and
+    # gather each word of each run with a single strided slice.
+    words = array(WORD, a.tostring())
+    width = run // words.itemsize
+    l = []
+    for index in range(16):
+        segment = array(WORD, [0]) * (len(words) // 16)
+        for offset in range(width):
+            segment[offset::width] = words[index * width + offset::16 * width]
+        l.append(array(a.typecode, segment.tostring()))
+    return l
 
-def neighboring_light(glow, block):
+def damage_records(section, index, indices):
     """
-    Calculate the amount of light that should be shone on a block.
+    Encode the records of a batch packet for some damaged blocks of a
+    section.
 
-    ``glow`` is the brighest neighboring light. ``block`` is the slot of the
-    block being illuminated.
+    Each record is a big-endian 32-bit integer holding a block's coordinates,
+    type, and metadata. All of the records are built at once, with NumPy if
+    it is available.
 
-    The return value is always a valid light value.
+    :param `Section` section: the section
+    :param int index: which section of the chunk this is
+    :param list indices: the damaged section indices
+    :returns: the records, as a string
     """
 
-    return clamp(glow - blocks[block].dim, 0, 15)
-
+    blocks = section.take_blocks(indices)
+    metadata = section.take_metadata(indices)
+    base = index * 16
+
+    if numpy is not None:
+        where = numpy.asarray(indices, dtype=numpy.uint32)
+        blocks = numpy.frombuffer(blocks, dtype=numpy.uint8)
+        metadata = numpy.frombuffer(metadata, dtype=numpy.uint8)
+        records = ((where & 0xf) << 28 | (where >> 4 & 0xf) << 24 |
+                   ((where >> 8) + base) << 16 |
+                   blocks.astype(numpy.uint32) << 4 | metadata)
+        return records.astype(">u4").tostring()
+
+    records = array(UINT32, [
+        (i & 0xf) << 28 | (i >> 4 & 0xf) << 24 | ((i >> 8) + base) << 16 |
+        block << 4 | meta
+        for i, block, meta in zip(indices, blocks, metadata)])
+    if sys.byteorder == "little":
+        records.byteswap()
+    return records.tostring()
 
 class Chunk(object):
     """
@@ -194,6 +164,8 @@ class Chunk(object):
     :cvar bool dirty: Whether this chunk needs to be flushed to disk.
     :cvar bool populated: Whether this chunk has had its initial block data
         filled out.
+    :ivar int version: Changes every time this chunk changes, for keeping
+        caches of things made from chunks, like packets.
     """
 
     all_damaged = False
@@ -204,12 +176,32 @@ class Chunk(object):
     Optional hook to be called when this chunk becomes dirty.
     """
 
+    lookup = None
+    """
+    Optional hook to look up other loaded chunks by chunk coordinates, so that
+    light can cross chunk borders. It should return None for chunks which
+    aren't loaded.
+    """
+
     _dirty = True
     """
     Internal flag describing whether the chunk is dirty. Don't touch directly;
     use the ``dirty`` property instead.
     """
 
+    resend_cost = 704
+    """
+    The estimated cost, in bytes, of resending each section with blocks in it
+    when the entire chunk is resent. Each damaged block costs four bytes to
+    send on its own; once sending the damage would cost more than resending,
+    the whole chunk is resent instead.
+    """
+
+    _batches = 0
+    """
+    How deeply nested the batch in progress is, or zero if there isn't one.
+    """
+
     def __init__(self, x, z):
         """
         :param int x: X coordinate in chunk coords
@@ -226,19 +218,57 @@ class Chunk(object):
         self.x = int(x)
         self.z = int(z)
 
+        self.version = next(versions)
+
         self.heightmap = array("B", [0] * (16 * 16))
-        self.blocklight = array("B", [0] * (16 * 16 * CHUNK_HEIGHT))
 
         self.sections = [Section() for i in range(16)]
 
         self.entities = set()
         self.tiles = {}
 
-        self.damaged = set()
+        self.damaged = Damage()
+
+    def __getstate__(self):
+        # The hooks belong to whoever is holding onto this chunk, not to the
+        # chunk, so don't drag them along into copies.
+        state = self.__dict__.copy()
+        state.pop("dirtied", None)
+        state.pop("lookup", None)
+        return state
 
     def __repr__(self):
         return "Chunk(%d, %d)" % (self.x, self.z)
 
+    def snapshot(self):
+        """
+        Take a snapshot of this chunk.
+
+        The snapshot is a chunk which has the blocks, light, tiles, and
+        entities that this chunk has right now, and the same version. Its
+        sections share their arrays with this chunk's sections until either
+        chunk writes to them, so snapshots are cheap to take, and can be
+        handed to anything which wants to look at a chunk without stopping
+        it from changing, like savers and map renderers.
+
+        Tiles and entities are copied deeply, inventories and all, since
+        they're small and change in place.
+
+        Snapshots don't have hooks, damage, or batches in progress.
+        """
+
+        chunk = copy(self)
+        for name in ("_batches", "_changed", "_damaged", "all_damaged"):
+            chunk.__dict__.pop(name, None)
+
+        chunk.heightmap = array("B", self.heightmap)
+        chunk.sections = [section.snapshot() for section in self.sections]
+        chunk.entities = deepcopy(self.entities)
+        chunk.tiles = deepcopy(self.tiles)
+        chunk.damaged = Damage()
+
+        return chunk
+
     __str__ = __repr__
 
     @property
@@ -247,12 +277,90 @@ class Chunk(object):
 
     @dirty.setter
     def dirty(self, value):
-        if value and not self._dirty:
-            # Notify whoever cares.
-            if self.dirtied is not None:
-                self.dirtied(self)
+        if value:
+            self.touch()
+            if not self._dirty:
+                # Notify whoever cares.
+                if self.dirtied is not None:
+                    self.dirtied(self)
         self._dirty = value
 
+    def touch(self):
+        """
+        Note that this chunk has changed.
+
+        The chunk's version is bumped, which invalidates anything cached from
+        the chunk. Marking the chunk dirty also touches it, as do all of the
+        chunk's mutators, so this only needs to be called by code which
+        writes to sections directly.
+        """
+
+        self.version = next(versions)
+
+    def begin(self):
+        """
+        Start a batch of changes.
+
+        Until the batch is committed, changing blocks only changes the blocks.
+        The height map, lighting, and damage are caught up once, for every
+        change at once, by ``commit()``, rather than once per change. This is
+        much faster for large edits, like growing trees.
+
+        Batches can be nested; only committing the outermost batch catches
+        up.
+        """
+
+        if not self._batches:
+            self._changed = set()
+            self._damaged = set()
+        self._batches += 1
+
+    def commit(self):
+        """
+        Finish a batch of changes, and catch up on everything which was put
+        off during the batch.
+        """
+
+        if not self._batches:
+            warn("Committing %s without a batch, ignoring call" % self,
+                ChunkWarning, stacklevel=2)
+            return
+
+        self._batches -= 1
+        if self._batches:
+            return
+
+        changed, damaged = self._changed, self._damaged
+        del self._changed, self._damaged
+
+        if changed:
+            for x, z in set((x, z) for x, y, z in changed):
+                column = self.get_block_column(x, z).tostring()
+                height = len(column.rstrip("\x00")) - 1
+                self.heightmap[x * 16 + z] = max(height, 0)
+
+            Lighting(self).update_many([(self.x * 16 + x, y, self.z * 16 + z)
+                                        for x, y, z in changed])
+
+        if damaged:
+            self.dirty = True
+            for coords in damaged:
+                self.damage(coords)
+
+    @contextmanager
+    def batch(self):
+        """
+        Make a batch of changes in a ``with`` block.
+
+        The batch is committed when the block is left, even if it raised.
+        """
+
+        self.begin()
+        try:
+            yield self
+        finally:
+            self.commit()
+
     def regenerate_heightmap(self):
         """
         Regenerate the height map array.
@@ -261,73 +369,41 @@ class Chunk(object):
         xz-column.
         """
 
-        for x in range(16):
-            for z in range(16):
-                column = x * 16 + z
-                for y in range(255, -1, -1):
-                    if self.get_block((x, y, z)):
-                        break
+        # Scan sections from the top down, skipping the empty ones, until
+        # every column has found its top.
+        tops = column_tops(self.sections)
 
-                self.heightmap[column] = y
+        self.heightmap = array("B", [max(tops[z * 16 + x], 0)
+                                     for x, z in XZ])
 
     def regenerate_blocklight(self):
-        lightmap = array("L", [0] * (16 * 16 * CHUNK_HEIGHT))
+        """
+        Regenerate the block light map.
 
-        for x, z, y in iterchunk():
-            block = self.get_block((x, y, z))
-            if block in glowing_blocks:
-                composite_glow(lightmap, glowing_blocks[block], x, y, z)
+        Block light is the light which comes from glowing blocks, like
+        torches, rather than from the sky.
+        """
 
-        self.blocklight = array("B", [clamp(x, 0, 15) for x in lightmap])
+        Lighting(self).regenerate_blocklight()
 
     def regenerate_skylight(self):
         """
         Regenerate the ambient light map.
 
         Each block's individual light comes from two sources. The ambient
-        light comes from the sky.
-
-        The height map must be valid for this method to produce valid results.
+        light comes from the sky, falling straight down until it hits
+        something, and then spreading sideways under overhangs and into caves.
         """
 
-        # Create an array of skylights, and a mask of dimming blocks.
-        lights = [0xf] * (16 * 16)
-        mask = [0x0] * (16 * 16)
-
-        # For each y-level, we're going to update the mask, apply it to the
-        # lights, apply the lights to the section, and then blur the lights
-        # and move downwards. Since empty sections are full of air, and air
-        # doesn't ever dim, ignoring empty sections should be a correct way
-        # to speed things up. Another optimization is that the process ends
-        # early if the entire slice of lights is dark.
-        for section in reversed(self.sections):
-            if not section:
-                continue
-
-            for y in range(15, -1, -1):
-                # Early-out if there's no more light left.
-                if not any(lights):
-                    break
-
-                # Update the mask.
-                for x, z in XZ:
-                    offset = x * 16 + z
-                    block = section.get_block((x, y, z))
-                    mask[offset] = blocks[block].dim
+        Lighting(self).regenerate_skylight()
 
-                # Apply the mask to the lights.
-                for i, dim in enumerate(mask):
-                    # Keep it positive.
-                    lights[i] = max(0, lights[i] - dim)
-
-                # Apply the lights to the section.
-                for x, z in XZ:
-                    offset = x * 16 + z
-                    section.set_skylight((x, y, z), lights[offset])
-
-                # XXX blur the lights
+    def relight_borders(self):
+        """
+        Spread light across the borders between this chunk and its loaded
+        neighbors, for a chunk which was lit without them.
+        """
 
-                # And continue moving downward.
+        Lighting(self).relight_borders()
 
     def regenerate(self):
         """
@@ -348,15 +424,17 @@ class Chunk(object):
         if self.all_damaged:
             return
 
-        x, y, z = coords
-
         self.damaged.add(coords)
 
-        # The number 176 represents the threshold at which it is cheaper to
-        # resend the entire chunk instead of individual blocks.
-        if len(self.damaged) > 176:
-            self.all_damaged = True
-            self.damaged.clear()
+        # Check whether it has become cheaper to resend the entire chunk
+        # instead of individual blocks. Even the emptiest chunk costs a
+        # section to resend, so don't bother counting sections until then.
+        cost = len(self.damaged) * 4
+        if cost > self.resend_cost:
+            sections = sum(1 for section in self.sections if section)
+            if cost > self.resend_cost * max(sections, 1):
+                self.all_damaged = True
+                self.damaged.clear()
 
     def is_damaged(self):
         """
@@ -400,8 +478,7 @@ class Chunk(object):
             # Send nothing at all; we don't even have a scratch on us.
             return ""
         elif len(self.damaged) == 1:
-            # Use a single block update packet. Find the first (only) set bit
-            # in the damaged array, and use it as an index.
+            # Use a single block update packet.
             coords = next(iter(self.damaged))
 
             block = self.get_block(coords)
@@ -416,22 +493,12 @@ class Chunk(object):
                     type=block,
                     meta=metadata)
         else:
-            # Use a batch update.
-            records = []
-
-            for coords in self.damaged:
-                block = self.get_block(coords)
-                metadata = self.get_metadata(coords)
-
-                x, y, z = coords
-
-                record = x << 28 | z << 24 | y << 16 | block << 4 | metadata
-                records.append(record)
-
-            data = "".join(pack(">I", record) for record in records)
+            # Use a batch update, built a section at a time.
+            data = "".join(damage_records(self.sections[index], index, indices)
+                           for index, indices in self.damaged.sections())
 
             return make_packet("batch", x=self.x, z=self.z,
-                               count=len(records), data=data)
+                               count=len(self.damaged), data=data)
 
     def clear_damage(self):
         """
@@ -449,24 +516,20 @@ class Chunk(object):
         mask = 0
         packed = []
 
-        ls = segment_array(self.blocklight)
-
+        sections = []
         for i, section in enumerate(self.sections):
-            if any(section.blocks):
+            if section.has_blocks():
                 mask |= 1 << i
-                packed.append(section.blocks.tostring())
-
-        for i, section in enumerate(self.sections):
-            if mask & 1 << i:
-                packed.append(pack_nibbles(section.metadata))
+                sections.append(section.pack())
 
-        for i, l in enumerate(ls):
-            if mask & 1 << i:
-                packed.append(pack_nibbles(l))
+        # The packet wants all of the blocks, then all of the metadata, and
+        # so forth, so transpose our packed sections.
+        blocks, metadata, skylight, blocklight = zip(*sections) or [()] * 4
 
-        for i, section in enumerate(self.sections):
-            if mask & 1 << i:
-                packed.append(pack_nibbles(section.skylight))
+        packed.extend(blocks)
+        packed.extend(metadata)
+        packed.extend(blocklight)
+        packed.extend(skylight)
 
         # Fake the biome data.
         packed.append("\x00" * 256)
@@ -486,9 +549,8 @@ class Chunk(object):
         """
 
         x, y, z = coords
-        index, y = divmod(y, 16)
 
-        return self.sections[index].get_block((x, y, z))
+        return self.sections[y >> 4].get_block((x, y & 0xf, z))
 
     @check_bounds
     def set_block(self, coords, block):
@@ -506,10 +568,16 @@ class Chunk(object):
 
         if self.get_block(coords) != block:
             self.sections[index].set_block((x, section_y, z), block)
+            self.touch()
 
             if not self.populated:
                 return
 
+            if self._batches:
+                self._changed.add(coords)
+                self._damaged.add(coords)
+                return
+
             # Regenerate heightmap at this coordinate.
             if block:
                 self.heightmap[column] = max(self.heightmap[column], y)
@@ -518,22 +586,13 @@ class Chunk(object):
                 # through all blocks below it to find the new top block.
                 height = self.heightmap[column]
                 if y == height:
-                    for y in range(height, -1, -1):
-                        if self.get_block((x, y, z)):
+                    for height in range(height, -1, -1):
+                        if self.get_block((x, height, z)):
                             break
-                    self.heightmap[column] = y
-
-            # Do the blocklight at this coordinate, if appropriate.
-            if block in glowing_blocks:
-                composite_glow(self.blocklight, glowing_blocks[block],
-                    x, y, z)
-                bl = [clamp(light, 0, 15) for light in self.blocklight]
-                self.blocklight = array("B", bl)
+                    self.heightmap[column] = height
 
-            # And the skylight.
-            glow = max(self.get_skylight((nx, ny, nz))
-                       for nx, nz, ny in iter_neighbors((x, z, y)))
-            self.set_skylight((x, y, z), neighboring_light(glow, block))
+            # And relight everything the block could have shaded or lit.
+            Lighting(self).update(self.x * 16 + x, y, self.z * 16 + z)
 
             self.dirty = True
             self.damage(coords)
@@ -548,9 +607,8 @@ class Chunk(object):
         """
 
         x, y, z = coords
-        index, y = divmod(y, 16)
 
-        return self.sections[index].get_metadata((x, y, z))
+        return self.sections[y >> 4].get_metadata((x, y & 0xf, z))
 
     @check_bounds
     def set_metadata(self, coords, metadata):
@@ -567,6 +625,11 @@ class Chunk(object):
 
             self.sections[index].set_metadata((x, y, z), metadata)
 
+            if self._batches:
+                self.touch()
+                self._damaged.add(coords)
+                return
+
             self.dirty = True
             self.damage(coords)
 
@@ -580,9 +643,8 @@ class Chunk(object):
         """
 
         x, y, z = coords
-        index, y = divmod(y, 16)
 
-        return self.sections[index].get_skylight((x, y, z))
+        return self.sections[y >> 4].get_skylight((x, y & 0xf, z))
 
     @check_bounds
     def set_skylight(self, coords, value):
@@ -593,11 +655,39 @@ class Chunk(object):
         :param int metadata:
         """
 
-        if self.get_metadata(coords) != value:
+        if self.get_skylight(coords) != value:
             x, y, z = coords
             index, y = divmod(y, 16)
 
             self.sections[index].set_skylight((x, y, z), value)
+            self.touch()
+
+    @check_bounds
+    def get_blocklight(self, coords):
+        """
+        Look up block light value.
+
+        :param tuple coords: coordinate triplet
+        :rtype: int
+        """
+
+        x, y, z = coords
+
+        return self.sections[y >> 4].get_blocklight((x, y & 0xf, z))
+
+    @check_bounds
+    def set_blocklight(self, coords, value):
+        """
+        Update block light value.
+
+        :param tuple coords: coordinate triplet
+        :param int value:
+        """
+
+        x, y, z = coords
+
+        self.sections[y >> 4].set_blocklight((x, y & 0xf, z), value)
+        self.touch()
 
     @check_bounds
     def destroy(self, coords):
@@ -642,8 +732,151 @@ class Chunk(object):
         """
 
         for section in self.sections:
-            for i, block in enumerate(section.blocks):
-                if block == search:
-                    section.blocks[i] = replace
-                    self.all_damaged = True
-                    self.dirty = True
+            if section.replace_blocks(search, replace):
+                self.all_damaged = True
+                self.dirty = True
+
+    def find_blocks(self, acceptable):
+        """
+        Find every block in this chunk which is one of a set of blocks.
+
+        :param acceptable: a container of blocks to look for
+        :returns: a list of chunk-local coordinate triplets
+        """
+
+        coords = []
+
+        for index, section in enumerate(self.sections):
+            base = index * 16
+            for i in section.find_blocks(acceptable):
+                coords.append((i & 0xf, (i >> 8) + base, i >> 4 & 0xf))
+
+        return coords
+
+    def get_block_column(self, x, z):
+        """
+        Look up an entire xz-column of blocks.
+
+        :param int x: X coordinate
+        :param int z: Z coordinate
+        :rtype: array.array
+        :returns: CHUNK_HEIGHT blocks, from the bottom up
+        """
+
+        column = array("B")
+        for section in self.sections:
+            column.extend(section.get_block_column(x, z))
+        return column
+
+    def set_block_column(self, x, z, blocks):
+        """
+        Update an entire xz-column of blocks.
+
+        The chunk is marked as completely damaged, since this is usually more
+        changes than are worth tracking individually. Populated chunks are
+        relit where blocks changed, as with ``set_block()``.
+
+        :param int x: X coordinate
+        :param int z: Z coordinate
+        :param blocks: CHUNK_HEIGHT blocks, from the bottom up, or a single
+            block to fill the column with
+        """
+
+        if isinstance(blocks, Integral):
+            blocks = filled(blocks, CHUNK_HEIGHT)
+        elif not isinstance(blocks, array):
+            blocks = array("B", blocks)
+
+        if self.populated:
+            old = self.get_block_column(x, z)
+
+        for index, section in enumerate(self.sections):
+            section.set_block_column(x, z, blocks[index * 16:index * 16 + 16])
+
+        if self.populated:
+            changed = [(x, y, z) for y in xrange(CHUNK_HEIGHT)
+                       if old[y] != blocks[y]]
+            if self._batched(changed):
+                return
+
+            height = len(blocks.tostring().rstrip("\x00")) - 1
+            self.heightmap[x * 16 + z] = max(height, 0)
+            self._relight(changed)
+
+        self.all_damaged = True
+        self.dirty = True
+
+    def get_block_slab(self, y):
+        """
+        Look up an entire y-level of blocks.
+
+        :param int y: Y coordinate
+        :rtype: array.array
+        :returns: 256 blocks, indexed by ``z * 16 + x``
+        """
+
+        return self.sections[y >> 4].get_block_slab(y & 0xf)
+
+    def set_block_slab(self, y, blocks):
+        """
+        Update an entire y-level of blocks.
+
+        The chunk is marked as completely damaged, since this is usually more
+        changes than are worth tracking individually. Populated chunks are
+        relit where blocks changed, as with ``set_block()``.
+
+        :param int y: Y coordinate
+        :param blocks: 256 blocks, indexed by ``z * 16 + x``, or a single
+            block to fill the slab with
+        """
+
+        if self.populated:
+            old = self.get_block_slab(y)
+
+        self.sections[y >> 4].set_block_slab(y & 0xf, blocks)
+
+        if self.populated:
+            slab = self.sections[y >> 4].get_block_slab(y & 0xf)
+            changed = [(x, y, z) for x, z in XZ
+                       if old[z * 16 + x] != slab[z * 16 + x]]
+            if self._batched(changed):
+                return
+
+            # Only columns whose top block was on this slab, or is now on
+            # this slab, need their heights changed.
+            for x, z in XZ:
+                column = x * 16 + z
+                height = self.heightmap[column]
+                if slab[z * 16 + x]:
+                    if y > height:
+                        self.heightmap[column] = y
+                elif y == height:
+                    below = self.get_block_column(x, z)[:y].tostring()
+                    height = len(below.rstrip("\x00")) - 1
+                    self.heightmap[column] = max(height, 0)
+
+            self._relight(changed)
+
+        self.all_damaged = True
+        self.dirty = True
+
+    def _batched(self, changed):
+        """
+        Put off the heights and light of changed blocks until the batch in
+        progress is committed, if there is one.
+
+        :returns: whether there was a batch to put them off until
+        """
+
+        if not self._batches:
+            return False
+
+        self.touch()
+        self._changed.update(changed)
+        self._damaged.update(changed)
+        return True
+
+    def _relight(self, changed):
+        if changed:
+            Lighting(self).update_many([(self.x * 16 + x, y, self.z * 16 + z)
+                                        for x, y, z in changed])
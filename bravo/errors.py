@@ -58,3 +58,8 @@ class ChunkNotLoaded(Exception):
     The requested chunk is not currently loaded. If you need it, you will need
     to request it yourself.
     """
+
+class ChunkGenerationError(Exception):
+    """
+    A chunk couldn't be generated.
+    """
@@ -0,0 +1,109 @@
+import re
+
+from bravo.geometry.section import si
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# The bits set in each possible byte of a bitmap, from the high bit down.
+BITS = [tuple(j for j in range(8) if b & (0x80 >> j)) for b in range(256)]
+
+NONZERO = re.compile("[^\x00]")
+
+
+def set_bits(bitmap):
+    """
+    Find the indices of every set bit in a bitmap.
+
+    Bits are numbered from the high bit of the first byte onwards.
+
+    :param bytearray bitmap: the bitmap
+    :returns: a sorted list of indices
+    """
+
+    if numpy is not None:
+        bits = numpy.unpackbits(numpy.frombuffer(bitmap, dtype=numpy.uint8))
+        return numpy.flatnonzero(bits).tolist()
+
+    indices = []
+    for match in NONZERO.finditer(str(bitmap)):
+        byte = match.start()
+        base = byte * 8
+        indices.extend(base + j for j in BITS[bitmap[byte]])
+    return indices
+
+
+class Damage(object):
+    """
+    A record of the damaged blocks of a chunk.
+
+    Damage is kept as a bitmap for each section, with one bit for each block
+    of the section, so recording damage is a couple of bitwise operations and
+    doesn't allocate anything once the section is damaged. Sections which
+    have never been damaged don't have bitmaps at all.
+
+    Damage can be iterated over a section at a time with ``sections()``,
+    which is how packets are built, or a block at a time, as chunk-local
+    coordinates.
+    """
+
+    def __init__(self):
+        self._bitmaps = [None] * 16
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, coords):
+        x, y, z = coords
+        bitmap = self._bitmaps[y >> 4]
+        if bitmap is None:
+            return False
+        i = si(x, y & 0xf, z)
+        return bool(bitmap[i >> 3] & (0x80 >> (i & 7)))
+
+    def __iter__(self):
+        for index, indices in self.sections():
+            base = index * 16
+            for i in indices:
+                yield i & 0xf, (i >> 8) + base, i >> 4 & 0xf
+
+    def add(self, coords):
+        """
+        Damage a block.
+
+        :param tuple coords: chunk-local coordinates
+        """
+
+        x, y, z = coords
+        bitmap = self._bitmaps[y >> 4]
+        if bitmap is None:
+            bitmap = self._bitmaps[y >> 4] = bytearray(512)
+
+        i = si(x, y & 0xf, z)
+        byte, bit = i >> 3, 0x80 >> (i & 7)
+        if not bitmap[byte] & bit:
+            bitmap[byte] |= bit
+            self._count += 1
+
+    def clear(self):
+        """
+        Forget all of the damage.
+        """
+
+        self._bitmaps = [None] * 16
+        self._count = 0
+
+    def sections(self):
+        """
+        Iterate over the damaged sections.
+
+        :returns: an iterator of pairs of section numbers and sorted lists of
+            damaged section indices
+        """
+
+        for index, bitmap in enumerate(self._bitmaps):
+            if bitmap is not None:
+                yield index, set_bits(bitmap)
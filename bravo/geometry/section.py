@@ -1,4 +1,12 @@
 from array import array
+from numbers import Integral
+
+from bravo.utilities.bits import NibbleArray
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 def si(x, y, z):
@@ -11,30 +19,668 @@ def si(x, y, z):
     return (y * 16 + z) * 16 + x
 
 
+def view(a):
+    """
+    Get a NumPy view of a byte array.
+
+    The view shares its memory with the array, so writes to the view are
+    writes to the array, and no copying is done. The array must not be
+    resized while the view is alive.
+
+    This function must not be called if NumPy is not available.
+    """
+
+    return numpy.frombuffer(a, dtype=numpy.uint8)
+
+
+def filled(value, length):
+    """
+    Make a byte array of a single value.
+    """
+
+    return array("B", [value]) * length
+
+
+# Bulk kernels. These all operate on section-sized byte arrays, and use NumPy
+# when it is around. When it isn't, they lean on slicing and string methods,
+# which still run at C speed, rather than walking the array in Python. The
+# slab and column kernels also work on nibble arrays.
+
+def get_slab(a, y):
+    """
+    Get the 256 entries of a y-level of a section array, in section order.
+    """
+
+    return a[y * 256:(y + 1) * 256]
+
+
+def set_slab(a, y, values):
+    """
+    Set the 256 entries of a y-level of a section array.
+
+    ``values`` may be a single value, which will be used for the entire slab.
+    """
+
+    if isinstance(values, Integral):
+        values = filled(values, 256)
+    elif not isinstance(values, array):
+        values = array("B", values)
+    elif len(values) != 256:
+        raise ValueError("Slabs have 256 entries, not %d" % len(values))
+
+    a[y * 256:(y + 1) * 256] = values
+
+
+def get_column(a, x, z):
+    """
+    Get the 16 entries of an xz-column of a section array, from the bottom
+    up.
+    """
+
+    return a[z * 16 + x::256]
+
+
+def set_column(a, x, z, values):
+    """
+    Set the 16 entries of an xz-column of a section array.
+
+    ``values`` may be a single value, which will be used for the entire
+    column.
+    """
+
+    if isinstance(values, Integral):
+        values = filled(values, 16)
+    elif not isinstance(values, array):
+        values = array("B", values)
+    elif len(values) != 16:
+        raise ValueError("Columns have 16 entries, not %d" % len(values))
+
+    a[z * 16 + x::256] = values
+
+
+def take(a, indices):
+    """
+    Get the entries of a section array at a list of indices.
+
+    :returns: an array of the entries, in the same order as the indices
+    """
+
+    if numpy is not None:
+        return array("B", view(a)[indices].tostring())
+
+    return array("B", [a[i] for i in indices])
+
+
+def take_nibbles(n, indices):
+    """
+    Get the entries of a section nibble array at a list of indices.
+
+    :returns: an array of the entries, in the same order as the indices
+    """
+
+    if numpy is not None:
+        indices = numpy.asarray(indices)
+        packed = view(n.data)[indices >> 1]
+        nibbles = (packed >> ((indices & 1) << 2)) & 0xf
+        return array("B", nibbles.astype(numpy.uint8).tostring())
+
+    return array("B", [n[i] for i in indices])
+
+
+def nonzero(a):
+    """
+    Count the non-zero entries of a section array.
+    """
+
+    if numpy is not None:
+        return int(numpy.count_nonzero(view(a)))
+
+    return len(a) - a.tostring().count("\x00")
+
+
+def find(a, acceptable):
+    """
+    Find every index in a section array whose value is acceptable.
+
+    :param acceptable: a container of values to look for
+    :returns: a sorted list of section indices
+    """
+
+    if not acceptable:
+        return []
+
+    if numpy is not None:
+        mask = numpy.in1d(view(a), list(acceptable))
+        return numpy.flatnonzero(mask).tolist()
+
+    s = a.tostring()
+    indices = []
+    for value in acceptable:
+        c = chr(value)
+        i = s.find(c)
+        while i != -1:
+            indices.append(i)
+            i = s.find(c, i + 1)
+    indices.sort()
+    return indices
+
+
+def replace(a, search, replacement):
+    """
+    Replace every occurrence of a value in a section array.
+
+    :returns: the number of entries which were replaced
+    """
+
+    if numpy is not None:
+        v = view(a)
+        mask = v == search
+        count = int(numpy.count_nonzero(mask))
+        if count:
+            v[mask] = replacement
+        return count
+
+    s = a.tostring()
+    count = s.count(chr(search))
+    if count:
+        a[:] = array("B", s.replace(chr(search), chr(replacement)))
+    return count
+
+
+def translate(a, table):
+    """
+    Map every entry of a section array through a table.
+
+    :param str table: 256 bytes, one for each possible entry
+    :returns: a new array
+    """
+
+    if numpy is not None:
+        mapped = numpy.frombuffer(table, dtype=numpy.uint8)[view(a)]
+        return array("B", mapped.tostring())
+
+    return array("B", a.tostring().translate(table))
+
+
+def heights(a):
+    """
+    Find the highest non-zero entry in each xz-column of a section array.
+
+    :returns: a list of 256 y-levels, in section order, with -1 marking
+        columns which are entirely zero
+    """
+
+    if numpy is not None:
+        v = view(a).reshape(16, 256)
+        nonzero = v[::-1] != 0
+        tops = 15 - nonzero.argmax(axis=0)
+        tops[~nonzero.any(axis=0)] = -1
+        return tops.tolist()
+
+    return [len(a[i::256].tostring().rstrip("\x00")) - 1
+            for i in range(256)]
+
+
+EMPTY = filled(0, 16 * 16 * 16)
+"""
+A shared, section-sized array of zeroes.
+
+Sections use this as the initial value of their blocks, and only make their
+own copies once they are written to. It must never be written to; all
+sections share it.
+"""
+
+EMPTY_NIBBLES = NibbleArray.filled(0, 16 * 16 * 16)
+"""
+A shared, section-sized nibble array of zeroes, for metadata and block light.
+
+Just like ``EMPTY``, this array must never be written to.
+"""
+
+FULL_NIBBLES = NibbleArray.filled(0xf, 16 * 16 * 16)
+"""
+A shared, section-sized nibble array of full light, for initial skylight.
+
+Just like ``EMPTY``, this array must never be written to.
+"""
+
+SHARED = EMPTY, EMPTY_NIBBLES, FULL_NIBBLES
+
+
+def shared_index(a):
+    """
+    Find the index of an array in ``SHARED``, or None if it isn't shared.
+
+    Shared arrays are found by identity, not equality.
+    """
+
+    for i, shared in enumerate(SHARED):
+        if a is shared:
+            return i
+    return None
+
+
+def private(a):
+    """
+    Get a private copy of an array if it is shared, or the array itself if it
+    isn't.
+    """
+
+    if a is EMPTY:
+        return array("B", EMPTY)
+    elif a is EMPTY_NIBBLES or a is FULL_NIBBLES:
+        return a.copy()
+    return a
+
+
+def copied(a):
+    """
+    Get a copy of a byte or nibble array.
+    """
+
+    if isinstance(a, NibbleArray):
+        return a.copy()
+    return array("B", a)
+
+
+# Flags for the arrays of a section which are borrowed by, or lent to, a
+# snapshot.
+BLOCKS, METADATA, SKYLIGHT, BLOCKLIGHT = 1, 2, 4, 8
+
+
+def column_tops(sections, table=None):
+    """
+    Find the highest block in each xz-column of a stack of sections, like the
+    sections of a chunk.
+
+    Empty sections are skipped, and the scan stops as soon as every column
+    has been topped out.
+
+    :param table: an optional table of blocks to count, as for
+        ``Section.column_heights()``
+    :returns: a list of 256 y-levels, indexed by ``z * 16 + x``, with -1
+        marking empty columns
+    """
+
+    tops = [-1] * 256
+    remaining = 256
+
+    for index in range(len(sections) - 1, -1, -1):
+        section = sections[index]
+        if not section:
+            continue
+
+        base = index * 16
+        for i, height in enumerate(section.column_heights(table)):
+            if height >= 0 and tops[i] < 0:
+                tops[i] = base + height
+                remaining -= 1
+
+        if not remaining:
+            break
+
+    return tops
+
+
 class Section(object):
     """
     A section of geometry.
+
+    Along with the single-block accessors, sections offer bulk accessors which
+    read and write whole slabs, columns, and masks at once. These are
+    vectorized with NumPy, if it is available.
+
+    Sections start out uniform: full of air and sky, and backed by arrays
+    shared with every other uniform section. Each array is copied the first
+    time it is written to, so sections which are never touched, like most of
+    the sky, cost almost no memory.
+
+    Blocks are stored one per byte. Metadata, skylight, and block light are
+    stored as packed nibble arrays, in the same packing used on disk and on
+    the wire, so loading, saving, and sending sections are buffer copies.
+
+    The ``blocks``, ``metadata``, ``skylight``, and ``blocklight`` attributes
+    always hand out arrays private to the section, since the caller might
+    write to them. Prefer the accessors, which don't make copies just to read
+    from a uniform section.
+
+    Sections keep count of how many of their blocks aren't air, and the
+    length of a section is that count, so empty sections are false and can be
+    skipped without looking at their blocks. The accessors keep the count up
+    to date as they go. Handing out the ``blocks`` attribute forgets the
+    count, since the caller might write to it, and the count is taken again
+    the next time it is needed.
+
+    Snapshots of sections share their arrays with the section they were
+    taken from, the same way that uniform sections share arrays. Whichever of
+    the two writes to an array first copies it.
     """
 
+    __slots__ = ("_blocks", "_metadata", "_skylight", "_blocklight",
+                 "_count", "_borrowed")
+
     def __init__(self):
-        self.blocks = array("B", [0] * (16 * 16 * 16))
-        self.metadata = array("B", [0] * (16 * 16 * 16))
-        self.skylight = array("B", [0xf] * (16 * 16 * 16))
+        self._blocks = EMPTY
+        self._metadata = EMPTY_NIBBLES
+        self._skylight = FULL_NIBBLES
+        self._blocklight = EMPTY_NIBBLES
+        self._count = 0
+        self._borrowed = 0
+
+    def __getstate__(self):
+        # Don't copy or pickle the shared arrays; put their indices in their
+        # place and hook back up to the shared arrays on the other side.
+        state = []
+        for a in (self._blocks, self._metadata, self._skylight,
+                  self._blocklight):
+            index = shared_index(a)
+            state.append(a if index is None else index)
+        return tuple(state)
+
+    def __setstate__(self, state):
+        (self._blocks, self._metadata, self._skylight,
+         self._blocklight) = [SHARED[a] if isinstance(a, int) else a
+                              for a in state]
+        self._count = None
+        self._borrowed = 0
+
+    def __len__(self):
+        """
+        The number of blocks in this section which aren't air.
+        """
+
+        if self._count is None:
+            self._count = nonzero(self._blocks)
+        return self._count
+
+    def __nonzero__(self):
+        return len(self) != 0
+
+    def _private(self, a, flag):
+        """
+        Get a private version of one of this section's arrays.
+        """
+
+        if self._borrowed & flag:
+            self._borrowed &= ~flag
+            return copied(a)
+        return private(a)
+
+    def _private_blocks(self):
+        """
+        Get the blocks for writing, without forgetting the count.
+        """
+
+        self._blocks = self._private(self._blocks, BLOCKS)
+        return self._blocks
+
+    @property
+    def blocks(self):
+        self._count = None
+        return self._private_blocks()
+
+    @blocks.setter
+    def blocks(self, value):
+        self._blocks = value
+        self._count = None
+        self._borrowed &= ~BLOCKS
+
+    @property
+    def metadata(self):
+        self._metadata = self._private(self._metadata, METADATA)
+        return self._metadata
+
+    @metadata.setter
+    def metadata(self, value):
+        self._metadata = value
+        self._borrowed &= ~METADATA
+
+    @property
+    def skylight(self):
+        self._skylight = self._private(self._skylight, SKYLIGHT)
+        return self._skylight
+
+    @skylight.setter
+    def skylight(self, value):
+        self._skylight = value
+        self._borrowed &= ~SKYLIGHT
+
+    @property
+    def blocklight(self):
+        self._blocklight = self._private(self._blocklight, BLOCKLIGHT)
+        return self._blocklight
+
+    @blocklight.setter
+    def blocklight(self, value):
+        self._blocklight = value
+        self._borrowed &= ~BLOCKLIGHT
+
+    def snapshot(self):
+        """
+        Take a snapshot of this section.
+
+        The snapshot shares its arrays with this section, so taking it
+        doesn't copy anything. Each array is copied the first time either
+        section writes to it, so the snapshot keeps the blocks and light that
+        this section had when the snapshot was taken.
+        """
+
+        flags = 0
+        for a, flag in ((self._blocks, BLOCKS),
+                        (self._metadata, METADATA),
+                        (self._skylight, SKYLIGHT),
+                        (self._blocklight, BLOCKLIGHT)):
+            if shared_index(a) is None:
+                flags |= flag
+        self._borrowed |= flags
+
+        section = Section()
+        section._blocks = self._blocks
+        section._metadata = self._metadata
+        section._skylight = self._skylight
+        section._blocklight = self._blocklight
+        section._count = self._count
+        section._borrowed = self._borrowed
+        return section
+
+    @classmethod
+    def from_packed(cls, blocks, metadata, skylight, blocklight=None):
+        """
+        Make a section from the packed strings of the Anvil format.
+
+        Nibble arrays which are entirely zero, or entirely full in the case of
+        skylight, are left uniform.
+
+        :param str blocks: 4096 bytes of blocks
+        :param str metadata: 2048 bytes of packed metadata
+        :param str skylight: 2048 bytes of packed skylight
+        :param str blocklight: 2048 bytes of packed block light, or None if
+            the section doesn't have any
+        """
+
+        section = cls()
+
+        count = len(blocks) - blocks.count("\x00")
+        if count:
+            section._blocks = array("B", blocks)
+            section._count = count
+        if metadata.count("\x00") != len(metadata):
+            section._metadata = NibbleArray(metadata)
+        if skylight.count("\xff") != len(skylight):
+            section._skylight = NibbleArray(skylight)
+        if blocklight and blocklight.count("\x00") != len(blocklight):
+            section._blocklight = NibbleArray(blocklight)
+
+        return section
+
+    def pack(self):
+        """
+        Pack this section into strings for the Anvil format.
+
+        :returns: a tuple of blocks, metadata, skylight, and block light, with
+            all but the blocks packed as nibbles
+        """
+
+        return (
+            self._blocks.tostring(),
+            self._metadata.tostring(),
+            self._skylight.tostring(),
+            self._blocklight.tostring(),
+        )
+
+    def is_uniform(self):
+        """
+        Whether this section is still entirely backed by shared arrays.
+
+        Uniform sections are full of air, have no metadata or block light,
+        and are fully lit by the sky. Sections which have had blocks, but are
+        back to being full of air, count as uniform too.
+        """
+
+        return (not self and
+                self._metadata is EMPTY_NIBBLES and
+                self._skylight is FULL_NIBBLES and
+                self._blocklight is EMPTY_NIBBLES)
+
+    def has_blocks(self):
+        """
+        Whether this section has any blocks in it which aren't air.
+        """
+
+        return len(self) != 0
+
+    def has_blocklight(self):
+        """
+        Whether any block in this section might be lit by block light.
+        """
+
+        return self._blocklight is not EMPTY_NIBBLES
 
     def get_block(self, coords):
-        return self.blocks[si(*coords)]
+        return self._blocks[si(*coords)]
 
     def set_block(self, coords, block):
-        self.blocks[si(*coords)] = block
+        if block or self._blocks is not EMPTY:
+            blocks = self._private_blocks()
+            i = si(*coords)
+            if self._count is not None:
+                self._count += (block != 0) - (blocks[i] != 0)
+            blocks[i] = block
 
     def get_metadata(self, coords):
-        return self.metadata[si(*coords)]
+        return self._metadata[si(*coords)]
 
     def set_metadata(self, coords, metadata):
-        self.metadata[si(*coords)] = metadata
+        if metadata or self._metadata is not EMPTY_NIBBLES:
+            self.metadata[si(*coords)] = metadata
 
     def get_skylight(self, coords):
-        return self.skylight[si(*coords)]
+        return self._skylight[si(*coords)]
 
     def set_skylight(self, coords, value):
-        self.skylight[si(*coords)] = value
+        if value != 0xf or self._skylight is not FULL_NIBBLES:
+            self.skylight[si(*coords)] = value
+
+    def get_blocklight(self, coords):
+        return self._blocklight[si(*coords)]
+
+    def set_blocklight(self, coords, value):
+        if value or self._blocklight is not EMPTY_NIBBLES:
+            self.blocklight[si(*coords)] = value
+
+    def get_block_slab(self, y):
+        return get_slab(self._blocks, y)
+
+    def set_block_slab(self, y, blocks):
+        old = nonzero(get_slab(self._blocks, y))
+        set_slab(self._private_blocks(), y, blocks)
+        if self._count is not None:
+            self._count += nonzero(get_slab(self._blocks, y)) - old
+
+    def get_block_column(self, x, z):
+        return get_column(self._blocks, x, z)
+
+    def set_block_column(self, x, z, blocks):
+        old = nonzero(get_column(self._blocks, x, z))
+        set_column(self._private_blocks(), x, z, blocks)
+        if self._count is not None:
+            self._count += nonzero(get_column(self._blocks, x, z)) - old
+
+    def get_metadata_slab(self, y):
+        return get_slab(self._metadata, y)
+
+    def set_metadata_slab(self, y, metadata):
+        set_slab(self.metadata, y, metadata)
+
+    def get_skylight_slab(self, y):
+        return get_slab(self._skylight, y)
+
+    def set_skylight_slab(self, y, values):
+        set_slab(self.skylight, y, values)
+
+    def get_blocklight_column(self, x, z):
+        return get_column(self._blocklight, x, z)
+
+    def set_blocklight_column(self, x, z, values):
+        set_column(self.blocklight, x, z, values)
+
+    def take_blocks(self, indices):
+        """
+        Get the blocks at a list of section indices.
+        """
+
+        return take(self._blocks, indices)
+
+    def take_metadata(self, indices):
+        """
+        Get the metadata at a list of section indices.
+        """
+
+        return take_nibbles(self._metadata, indices)
+
+    def find_blocks(self, acceptable):
+        """
+        Find the section indices of every block in a set of blocks.
+        """
+
+        if not self and 0 not in acceptable:
+            return []
+
+        return find(self._blocks, acceptable)
+
+    def replace_blocks(self, search, replacement):
+        """
+        Replace every instance of a block with another block.
+
+        :returns: the number of blocks replaced
+        """
+
+        if search == replacement:
+            return 0
+
+        if not self and search:
+            return 0
+
+        count = replace(self._private_blocks(), search, replacement)
+        if self._count is not None:
+            self._count += count * ((replacement != 0) - (search != 0))
+        return count
+
+    def column_heights(self, table=None):
+        """
+        Find the highest non-air block in each xz-column.
+
+        :param str table: if given, a table of 256 bytes, mapping blocks which
+            should be counted to non-zero bytes, and blocks which should be
+            skipped, like air, to zero bytes
+        :returns: a list of 256 y-levels, indexed by ``z * 16 + x``, with -1
+            marking empty columns
+        """
+
+        if not self:
+            return [-1] * 256
+
+        if table is None:
+            return heights(self._blocks)
+
+        return heights(translate(self._blocks, table))
@@ -219,6 +219,28 @@ class ISerializer(IBravoPlugin):
         invalid, this method may raise an exception.
         """
 
+    def close():
+        """
+        Finish any outstanding work and let go of any resources, like open
+        files, which are being held for speed.
+
+        The serializer may be used again afterwards, and should pick its
+        resources back up as needed.
+
+        May return a ``Deferred`` that will fire on completion.
+        """
+
+    def compact():
+        """
+        Reclaim some of the space which has been wasted in the serialization
+        resource, such as space left behind by chunks which have moved.
+
+        This is called periodically while the world is running, so it should
+        only do a little work at a time.
+
+        May return a ``Deferred`` that will fire on completion.
+        """
+
     def save_chunk(chunk):
         """
         Save a chunk.
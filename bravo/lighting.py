@@ -0,0 +1,493 @@
+"""
+Light propagation.
+
+Light is spread with a breadth-first flood fill. Each step into a block costs
+one level of light, plus however much the block dims light; opaque blocks
+stop light entirely. The exception is full skylight, which falls straight
+down through blocks which don't dim it without losing any light at all.
+
+Changes are made incrementally: placing or removing a block only revisits
+the blocks whose light actually changes. Removing light is done by first
+darkening every block which might have been lit by the removed light, and
+then filling the darkened area back in from its brighter edges.
+"""
+
+from array import array
+from collections import deque
+
+from bravo.blocks import blocks, glowing_blocks
+from bravo.geometry.section import EMPTY_NIBBLES, FULL_NIBBLES, column_tops
+from bravo.utilities.bits import NibbleArray
+from bravo.utilities.coords import CHUNK_HEIGHT, XZ
+
+def make_tables():
+    """
+    Set up the per-block tables of dimming and emitted light.
+
+    Blocks which aren't known are opaque and dark.
+    """
+
+    dims = [16] * 256
+    emission = [0] * 256
+    for slot in range(256):
+        if slot in blocks:
+            dims[slot] = blocks[slot].dim
+        if slot in glowing_blocks:
+            emission[slot] = glowing_blocks[slot]
+    return dims, emission
+
+dims, emission = make_tables()
+
+# A block table, for section kernels, of the blocks which dim skylight.
+dimming = "".join("\x01" if dim else "\x00" for dim in dims)
+
+# Neighbors, as offsets. The last one is straight down, which matters for
+# skylight.
+NEIGHBORS = (
+    (1, 0, 0),
+    (-1, 0, 0),
+    (0, 0, 1),
+    (0, 0, -1),
+    (0, 1, 0),
+    (0, -1, 0),
+)
+
+# The border columns of a chunk on each side, with the offset to the
+# neighboring chunk's matching column.
+BORDERS = (
+    ([(0, z) for z in range(16)], (-1, 0)),
+    ([(15, z) for z in range(16)], (1, 0)),
+    ([(x, 0) for x in range(16)], (0, -1)),
+    ([(x, 15) for x in range(16)], (0, 1)),
+)
+
+def attenuate(sky, level, block, down):
+    """
+    Work out how much light makes it into a block from a neighbor.
+
+    :param bool sky: whether this is skylight
+    :param int level: the light of the neighbor
+    :param int block: the block being lit
+    :param bool down: whether the light is going straight down
+    """
+
+    if sky and down and level == 15:
+        return 15 - dims[block]
+    return level - 1 - dims[block]
+
+class Lighting(object):
+    """
+    A light engine for a chunk.
+
+    Light is spread within the chunk and, if the chunk has a ``lookup`` hook,
+    into its loaded neighbors. Neighbors which are touched by light are
+    marked dirty once the update is done.
+
+    All coordinates used by the engine are world coordinates.
+    """
+
+    def __init__(self, chunk):
+        self.chunk = chunk
+        self.touched = set()
+        self._chunks = {(chunk.x, chunk.z): chunk}
+
+    def _chunk(self, x, z):
+        key = x, z
+        if key not in self._chunks:
+            chunk = None
+            if self.chunk.lookup is not None:
+                chunk = self.chunk.lookup(key)
+                # Chunks which are still being generated don't have any light
+                # to share yet.
+                if chunk is not None and not chunk.populated:
+                    chunk = None
+            self._chunks[key] = chunk
+        return self._chunks[key]
+
+    def get_block(self, x, y, z):
+        """
+        Get a block, or None if it isn't loaded.
+        """
+
+        chunk = self._chunk(x >> 4, z >> 4)
+        if chunk is None:
+            return None
+        return chunk.sections[y >> 4].get_block((x & 0xf, y & 0xf, z & 0xf))
+
+    def get(self, sky, x, y, z):
+        """
+        Get some light, or None if the block isn't loaded.
+        """
+
+        chunk = self._chunk(x >> 4, z >> 4)
+        if chunk is None:
+            return None
+        section = chunk.sections[y >> 4]
+        coords = x & 0xf, y & 0xf, z & 0xf
+        if sky:
+            return section.get_skylight(coords)
+        return section.get_blocklight(coords)
+
+    def set(self, sky, x, y, z, value):
+        chunk = self._chunk(x >> 4, z >> 4)
+        section = chunk.sections[y >> 4]
+        coords = x & 0xf, y & 0xf, z & 0xf
+        if sky:
+            section.set_skylight(coords, value)
+        else:
+            section.set_blocklight(coords, value)
+        self.touched.add(chunk)
+
+    def emitted(self, sky, x, y, z, block):
+        """
+        Get the light a block gives off on its own.
+
+        The top layer of the world is lit by the sky above it.
+        """
+
+        if sky:
+            if y == CHUNK_HEIGHT - 1:
+                return max(15 - dims[block], 0)
+            return 0
+        return emission[block]
+
+    def compute(self, sky, x, y, z):
+        """
+        Work out what the light of a block should be, from its own light and
+        that of its neighbors.
+        """
+
+        block = self.get_block(x, y, z)
+        best = self.emitted(sky, x, y, z, block)
+
+        for dx, dy, dz in NEIGHBORS:
+            ny = y - dy
+            if not 0 <= ny < CHUNK_HEIGHT:
+                continue
+            level = self.get(sky, x - dx, ny, z - dz)
+            if level:
+                best = max(best, attenuate(sky, level, block, dy == -1))
+
+        return max(best, 0)
+
+    def spread(self, sky, queue):
+        """
+        Spread light outwards from a queue of lit blocks.
+        """
+
+        queue = deque(queue)
+        touched = self.touched
+
+        while queue:
+            x, y, z = queue.popleft()
+            level = self.get(sky, x, y, z)
+            if not level:
+                continue
+
+            for dx, dy, dz in NEIGHBORS:
+                ny = y + dy
+                if not 0 <= ny < CHUNK_HEIGHT:
+                    continue
+                nx = x + dx
+                nz = z + dz
+
+                # This is the hottest loop in the engine, so look up the
+                # section once and use it for everything.
+                chunk = self._chunk(nx >> 4, nz >> 4)
+                if chunk is None:
+                    continue
+                section = chunk.sections[ny >> 4]
+                coords = nx & 0xf, ny & 0xf, nz & 0xf
+
+                light = attenuate(sky, level, section.get_block(coords),
+                                  dy == -1)
+                if light <= 0:
+                    continue
+
+                if sky:
+                    if light > section.get_skylight(coords):
+                        section.set_skylight(coords, light)
+                        touched.add(chunk)
+                        queue.append((nx, ny, nz))
+                elif light > section.get_blocklight(coords):
+                    section.set_blocklight(coords, light)
+                    touched.add(chunk)
+                    queue.append((nx, ny, nz))
+
+    def remove(self, sky, queue):
+        """
+        Darken everything which might have been lit by a queue of darkened
+        blocks.
+
+        The queue holds coordinates and the light each block had before it
+        was darkened. Light sources found along the way are kept lit.
+
+        :returns: a list of lit blocks to spread light from, to fill the
+            darkened area back in
+        """
+
+        queue = deque(queue)
+        relight = []
+
+        while queue:
+            x, y, z, level = queue.popleft()
+
+            for dx, dy, dz in NEIGHBORS:
+                ny = y + dy
+                if not 0 <= ny < CHUNK_HEIGHT:
+                    continue
+                nx = x + dx
+                nz = z + dz
+                light = self.get(sky, nx, ny, nz)
+                if not light:
+                    continue
+
+                if light < level or (sky and dy == -1 and level == 15):
+                    self.set(sky, nx, ny, nz, 0)
+                    queue.append((nx, ny, nz, light))
+
+                    block = self.get_block(nx, ny, nz)
+                    source = self.emitted(sky, nx, ny, nz, block)
+                    if source:
+                        self.set(sky, nx, ny, nz, source)
+                        relight.append((nx, ny, nz))
+                else:
+                    relight.append((nx, ny, nz))
+
+        return relight
+
+    def update(self, x, y, z):
+        """
+        Update light after the block at the given coordinates has changed.
+        """
+
+        for sky in (False, True):
+            old = self.get(sky, x, y, z)
+            new = self.compute(sky, x, y, z)
+
+            if new > old:
+                self.set(sky, x, y, z, new)
+                self.spread(sky, [(x, y, z)])
+            elif new < old:
+                self.set(sky, x, y, z, 0)
+                relight = self.remove(sky, [(x, y, z, old)])
+                block = self.get_block(x, y, z)
+                source = self.emitted(sky, x, y, z, block)
+                if source:
+                    self.set(sky, x, y, z, source)
+                    relight.append((x, y, z))
+                self.spread(sky, relight)
+
+        self.finish()
+
+    def update_many(self, coords):
+        """
+        Update light after many blocks have changed at once.
+
+        Every changed block is darkened, along with everything it might have
+        lit, and then the whole darkened area is filled back in together, so
+        that blocks reached by many of the changes are only relit once.
+        """
+
+        for sky in (False, True):
+            darkened = []
+            for x, y, z in coords:
+                old = self.get(sky, x, y, z)
+                if old:
+                    self.set(sky, x, y, z, 0)
+                    darkened.append((x, y, z, old))
+
+            relight = self.remove(sky, darkened)
+
+            for x, y, z in coords:
+                block = self.get_block(x, y, z)
+                source = self.emitted(sky, x, y, z, block)
+                if source:
+                    self.set(sky, x, y, z, source)
+                    relight.append((x, y, z))
+
+                # Let the light of the neighbors back in.
+                for dx, dy, dz in NEIGHBORS:
+                    ny = y + dy
+                    if (0 <= ny < CHUNK_HEIGHT and
+                        self.get(sky, x + dx, ny, z + dz)):
+                        relight.append((x + dx, ny, z + dz))
+
+            self.spread(sky, relight)
+
+        self.finish()
+
+    def border_seeds(self, sky, below):
+        """
+        Find the lit blocks in neighboring chunks which border this chunk.
+
+        :param list below: for each column of this chunk, indexed by ``x * 16
+            + z``, the height below which light might come in
+        """
+
+        seeds = []
+        cx, cz = self.chunk.x, self.chunk.z
+
+        for columns, (dx, dz) in BORDERS:
+            neighbor = self._chunk(cx + dx, cz + dz)
+            if neighbor is None:
+                continue
+
+            # Sections without any block light can be skipped wholesale.
+            lit = [sky or section.has_blocklight()
+                   for section in neighbor.sections]
+
+            for x, z in columns:
+                # The matching column, across the border.
+                wx = (cx + dx) * 16 + ((x + dx) & 0xf)
+                wz = (cz + dz) * 16 + ((z + dz) & 0xf)
+                for y in range(below[x * 16 + z]):
+                    if lit[y >> 4] and self.get(sky, wx, y, wz) > 1:
+                        seeds.append((wx, y, wz))
+
+        return seeds
+
+    def relight_borders(self):
+        """
+        Spread light both ways across the borders between the chunk and its
+        loaded neighbors.
+
+        This is for chunks which were lit on their own, without their
+        neighbors, like chunks generated in other processes.
+        """
+
+        chunk = self.chunk
+        ox, oz = chunk.x * 16, chunk.z * 16
+        heights = self.sky_heights()
+
+        for sky in (True, False):
+            # Light coming in from the neighbors...
+            seeds = self.border_seeds(sky, heights if sky
+                                      else [CHUNK_HEIGHT] * 256)
+
+            # ...and going out to them.
+            lit = [sky or section.has_blocklight()
+                   for section in chunk.sections]
+            for columns, (dx, dz) in BORDERS:
+                neighbor = self._chunk(chunk.x + dx, chunk.z + dz)
+                if neighbor is None:
+                    continue
+
+                for x, z in columns:
+                    # Above the neighbor's height map, its sky is as bright
+                    # as it gets.
+                    top = CHUNK_HEIGHT
+                    if sky:
+                        nx, nz = (x + dx) & 0xf, (z + dz) & 0xf
+                        top = min(neighbor.heightmap[nx * 16 + nz] + 2,
+                                  CHUNK_HEIGHT)
+                    for y in range(top):
+                        if (lit[y >> 4] and
+                            self.get(sky, ox + x, y, oz + z) > 1):
+                            seeds.append((ox + x, y, oz + z))
+
+            self.spread(sky, seeds)
+
+        self.finish()
+
+    def regenerate_blocklight(self):
+        """
+        Light the chunk's glowing blocks from scratch.
+        """
+
+        chunk = self.chunk
+        ox, oz = chunk.x * 16, chunk.z * 16
+
+        for section in chunk.sections:
+            section.blocklight = EMPTY_NIBBLES
+        self.touched.add(chunk)
+
+        seeds = []
+        for x, y, z in chunk.find_blocks(glowing_blocks):
+            block = chunk.get_block((x, y, z))
+            self.set(False, ox + x, y, oz + z, emission[block])
+            seeds.append((ox + x, y, oz + z))
+
+        seeds.extend(self.border_seeds(False, [CHUNK_HEIGHT] * 256))
+
+        self.spread(False, seeds)
+        self.finish()
+
+    def sky_heights(self):
+        """
+        Find the lowest block in each column which can see the sky.
+
+        :returns: a list of heights, indexed by ``x * 16 + z``
+        """
+
+        tops = column_tops(self.chunk.sections, dimming)
+        return [tops[z * 16 + x] + 1 for x, z in XZ]
+
+    def regenerate_skylight(self):
+        """
+        Light the chunk from the sky, from scratch.
+        """
+
+        chunk = self.chunk
+        ox, oz = chunk.x * 16, chunk.z * 16
+        heights = self.sky_heights()
+        lowest, highest = min(heights), max(heights)
+
+        # Fill in the open sky. Sections entirely above or below the sky's
+        # reach are uniform; the rest are filled a slab at a time.
+        slab = [heights[x * 16 + z] for z, x in XZ]
+        for index, section in enumerate(chunk.sections):
+            bottom = index * 16
+            if bottom >= highest:
+                section.skylight = FULL_NIBBLES
+            elif bottom + 16 <= lowest:
+                section.skylight = EMPTY_NIBBLES
+            else:
+                nibbles = array("B")
+                for y in range(bottom, bottom + 16):
+                    nibbles.extend([15 if h <= y else 0 for h in slab])
+                section.skylight = NibbleArray.from_nibbles(nibbles)
+
+        self.touched.add(chunk)
+
+        # Spread from the sky only where it can brighten something: down
+        # from the bottom of each column, and sideways into lower columns.
+        seeds = []
+        for x, z in XZ:
+            height = heights[x * 16 + z]
+            if height >= CHUNK_HEIGHT:
+                continue
+
+            top = height + 1
+            for nx, nz in ((x - 1, z), (x + 1, z), (x, z - 1), (x, z + 1)):
+                if 0 <= nx < 16 and 0 <= nz < 16:
+                    top = max(top, heights[nx * 16 + nz])
+                else:
+                    # Across the border; use the neighbor's height map as a
+                    # conservative guess of its sky.
+                    neighbor = self._chunk(chunk.x + (nx >> 4),
+                                           chunk.z + (nz >> 4))
+                    if neighbor is not None:
+                        top = max(top,
+                            neighbor.heightmap[(nx & 0xf) * 16 + (nz & 0xf)]
+                            + 2)
+
+            for y in range(height, min(top, CHUNK_HEIGHT)):
+                seeds.append((ox + x, y, oz + z))
+
+        seeds.extend(self.border_seeds(True, heights))
+
+        self.spread(True, seeds)
+        self.finish()
+
+    def finish(self):
+        """
+        Let every touched chunk know that it has changed.
+        """
+
+        for chunk in self.touched:
+            if chunk is self.chunk:
+                chunk.touch()
+            else:
+                chunk.dirty = True
+        self.touched.clear()
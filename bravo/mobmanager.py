@@ -48,10 +48,11 @@ class MobManager(object):
         min_block = min_point.to_block()
         max_block = max_point.to_block()
 
+        cursor = self.world.cursor()
         for x in xrange(min_block[0],max_block[0]):
             for y in xrange(min_block[1],max_block[1]):
                 for z in xrange(min_block[2],max_block[2]):
-                    if self.world.sync_get_block((x,y,z)):
+                    if cursor.sync_get_block((x,y,z)):
                         return False
 
         return True
@@ -45,6 +45,15 @@ class Trees(object):
         for call in self.tracked:
             if call.active():
                 call.cancel()
+                self.release(*call.args)
+
+    def release(self, coords):
+        """
+        Let go of the chunk holding a sapling.
+        """
+
+        x, y, z = coords
+        self.factory.world.release_chunk(x // 16, z // 16)
 
     def process(self, coords):
         try:
@@ -54,12 +63,17 @@ class Trees(object):
             if metadata >= 12:
                 # Tree time!
                 tree = self.trees[metadata % 4](pos=coords)
-                tree.prepare(self.factory.world)
-                tree.make_trunk(self.factory.world)
-                tree.make_foliage(self.factory.world)
+                # Grow the whole tree in one batch, so that the chunks only
+                # catch up on their lighting once.
+                with self.factory.world.batch() as world:
+                    cursor = world.cursor()
+                    tree.prepare(cursor)
+                    tree.make_trunk(cursor)
+                    tree.make_foliage(cursor)
                 # We can't easily tell how many chunks were modified, so we have
                 # to flush all of them.
                 self.factory.flush_all_chunks()
+                self.release(coords)
             else:
                 # Increment metadata.
                 metadata += 4
@@ -72,9 +86,13 @@ class Trees(object):
             # Filter tracked set.
             self.tracked = set(i for i in self.tracked if i.active())
         except ChunkNotLoaded:
-            pass
+            self.release(coords)
 
     def feed(self, coords):
+        # Keep the sapling's chunk around until it has grown.
+        x, y, z = coords
+        self.factory.world.acquire_chunk(x // 16, z // 16)
+
         call = reactor.callLater(
             randint(self.grow_step_min, self.grow_step_max), self.process,
             coords)
@@ -118,7 +136,8 @@ class Grass(object):
         # about it; we can get to it later. Grass isn't exactly a
         # super-high-tension thing that must happen.
         try:
-            current = self.factory.world.sync_get_block(coords)
+            cursor = self.factory.world.cursor()
+            current = cursor.sync_get_block(coords)
             if current == blocks["dirt"].slot:
                 # Yep, it's still dirt. Let's look around and see whether it
                 # should be grassy.  Our general strategy is as follows: We
@@ -129,7 +148,7 @@ class Grass(object):
 
                 # First things first: Grass can't grow if there's things on
                 # top of it, so check that first.
-                above = self.factory.world.sync_get_block((x, y + 1, z))
+                above = cursor.sync_get_block((x, y + 1, z))
                 if above:
                     return
 
@@ -141,7 +160,7 @@ class Grass(object):
                     # Early-exit to avoid block lookup if we finish early.
                     if grasses >= 8:
                         break
-                    block = self.factory.world.sync_get_block((x, y, z))
+                    block = cursor.sync_get_block((x, y, z))
                     if block == blocks["grass"].slot:
                         grasses += 1
 
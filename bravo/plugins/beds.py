@@ -49,12 +49,8 @@ class Bed(object):
         if not player.inventory.consume((item.slot, 0), player.equipped):
             return False, builddata, False
 
-        self.factory.world.set_block((x, y, z), blocks["bed-block"].slot)
-        self.factory.world.set_block((x + dx, y, z + dz),
-                blocks["bed-block"].slot)
-        self.factory.world.set_metadata((x, y, z), metadata)
-        self.factory.world.set_metadata((x + dx, y, z + dz),
-                metadata | HEAD_PART)
+        self.factory.world.set_blocks([(x, y, z), (x + dx, y, z + dz)],
+                blocks["bed-block"].slot, [metadata, metadata | HEAD_PART])
 
         # XXX As we doing all of the building actions manually we cancel at this point.
         # This is not what we shall do, but now it's the best solution we have.
@@ -64,10 +64,34 @@ class Status(object):
             dirty = len([i for i in protocol.chunks.values() if i.dirty])
             yield "%s: %d chunks (%d dirty)" % (name, count, dirty)
 
-        chunk_count = 0 # len(self.factory.world.chunk_cache)
-        dirty = len(self.factory.world._cache._dirty)
-        chunk_count += dirty
-        yield "World cache: %d chunks (%d dirty)" % (chunk_count, dirty)
+        cache = self.factory.world._cache
+        yield "World cache: %d chunks (%d dirty)" % (len(cache),
+                                                     cache.dirty_count())
+        yield "World cache: %d hits, %d misses, %d evictions" % (
+            cache.hits, cache.misses, cache.evictions)
+
+        flusher = self.factory.world.flusher
+        yield "Flusher: %d behind (about %ds), %d written" % (
+            flusher.backlog, flusher.estimate(), flusher.flushed)
+        yield "Flusher: %.1fs average latency, %.1fs worst" % (
+            flusher.average_latency, flusher.max_latency)
+
+        compactor = self.factory.world.compactor
+        yield "Compactor: %d runs, %d KiB reclaimed" % (
+            compactor.compactions, compactor.reclaimed // 1024)
+
+        scheduler = self.factory.world.scheduler
+        yield "Chunk requests: %d queued, %d running, %d cancelled" % (
+            scheduler.queued, scheduler.running, scheduler.cancelled)
+
+        prefetcher = self.factory.prefetcher
+        yield "Prefetch: %d chunks, %d used, %d wasted (%d%% accurate)" % (
+            prefetcher.prefetched, prefetcher.used, prefetcher.wasted,
+            prefetcher.accuracy * 100)
+
+        packets = self.factory.chunk_packets
+        yield "Packet cache: %d chunks, %d KiB (%d hits, %d misses)" % (
+            len(packets), packets.size // 1024, packets.hits, packets.misses)
 
     name = "status"
     aliases = tuple()
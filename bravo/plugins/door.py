@@ -158,10 +158,8 @@ class Door(object):
                 # mirror the door: rotate 90deg and open (sic!)
                 metadata = ((metadata + 3) % 4) | DOOR_IS_SWUNG
 
-        world.set_block((x, y, z), blocks[entity_name].slot)
-        world.set_block((x, y + 1, z), blocks[entity_name].slot)
-        world.set_metadata((x, y, z), metadata)
-        world.set_metadata((x, y + 1, z), metadata | DOOR_TOP_BLOCK)
+        world.set_blocks([(x, y, z), (x, y + 1, z)], blocks[entity_name].slot,
+                         [metadata, metadata | DOOR_TOP_BLOCK])
 
         return False, builddata, True
 
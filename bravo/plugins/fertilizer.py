@@ -41,9 +41,13 @@ class Fertilizer(object):
 
                 # Select correct treee and coordinates, then build tree.
                 tree = self.trees[metadata % 4](pos=(x, y, z))
-                tree.prepare(self.factory.world)
-                tree.make_trunk(self.factory.world)
-                tree.make_foliage(self.factory.world)
+                # Grow the whole tree in one batch, so that the chunks only
+                # catch up on their lighting once.
+                with self.factory.world.batch() as world:
+                    cursor = world.cursor()
+                    tree.prepare(cursor)
+                    tree.make_trunk(cursor)
+                    tree.make_foliage(cursor)
                 # We can't easily tell how many chunks were modified, so we
                 # have to flush all of them.
                 self.factory.flush_all_chunks()
@@ -7,9 +7,9 @@ from random import Random
 from zope.interface import implements
 
 from bravo.blocks import blocks
-from bravo.chunk import CHUNK_HEIGHT, XZ, iterchunk
 from bravo.ibravo import ITerrainGenerator
 from bravo.simplex import octaves2, octaves3, set_seed
+from bravo.utilities.coords import CHUNK_HEIGHT, XZ, iterchunk
 from bravo.utilities.maths import morton2
 
 R = Random()
@@ -31,7 +31,7 @@ class BoringGenerator(object):
         # Optimized fill. Fill the bottom eight sections with stone.
         stone = array("B", [blocks["stone"].slot] * 16 * 16 * 16)
         for section in chunk.sections[:8]:
-            section.blocks[:] = stone[:]
+            section.blocks = stone[:]
 
     name = "boring"
 
@@ -251,30 +251,35 @@ class Fluid(object):
             self.new.add(below)
 
     def process(self):
-        w = self.factory.world
-
-        for x, y, z in self.tracked:
-            # Try each block separately. If it can't be done, it'll be
-            # discarded from the set simply by not being added to the new set
-            # for the next iteration.
-            try:
-                block = w.sync_get_block((x, y, z))
-                if block == self.sponge:
-                    self.add_sponge(w, x, y, z)
-                elif block == self.spring:
-                    self.add_spring(w, x, y, z)
-                elif block == self.fluid:
-                    self.add_fluid(w, x, y, z)
-                else:
-                    # Hm, why would a pending block not be any of the things
-                    # we care about? Maybe it used to be a spring or
-                    # something?
-                    if (x, z) in self.springs:
-                        self.remove_spring(x, y, z)
-                    elif (x, y, z) in self.sponges:
-                        self.remove_sponge(x, y, z)
-            except ChunkNotLoaded:
-                pass
+        # Fluids only ever look at their neighbors, so a cursor saves
+        # looking up the same few chunks over and over.
+        w = self.factory.world.cursor()
+
+        # Process everything in one batch, so that the chunks only catch up
+        # on their lighting once per step.
+        with self.factory.world.batch():
+            for x, y, z in self.tracked:
+                # Try each block separately. If it can't be done, it'll be
+                # discarded from the set simply by not being added to the new
+                # set for the next iteration.
+                try:
+                    block = w.sync_get_block((x, y, z))
+                    if block == self.sponge:
+                        self.add_sponge(w, x, y, z)
+                    elif block == self.spring:
+                        self.add_spring(w, x, y, z)
+                    elif block == self.fluid:
+                        self.add_fluid(w, x, y, z)
+                    else:
+                        # Hm, why would a pending block not be any of the
+                        # things we care about? Maybe it used to be a spring
+                        # or something?
+                        if (x, z) in self.springs:
+                            self.remove_spring(x, y, z)
+                        elif (x, y, z) in self.sponges:
+                            self.remove_sponge(x, y, z)
+                except ChunkNotLoaded:
+                    pass
 
         # Flush affected chunks.
         to_flush = set()
@@ -309,8 +314,9 @@ class Fluid(object):
                 self.tracked.add(coords)
 
         else:
-            for coords in iterneighbors(x, y, z):
-                test_block = yield self.factory.world.get_block(coords)
+            neighbors = list(iterneighbors(x, y, z))
+            found = yield self.factory.world.get_blocks(neighbors)
+            for coords, test_block in zip(neighbors, found):
                 if test_block in (self.spring, self.fluid):
                     self.tracked.add(coords)
 
@@ -65,6 +65,8 @@ class Redstone(object):
         affected = set()
         changed = set()
 
+        cursor = self.factory.world.cursor()
+
         for circuit in self.active_circuits:
             # Should we skip this circuit? This could happen if the circuit
             # was already updated due to a side effect (e.g., a wire group
@@ -77,7 +79,7 @@ class Redstone(object):
             for coords in circuit.iter_outputs():
                 try:
                     if (coords not in self.asic.circuits and
-                        self.factory.world.sync_get_block(coords)):
+                        cursor.sync_get_block(coords)):
                         # Create a new circuit for this plain block and set it
                         # to be updated next tick. Odds are good it's a plain
                         # block anyway.
@@ -94,18 +96,19 @@ class Redstone(object):
             changed.update(updated)
             affected.update(outputs)
 
-        for circuit in changed:
-            # Get the world data...
-            coords = circuit.coords
-            block = self.factory.world.sync_get_block(coords)
-            metadata = self.factory.world.sync_get_metadata(coords)
+        with self.factory.world.batch():
+            for circuit in changed:
+                # Get the world data...
+                coords = circuit.coords
+                block = cursor.sync_get_block(coords)
+                metadata = cursor.sync_get_metadata(coords)
 
-            # ...truthify it...
-            block, metadata = circuit.to_block(block, metadata)
+                # ...truthify it...
+                block, metadata = circuit.to_block(block, metadata)
 
-            # ...and send it back out.
-            self.factory.world.sync_set_block(coords, block)
-            self.factory.world.sync_set_metadata(coords, metadata)
+                # ...and send it back out.
+                cursor.sync_set_block(coords, block)
+                cursor.sync_set_metadata(coords, metadata)
 
         self.active_circuits = affected
 
@@ -5,6 +5,11 @@ import os
 from StringIO import StringIO
 from urlparse import urlparse
 
+from twisted.internet import reactor
+from twisted.internet.defer import (Deferred, DeferredList, DeferredLock,
+                                    DeferredSemaphore, succeed)
+from twisted.internet.task import deferLater
+from twisted.internet.threads import deferToThread
 from twisted.python import log
 from twisted.python.filepath import FilePath
 from zope.interface import implements
@@ -19,8 +24,9 @@ from bravo.location import Location, Orientation, Position
 from bravo.nbt import NBTFile
 from bravo.nbt import TAG_Compound, TAG_List, TAG_Byte_Array, TAG_String
 from bravo.nbt import TAG_Double, TAG_Long, TAG_Short, TAG_Int, TAG_Byte
-from bravo.region import MissingChunk, Region
-from bravo.utilities.bits import unpack_nibbles, pack_nibbles
+from bravo.region import MissingChunk, RegionCache
+from bravo.utilities.bits import unpack_nibbles
+from bravo.utilities.coords import CHUNK_HEIGHT, XZ
 from bravo.utilities.paths import name_for_anvil
 
 class Anvil(object):
@@ -28,13 +34,62 @@ class Anvil(object):
     Minecraft Anvil world serializer.
 
     This serializer interacts with the modern Minecraft Anvil world format.
+
+    Chunks are rendered, compressed, and read and written in threads, so that
+    the reactor isn't stuck waiting on the disk. Reads and writes of any one
+    region happen in the order that they were asked for.
+
+    Recently used regions are kept open, with their headers loaded, until
+    ``close()``.
+
+    Chunks which are saved one after another, with nothing else asked of
+    their region in between, are written to it together, in one journaled
+    batch.
+
+    Regions which chunks have been written to are compacted, one at a time,
+    by ``compact()``, once enough of them is free pages.
     """
 
     implements(ISerializer)
 
     name = "anvil"
 
+    threads = 2
+    """
+    How many chunks may be read or written at once.
+    """
+
+    threaded = True
+    """
+    Whether chunks are read and written in threads. This is turned off when
+    the reactor shuts down, so that the last chunks are still written out.
+    """
+
+    regions = 16
+    """
+    How many regions to keep open.
+    """
+
+    mapped = True
+    """
+    Whether to memory-map regions for reading.
+    """
+
+    compact_waste = 0.25
+    """
+    How much of a region's file, as a fraction, has to be free pages before
+    the region is compacted.
+    """
+
+    _trigger = None
+
     def __init__(self):
+        self._regions = {}
+        self._written = {}
+        self._batches = {}
+        self._semaphore = DeferredSemaphore(self.threads)
+        self._region_cache = RegionCache(self.regions)
+
         self._entity_loaders = {
             "Chicken": lambda entity, tag: None,
             "Cow": lambda entity, tag: None,
@@ -100,6 +155,178 @@ class Anvil(object):
     def _write_tag(self, fp, tag):
         tag.write_file(fileobj=fp.open("w"))
 
+    def _region_for(self, x, z):
+        return self.folder.child("region").child(name_for_anvil(x, z))
+
+    def _run(self, fp, f, *args):
+        """
+        Run a function in a thread, once everything already queued for the
+        region has finished.
+
+        :returns: a ``Deferred`` which fires with the function's result
+        """
+
+        if self.threaded:
+            return self._queue(fp.path, self._semaphore.run, deferToThread,
+                               f, *args)
+        return self._queue(fp.path, f, *args)
+
+    def _run_region(self, x, z, f, *args):
+        """
+        Run a function with a chunk's region, as with ``_run()``.
+        """
+
+        fp = self._region_for(x, z)
+        region = self._region_cache.get(fp)
+        d = self._run(fp, f, region, *args)
+
+        # Make room for this region, now that it's busy and can't be closed.
+        self._region_cache.evict(self._regions)
+
+        return d
+
+    def _queue(self, path, f, *args):
+        # Anything else asked of the region has to wait for the batch which
+        # is being gathered for it, so later chunks can't join that batch.
+        self._batches.pop(path, None)
+
+        lock = self._regions.get(path)
+        if lock is None:
+            lock = self._regions[path] = DeferredLock()
+
+        d = lock.run(f, *args)
+
+        @d.addBoth
+        def cleanup(result):
+            if (not lock.locked and not lock.waiting and
+                self._regions.get(path) is lock):
+                del self._regions[path]
+            return result
+
+        return d
+
+    def _shutdown(self):
+        # The trigger is firing, so there's nothing to remove anymore.
+        self._trigger = None
+        self.threaded = False
+        return self.drain()
+
+    def drain(self):
+        """
+        Wait for every chunk which has been queued to be read or written.
+
+        :returns: a ``Deferred`` which fires when the queues are empty
+        """
+
+        return DeferredList([self._queue(path, lambda: None)
+                             for path in self._regions.keys()])
+
+    def _read_chunk(self, region, chunk):
+        """
+        Read and parse a chunk's tag. This is run in a thread.
+        """
+
+        try:
+            region.open()
+            if self.mapped:
+                region.map()
+            data = region.get_chunk(chunk.x, chunk.z)
+            return NBTFile(buffer=StringIO(data))
+        except MissingChunk:
+            raise SerializerReadException("No chunk %r in region" % chunk)
+        except Exception, e:
+            raise SerializerReadException("%r couldn't be loaded: %s" %
+                    (chunk, e))
+
+    def _save_batch(self, x, z, tag):
+        """
+        Add a chunk's tag to the batch being gathered for its region,
+        starting a new batch if there isn't one.
+
+        :returns: a ``Deferred`` which fires once the batch is written
+        """
+
+        fp = self._region_for(x, z)
+        waiter = Deferred()
+
+        batch = self._batches.get(fp.path)
+        if batch is not None:
+            tags, waiters = batch
+            tags[x, z] = tag
+            waiters.append(waiter)
+            return waiter
+
+        tags, waiters = batch = {(x, z): tag}, [waiter]
+        region = self._region_cache.get(fp)
+
+        if self.threaded:
+            # Give the rest of this turn's chunks a chance to join in.
+            d = self._queue(fp.path, deferLater, reactor, 0,
+                            self._start_batch, region, fp.path, batch)
+        else:
+            # There might not be a reactor running to wait a turn with, so
+            # start right away; chunks can still join in while the batch
+            # waits behind anything else queued for the region.
+            d = self._queue(fp.path, self._start_batch, region, fp.path,
+                            batch)
+
+        @d.addBoth
+        def cb(result):
+            for waiter in waiters:
+                waiter.callback(result)
+
+        # Let more chunks join in, unless the batch has already been written.
+        if not waiter.called:
+            self._batches[fp.path] = batch
+        self._region_cache.evict(self._regions)
+
+        return waiter
+
+    def _start_batch(self, region, path, batch):
+        if self._batches.get(path) is batch:
+            del self._batches[path]
+
+        tags, waiters = batch
+        if self.threaded:
+            return self._semaphore.run(deferToThread, self._write_chunks,
+                                       region, tags)
+        return self._write_chunks(region, tags)
+
+    def _write_chunks(self, region, tags):
+        """
+        Render chunks' tags and write them. This is run in a thread.
+        """
+
+        chunks = {}
+        for key, tag in tags.iteritems():
+            b = StringIO()
+            tag.write_file(buffer=b)
+            chunks[key] = b.getvalue()
+
+        # Allocate the region and put the chunks into it. Use ensure()
+        # instead of create() so that we don't trash the region.
+        try:
+            region.ensure()
+            region.open()
+            region.put_chunks(chunks)
+        except IOError, e:
+            raise SerializerWriteException("Couldn't write to region: %r" % e)
+
+    def _compact_region(self, region):
+        """
+        Compact a region if it's wasteful enough. This is run in a thread.
+        """
+
+        try:
+            region.open()
+            if region.positions is None:
+                region.load_pages()
+            if region.wasted <= region.size * self.compact_waste:
+                return 0
+            return region.compact()
+        except EnvironmentError, e:
+            raise SerializerWriteException("Couldn't compact region: %r" % e)
+
     # Entity serializers.
 
     def _load_entity_from_tag(self, tag):
@@ -281,24 +508,30 @@ class Anvil(object):
 
         level = tag["Level"]
 
-        # These fromstring() calls are designed to raise if there are any
-        # issues, but still be speedy.
-
         # Loop through the sections and unpack anything that we find.
         for tag in level["Sections"].tags:
             index = tag["Y"].value
-            section = Section()
-            section.blocks = array("B")
-            section.blocks.fromstring(tag["Blocks"].value)
-            section.metadata = array("B", unpack_nibbles(tag["Data"].value))
-            section.skylight = array("B",
-                                     unpack_nibbles(tag["SkyLight"].value))
-            chunk.sections[index] = section
+            blocklight = None
+            if "BlockLight" in tag:
+                blocklight = tag["BlockLight"].value
+            chunk.sections[index] = Section.from_packed(tag["Blocks"].value,
+                                                        tag["Data"].value,
+                                                        tag["SkyLight"].value,
+                                                        blocklight)
 
         chunk.heightmap = array("B")
         chunk.heightmap.fromstring(level["HeightMap"].value)
-        chunk.blocklight = array("B",
-            unpack_nibbles(level["BlockLight"].value))
+
+        # Older Bravo worlds kept block light for the entire chunk, rather
+        # than per section. It's indexed in x, z, y order.
+        if "BlockLight" in level and level["BlockLight"].value:
+            blocklight = unpack_nibbles(level["BlockLight"].value)
+            for x, z in XZ:
+                offset = (x * 16 + z) * CHUNK_HEIGHT
+                for i, section in enumerate(chunk.sections):
+                    start = offset + i * 16
+                    section.set_blocklight_column(x, z,
+                                                  blocklight[start:start + 16])
 
         chunk.populated = bool(level["TerrainPopulated"])
 
@@ -335,25 +568,25 @@ class Anvil(object):
         level["zPos"] = TAG_Int(chunk.z)
 
         level["HeightMap"] = TAG_Byte_Array()
-        level["BlockLight"] = TAG_Byte_Array()
-        level["SkyLight"] = TAG_Byte_Array()
 
         level["Sections"] = TAG_List(type=TAG_Compound)
         for i, s in enumerate(chunk.sections):
-            if s:
+            if not s.is_uniform():
+                blocks, metadata, skylight, blocklight = s.pack()
                 section = TAG_Compound()
                 section.name = ""
                 section["Y"] = TAG_Byte(i)
                 section["Blocks"] = TAG_Byte_Array()
-                section["Blocks"].value = s.blocks.tostring()
+                section["Blocks"].value = blocks
                 section["Data"] = TAG_Byte_Array()
-                section["Data"].value = pack_nibbles(s.metadata)
+                section["Data"].value = metadata
                 section["SkyLight"] = TAG_Byte_Array()
-                section["SkyLight"].value = pack_nibbles(s.skylight)
+                section["SkyLight"].value = skylight
+                section["BlockLight"] = TAG_Byte_Array()
+                section["BlockLight"].value = blocklight
                 level["Sections"].tags.append(section)
 
         level["HeightMap"].value = chunk.heightmap.tostring()
-        level["BlockLight"].value = pack_nibbles(chunk.blocklight)
 
         level["TerrainPopulated"] = TAG_Byte(chunk.populated)
 
@@ -444,43 +677,65 @@ class Anvil(object):
             except os.error:
                 raise Exception("Could not create world in %s" % self.folder)
 
+        if self._trigger is None:
+            self._trigger = reactor.addSystemEventTrigger("before",
+                "shutdown", self._shutdown)
+
+    def close(self):
+        """
+        Wait for every queued chunk, and then close every open region.
+        """
+
+        self._written.clear()
+
+        if self._trigger is not None:
+            reactor.removeSystemEventTrigger(self._trigger)
+            self._trigger = None
+
+        d = self.drain()
+        d.addCallback(lambda none: self._region_cache.close())
+        return d
+
+    def compact(self):
+        """
+        Compact one of the regions which chunks have been written to since it
+        was last looked at, if enough of it is free pages.
+
+        :returns: a ``Deferred`` which fires with the number of bytes
+            reclaimed
+        """
+
+        if not self._written:
+            return succeed(0)
+
+        path, (x, z) = self._written.popitem()
+        return self._run_region(x, z, self._compact_region)
+
     def load_chunk(self, x, z):
-        name = name_for_anvil(x, z)
-        fp = self.folder.child("region").child(name)
-        region = Region(fp)
         chunk = Chunk(x, z)
+        d = self._run_region(x, z, self._read_chunk, chunk)
 
-        try:
-            data = region.get_chunk(x, z)
-            tag = NBTFile(buffer=StringIO(data))
-            self._load_chunk_from_tag(chunk, tag)
-        except MissingChunk:
-            raise SerializerReadException("No chunk %r in region" % chunk)
-        except Exception, e:
-            raise SerializerReadException("%r couldn't be loaded: %s" %
-                    (chunk, e))
+        @d.addCallback
+        def cb(tag):
+            try:
+                self._load_chunk_from_tag(chunk, tag)
+            except Exception, e:
+                raise SerializerReadException("%r couldn't be loaded: %s" %
+                        (chunk, e))
+            return chunk
 
-        return chunk
+        return d
 
     def save_chunk(self, chunk):
+        # Building the tag packs the chunk, so the tag is a snapshot of the
+        # chunk as it is right now, which the thread can take its time with.
         tag = self._save_chunk_to_tag(chunk)
 
-        b = StringIO()
-        tag.write_file(buffer=b)
-        data = b.getvalue()
+        # Remember the region, so that it gets a chance to be compacted.
+        fp = self._region_for(chunk.x, chunk.z)
+        self._written[fp.path] = chunk.x, chunk.z
 
-        name = name_for_anvil(chunk.x, chunk.z)
-        fp = self.folder.child("region").child(name)
-
-        # Allocate the region and put the chunk into it. Use ensure() instead
-        # of create() so that we don't trash the region.
-        region = Region(fp)
-
-        try:
-            region.ensure()
-            region.put_chunk(chunk.x, chunk.z, data)
-        except IOError, e:
-            raise SerializerWriteException("Couldn't write to region: %r" % e)
+        return self._save_batch(chunk.x, chunk.z, tag)
 
     def load_level(self):
         fp = self.folder.child("level.dat")
@@ -16,8 +16,9 @@ class Memory(object):
 
     ``Memory`` works by taking a deep copy of objects passed to it, to avoid
     taking GC references, and then returning deep copies of those objects when
-    asked. It saves nothing to disk, has no optimistic caching, and will
-    quickly run out of memory if handed too many things.
+    asked. Chunks are snapshotted instead, which shares their sections until
+    they are written to. It saves nothing to disk, has no optimistic caching,
+    and will quickly run out of memory if handed too many things.
     """
 
     implements(ISerializer)
@@ -36,14 +37,24 @@ class Memory(object):
         Dummy ``connect()`` for ``ISerializer``.
         """
 
+    def close(self):
+        """
+        Dummy ``close()`` for ``ISerializer``.
+        """
+
+    def compact(self):
+        """
+        Dummy ``compact()`` for ``ISerializer``.
+        """
+
     def load_chunk(self, x, z):
         key = x, z
         if key in self.chunks:
-            return deepcopy(self.chunks[key])
+            return self.chunks[key].snapshot()
         raise SerializerReadException("%d, %d couldn't be loaded" % key)
 
     def save_chunk(self, chunk):
-        self.chunks[chunk.x, chunk.z] = deepcopy(chunk)
+        self.chunks[chunk.x, chunk.z] = chunk.snapshot()
 
     def load_level(self):
         if self.level:
@@ -87,64 +87,67 @@ class Tracks(object):
         if world.sync_get_block((x, y - 1, z)) not in tracks_allowed_on:
             return
 
-        # Use facing direction of player to set correct track tile
-        yaw, pitch = player.location.ori.to_degs()
-        if 30 < yaw < 60:
-            metadata = CORNER_SE
-        elif 120 < yaw < 150:
-            metadata = CORNER_SW
-        elif 210 < yaw < 240:
-            metadata = CORNER_NW
-        elif 300 < yaw < 330:
-            metadata = CORNER_NE
-        elif 60 <= yaw <= 120 or 240 <= yaw <= 300:
-            # North and south ascending tracks, if there are already tracks to
-            # the north or south.
-            if (world.sync_get_block((x - 1, y + 1, z)) ==
-                blocks["tracks"].slot):
-                metadata = ASCEND_N
-            elif (world.sync_get_block((x + 1, y + 1, z)) ==
-                  blocks["tracks"].slot):
-                metadata = ASCEND_S
+        # Adjacent tracks may be adjusted along with the new one, so make all
+        # of the changes in one batch.
+        with world.batch():
+            # Use facing direction of player to set correct track tile
+            yaw, pitch = player.location.ori.to_degs()
+            if 30 < yaw < 60:
+                metadata = CORNER_SE
+            elif 120 < yaw < 150:
+                metadata = CORNER_SW
+            elif 210 < yaw < 240:
+                metadata = CORNER_NW
+            elif 300 < yaw < 330:
+                metadata = CORNER_NE
+            elif 60 <= yaw <= 120 or 240 <= yaw <= 300:
+                # North and south ascending tracks, if there are already
+                # tracks to the north or south.
+                if (world.sync_get_block((x - 1, y + 1, z)) ==
+                    blocks["tracks"].slot):
+                    metadata = ASCEND_N
+                elif (world.sync_get_block((x + 1, y + 1, z)) ==
+                      blocks["tracks"].slot):
+                    metadata = ASCEND_S
+                else:
+                    metadata = FLAT_NS
+
+                # If there are tracks to the north or south on the next Z-level
+                # down, they should be adjusted to ascend to this level.
+                target = x - 1, y - 1, z
+                if (world.sync_get_block(target) == blocks["tracks"].slot
+                    and world.sync_get_metadata(target) == FLAT_NS):
+                    world.sync_set_metadata(target, ASCEND_S)
+
+                target = x + 1, y - 1, z
+                if (world.sync_get_block(target) == blocks["tracks"].slot
+                    and world.sync_get_metadata(target) == FLAT_NS):
+                    world.sync_set_metadata(target, ASCEND_N)
+            # And this last range is east/west.
             else:
-                metadata = FLAT_NS
-
-            # If there are tracks to the north or south on the next Z-level
-            # down, they should be adjusted to ascend to this level.
-            target = x - 1, y - 1, z
-            if (world.sync_get_block(target) == blocks["tracks"].slot
-                and world.sync_get_metadata(target) == FLAT_NS):
-                world.sync_set_metadata(target, ASCEND_S)
-
-            target = x + 1, y - 1, z
-            if (world.sync_get_block(target) == blocks["tracks"].slot
-                and world.sync_get_metadata(target) == FLAT_NS):
-                world.sync_set_metadata(target, ASCEND_N)
-        # And this last range is east/west.
-        else:
-            # east or west
-            if (world.sync_get_block((x, y + 1, z + 1)) ==
-                blocks["tracks"].slot):
-                metadata = ASCEND_W
-            elif (world.sync_get_block((x, y + 1, z - 1)) ==
-                  blocks["tracks"].slot):
-                metadata = ASCEND_E
-            else:
-                metadata = FLAT_EW
-
-            # check and adjust ascending tracks
-            target = x, y - 1, z - 1
-            if (world.sync_get_block(target) == blocks["tracks"].slot
-                and world.sync_get_metadata(target) == FLAT_EW):
-                world.sync_set_metadata(target, ASCEND_W)
-
-            target = x, y - 1, z + 1
-            if (world.sync_get_block(target) == blocks["tracks"].slot
-                and world.sync_get_metadata(target) == FLAT_EW):
-                world.sync_set_metadata(target, ASCEND_E)
-
-        # And finally, set the new metadata.
-        world.sync_set_metadata((x, y, z), metadata)
+                # east or west
+                if (world.sync_get_block((x, y + 1, z + 1)) ==
+                    blocks["tracks"].slot):
+                    metadata = ASCEND_W
+                elif (world.sync_get_block((x, y + 1, z - 1)) ==
+                      blocks["tracks"].slot):
+                    metadata = ASCEND_E
+                else:
+                    metadata = FLAT_EW
+
+                # check and adjust ascending tracks
+                target = x, y - 1, z - 1
+                if (world.sync_get_block(target) == blocks["tracks"].slot
+                    and world.sync_get_metadata(target) == FLAT_EW):
+                    world.sync_set_metadata(target, ASCEND_W)
+
+                target = x, y - 1, z + 1
+                if (world.sync_get_block(target) == blocks["tracks"].slot
+                    and world.sync_get_metadata(target) == FLAT_EW):
+                    world.sync_set_metadata(target, ASCEND_E)
+
+            # And finally, set the new metadata.
+            world.sync_set_metadata((x, y, z), metadata)
 
     def dig_hook(self, chunk, x, y, z, block):
         """
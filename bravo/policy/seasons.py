@@ -54,6 +54,10 @@ class Winter(object):
     implements(ISeason)
 
     def transform(self, chunk):
+        # Chunks without any blocks have nothing to freeze or snow on.
+        if not any(chunk.sections):
+            return
+
         chunk.sed(blocks["spring"].slot, blocks["ice"].slot)
 
         # Make sure that the heightmap is valid so that we don't spawn
@@ -1,35 +1,331 @@
+from bisect import bisect_left, insort
+from contextlib import contextmanager
 from gzip import GzipFile
+import mmap
+import os
 from StringIO import StringIO
-from struct import pack, unpack
+from struct import pack, unpack, unpack_from
+import zlib
+
+from bravo.utilities.maths import morton2
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
 
 class MissingChunk(Exception):
     """
     The requested chunk isn't in this region.
     """
 
+def pack_header(positions):
+    """
+    Pack up a region's header page.
+
+    :param dict positions: the first page and the number of pages of each
+        chunk, by chunk coordinates within the region
+    """
+
+    header = [0] * 1024
+    for (x, z), (position, pages) in positions.iteritems():
+        header[x + z * 32] = position << 8 | pages
+    return pack(">1024L", *header)
+
+class FreeExtents(object):
+    """
+    The free pages of a region, kept as runs of consecutive pages.
+
+    Runs are kept in two sorted lists: by where they start, so that freed
+    runs can be merged with their neighbors, and by how long they are, so
+    that allocations can take the smallest run which fits. Both are found
+    by binary search, so old, fragmented regions cost no more to allocate
+    from than new ones.
+    """
+
+    def __init__(self):
+        self._starts = []
+        self._sizes = []
+        self._lengths = {}
+
+    def __len__(self):
+        """
+        The number of free pages.
+        """
+
+        return sum(self._lengths.itervalues())
+
+    def __iter__(self):
+        """
+        Iterate over the free runs, as tuples of their first page and their
+        length, in page order.
+        """
+
+        for start in self._starts:
+            yield start, self._lengths[start]
+
+    def __contains__(self, page):
+        i = bisect_left(self._starts, page + 1) - 1
+        if i < 0:
+            return False
+        start = self._starts[i]
+        return page < start + self._lengths[start]
+
+    @classmethod
+    def from_used(cls, used, first, end):
+        """
+        Find the free runs between some used ones.
+
+        :param list used: tuples of the first page and length of each used
+            run; they may overlap
+        :param int first: the first page which could be free
+        :param int end: the page after the last page which could be free
+        """
+
+        extents = cls()
+        page = first
+        for start, length in sorted(used):
+            if page >= end:
+                break
+            if start > page:
+                extents._add(page, min(start, end) - page)
+            page = max(page, start + length)
+        if page < end:
+            extents._add(page, end - page)
+        return extents
+
+    def _add(self, start, length):
+        insort(self._starts, start)
+        insort(self._sizes, (length, start))
+        self._lengths[start] = length
+
+    def _remove(self, start):
+        length = self._lengths.pop(start)
+        del self._starts[bisect_left(self._starts, start)]
+        del self._sizes[bisect_left(self._sizes, (length, start))]
+        return length
+
+    def free(self, start, length):
+        """
+        Mark a run of pages as free, merging it with any free runs on either
+        side of it.
+        """
+
+        if length <= 0:
+            return
+
+        i = bisect_left(self._starts, start)
+
+        if i:
+            before = self._starts[i - 1]
+            if before + self._lengths[before] == start:
+                length += self._remove(before)
+                start = before
+                i -= 1
+
+        if i < len(self._starts) and self._starts[i] == start + length:
+            length += self._remove(start + length)
+
+        self._add(start, length)
+
+    def allocate(self, length):
+        """
+        Take a run of pages from the smallest free run which is long enough,
+        preferring the earliest of equally long runs.
+
+        :returns: the first page of the run, or None if no free run is long
+            enough
+        """
+
+        i = bisect_left(self._sizes, (length, 0))
+        if i == len(self._sizes):
+            return None
+
+        size, start = self._sizes[i]
+        self._remove(start)
+        if size > length:
+            self._add(start + length, size - length)
+        return start
+
+    def take_tail(self, end):
+        """
+        Take the free run which ends at a given page, if there is one.
+
+        A chunk which doesn't fit anywhere can start in the free run at the
+        end of the file and grow the file from there, rather than leaving the
+        run behind it.
+
+        :returns: the first page of the run, or None
+        """
+
+        if self._starts:
+            start = self._starts[-1]
+            if start + self._lengths[start] == end:
+                self._remove(start)
+                return start
+        return None
+
 class Region(object):
     """
     An MCRegion-style paged chunk file.
+
+    Regions open their file for every read and write, unless they have been
+    opened with ``open()``, in which case they keep one handle until they're
+    closed.
+
+    Regions can also be memory-mapped with ``map()``, so that chunks are
+    decompressed straight out of the map instead of being read into strings
+    first.
     """
 
     free_pages = None
+    """
+    The region's free pages, as ``FreeExtents``, once the pages have been
+    loaded.
+    """
+
     positions = None
 
+    handle = None
+    """
+    The region's file, while it's open.
+    """
+
+    size = None
+    """
+    The size of the region's file, once the pages have been loaded.
+    """
+
+    mapping = None
+    """
+    A read-only memory map of the region's file, while it's mapped.
+    """
+
     def __init__(self, fp):
         self.fp = fp
 
-    def load_pages(self):
+    def open(self):
+        """
+        Open the region's file, and keep it open until ``close()``.
+        """
+
+        if self.handle is None:
+            self.handle = self.fp.open("r+")
+
+    def close(self):
+        """
+        Close the region's file, if it's open, and unmap it, if it's mapped.
+        """
+
+        self.unmap()
+
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
+
+    def map(self):
+        """
+        Memory-map the region's file for reading.
+
+        Writes show up in the map, but the map doesn't grow along with the
+        file; chunks which are written past the end of the map are read from
+        the file instead. Mapping the region again picks them up. Nothing
+        happens if the region is already mapped and hasn't grown since.
+
+        :returns: whether the region is mapped
+        """
+
+        if self.mapping is not None:
+            if self.size is None or len(self.mapping) >= self.size:
+                return True
+            self.unmap()
+
+        try:
+            with self.fp.open("r") as handle:
+                self.mapping = mmap.mmap(handle.fileno(), 0,
+                                         access=mmap.ACCESS_READ)
+        except (EnvironmentError, ValueError):
+            # Empty files can't be mapped, and neither can files on some
+            # filesystems. Reading from the file works just as well.
+            self.mapping = None
+
+        return self.mapping is not None
+
+    def unmap(self):
+        """
+        Unmap the region's file, if it's mapped.
+        """
+
+        if self.mapping is not None:
+            self.mapping.close()
+            self.mapping = None
+
+    @contextmanager
+    def _file(self, mode):
+        if self.handle is not None:
+            yield self.handle
+        else:
+            with self.fp.open(mode) as handle:
+                yield handle
+
+    @property
+    def journal(self):
+        """
+        The file which batches of writes are journaled to.
+        """
+
+        return self.fp.siblingExtension(".journal")
+
+    def recover(self):
+        """
+        Finish a batch of writes which was interrupted after it was
+        journaled.
+
+        Journals which weren't completely written are thrown away, since the
+        region's header hasn't been touched yet.
+
+        :returns: whether a batch was finished
+        """
+
+        journal = self.journal
+        if not journal.exists():
+            return False
+
+        data = journal.getContent()
+        header, checksum = data[:4096], data[4096:]
+        recovered = (len(header) == 4096 and
+                     checksum == pack(">l", zlib.crc32(header)))
+
+        if recovered:
+            with self._file("r+") as handle:
+                handle.seek(0)
+                handle.write(header)
+                handle.flush()
+                os.fsync(handle.fileno())
+
+        journal.remove()
+        return recovered
+
+    def load_pages(self, recover=True):
         """
         Prefetch the pages of a region.
+
+        Any interrupted batch of writes is finished first, unless recovery is
+        turned off. Read-only tools turn it off so that they don't touch the
+        region; nothing should be written to a region loaded that way.
+
+        :param bool recover: whether to finish interrupted batches
         """
 
-        with self.fp.open("r") as handle:
+        if recover:
+            self.recover()
+
+        with self._file("r") as handle:
+            handle.seek(0)
             page = handle.read(4096)
+            handle.seek(0, 2)
+            self.size = handle.tell()
 
-        # The + 1 is not gratuitous. Remember that range/xrange won't include
-        # the upper index, but we want it, so we need to increase our upper
-        # bound. Additionally, the first page is off-limits.
-        self.free_pages = set(xrange(2, (self.fp.getsize() // 4096) + 1))
         self.positions = {}
 
         for x in xrange(32):
@@ -40,8 +336,10 @@ class Region(object):
                 position >>= 8
                 if position and pages:
                     self.positions[x, z] = position, pages
-                    for i in xrange(pages):
-                        self.free_pages.discard(position + i)
+
+        # The header and the spare page are off-limits.
+        self.free_pages = FreeExtents.from_used(self.positions.values(), 2,
+                                                (self.size + 4095) // 4096)
 
     def create(self):
         """
@@ -50,27 +348,129 @@ class Region(object):
         If the region already exists, this will zero it out.
         """
 
+        # The file is about to be replaced, so let go of the old one.
+        reopen = self.handle is not None
+        remap = self.mapping is not None
+        self.close()
+
         # Create the file and zero out the header, plus a spare page for
         # Notchian software.
         self.fp.setContent("\x00" * 8192)
 
-        self.free_pages = set()
+        self.free_pages = FreeExtents()
         self.positions = {}
+        self.size = 8192
+
+        if reopen:
+            self.open()
+        if remap:
+            self.map()
 
     def ensure(self):
         """
         If this region's file does not already exist, create it.
         """
 
-        if not self.fp.exists():
+        if self.handle is None and not self.fp.exists():
             self.create()
 
+    @property
+    def wasted(self):
+        """
+        How many bytes of the region's file are free pages, once the pages
+        have been loaded.
+        """
+
+        return len(self.free_pages) * 4096
+
+    def compact(self):
+        """
+        Rewrite the region's file with its chunks packed together, leaving no
+        free pages between them.
+
+        Chunks are laid out along a Z-order curve, so that chunks which are
+        near each other in the world tend to be near each other in the file.
+        The new file is written next to the old one and then renamed over it,
+        so the region is never left half-compacted.
+
+        :returns: the number of bytes reclaimed
+        """
+
+        if self.positions is None:
+            self.load_pages()
+
+        reopen = self.handle is not None
+        remap = self.mapping is not None
+
+        temp = self.fp.siblingExtension(".compact")
+        positions = {}
+        position = 2
+
+        try:
+            with self._file("r") as source:
+                with temp.open("w") as target:
+                    # Keep the spare page, since Notchian software keeps chunk
+                    # timestamps in it.
+                    source.seek(4096)
+                    target.write("\x00" * 4096)
+                    target.write(source.read(4096).ljust(4096, "\x00"))
+
+                    for x, z in sorted(self.positions,
+                                       key=lambda key: morton2(*key)):
+                        # Copy the chunk as it is, without decompressing it.
+                        source.seek(self.positions[x, z][0] * 4096)
+                        data = source.read(4)
+                        if len(data) == 4:
+                            data += source.read(unpack(">L", data)[0])
+
+                        pages = (len(data) + 4095) // 4096
+                        target.write(data.ljust(pages * 4096, "\x00"))
+
+                        positions[x, z] = position, pages
+                        position += pages
+
+                    target.seek(0)
+                    target.write(pack_header(positions))
+                    target.flush()
+                    os.fsync(target.fileno())
+        except:
+            if temp.exists():
+                temp.remove()
+            raise
+
+        reclaimed = self.size - position * 4096
+
+        self.close()
+        temp.moveTo(self.fp)
+
+        self.free_pages = FreeExtents()
+        self.positions = positions
+        self.size = position * 4096
+
+        if reopen:
+            self.open()
+        if remap:
+            self.map()
+
+        return reclaimed
+
+    def _mapped(self, start, length):
+        """
+        Get a buffer of part of the map, or None if that part isn't mapped.
+        """
+
+        if self.mapping is None or start + length > len(self.mapping):
+            return None
+        return buffer(self.mapping, start, length)
+
     def get_chunk_header(self, x, z):
         position, pages = self.positions[x, z]
 
-        with self.fp.open("r") as handle:
-            handle.seek(position * 4096)
-            header = handle.read(5)
+        header = self._mapped(position * 4096, 5)
+        if header is None:
+            with self._file("r") as handle:
+                handle.seek(position * 4096)
+                header = handle.read(5)
 
         length = unpack(">L", header[:4])[0] - 1
         version = ord(header[4])
@@ -81,33 +481,49 @@ class Region(object):
         x %= 32
         z %= 32
 
-        if not self.positions:
+        if self.positions is None:
             self.load_pages()
 
         if (x, z) not in self.positions:
             raise MissingChunk((x, z))
 
         position, pages = self.positions[x, z]
-        length, version = self.get_chunk_header(x, z)
-
-        with self.fp.open("r") as handle:
-            handle.seek(position * 4096 + 5)
-            data = handle.read(length)
+        start = position * 4096
+
+        data = None
+        header = self._mapped(start, 5)
+        if header is not None:
+            length = unpack_from(">L", header)[0] - 1
+            version = ord(header[4])
+            data = self._mapped(start + 5, length)
+
+        if data is None:
+            # Not mapped, or written past the end of the map. Read the chunk's
+            # header along with all of its pages at once.
+            with self._file("r") as handle:
+                handle.seek(start)
+                data = handle.read(pages * 4096)
+                length = unpack(">L", data[:4])[0] - 1
+                if len(data) < length + 5:
+                    data += handle.read(length + 5 - len(data))
+
+            version = ord(data[4])
+            data = buffer(data, 5, length)
 
         if version == 1:
-            fileobj = GzipFile(fileobj=StringIO(data))
-            data = fileobj.read()
+            fileobj = GzipFile(fileobj=StringIO(str(data)))
+            return fileobj.read()
         elif version == 2:
-            data = data.decode("zlib")
+            return zlib.decompress(data)
 
-        return data
+        return str(data)
 
     def put_chunk(self, x, z, data):
         x %= 32
         z %= 32
         data = data.encode("zlib")
 
-        if not self.positions:
+        if self.positions is None:
             self.load_pages()
 
         if (x, z) in self.positions:
@@ -129,42 +545,210 @@ class Region(object):
         # This is a lot cheaper than an explicit vacuum, by the way!
         if not position or not pages or pages != needed_pages:
             # Deallocate our current home.
-            for i in xrange(pages):
-                self.free_pages.add(position + i)
-
-            # Find a new home for us.
-            found = False
-            for candidate in sorted(self.free_pages):
-                if all(candidate + i in self.free_pages
-                    for i in range(needed_pages)):
-                        # Excellent.
-                        position = candidate
-                        found = True
-                        break
+            if position and pages:
+                self.free_pages.free(position, pages)
 
-            # If we couldn't find a reusable run of pages, we should just go
-            # to the end of the file.
-            if not found:
-                position = (self.fp.getsize() + 4095) // 4096
+            # Find a new home for us, in the snuggest free run of pages.
+            position = self.free_pages.allocate(needed_pages)
 
-            # And allocate our new home.
-            for i in xrange(needed_pages):
-                self.free_pages.discard(position + i)
+            # If we couldn't find a reusable run of pages, we should just go
+            # to the end of the file, starting in any free pages already
+            # there.
+            if position is None:
+                end = (self.size + 4095) // 4096
+                position = self.free_pages.take_tail(end)
+                if position is None:
+                    position = end
 
         pages = needed_pages
 
         self.positions[x, z] = position, pages
 
-        # Write our payload.
-        with self.fp.open("r+") as handle:
+        self.size = max(self.size, position * 4096 + len(data))
+
+        with self._file("r+") as handle:
+            # Write our payload.
             handle.seek(position * 4096)
             handle.write(data)
 
-        # And now update the count page, as a separate operation, for some
-        # semblance of consistency.
-        with self.fp.open("r+") as handle:
-            # Write our position and page count.
+            # And now update the count page, as a separate write, for some
+            # semblance of consistency.
             offset = 4 * (x + z * 32)
             position = position << 8 | pages
             handle.seek(offset)
             handle.write(pack(">L", position))
+
+            # Don't leave anything sitting in the handle's buffer.
+            handle.flush()
+
+    def put_chunks(self, chunks):
+        """
+        Write a batch of chunks at once.
+
+        The whole batch is given one run of new pages up front, and written
+        out in one go, before the header is rewritten in one go. The new
+        header is written to the journal first, and ``load_pages()`` replays
+        it if writing the header was interrupted. Until then, the old header
+        points at the old copies of the chunks, which are left alone, so the
+        region ends up with either all of the batch or none of it.
+
+        :param dict chunks: the data of each chunk, by chunk coordinates
+        """
+
+        if self.positions is None:
+            self.load_pages()
+
+        # Pack up the data, all ready to go.
+        batch = []
+        for (x, z), data in chunks.iteritems():
+            data = data.encode("zlib")
+            data = "%s\x02%s" % (pack(">L", len(data) + 1), data)
+            pages = (len(data) + 4095) // 4096
+            batch.append(((x % 32, z % 32), data.ljust(pages * 4096, "\x00")))
+
+        if not batch:
+            return
+
+        # Find one home for everybody, so that they can be written together.
+        needed = sum(len(data) // 4096 for key, data in batch)
+        end = (self.size + 4095) // 4096
+        start = self.free_pages.allocate(needed)
+        if start is None:
+            start = self.free_pages.take_tail(end)
+            if start is None:
+                start = end
+
+        positions = dict(self.positions)
+        old = []
+        position = start
+        for key, data in batch:
+            if key in positions:
+                old.append(positions[key])
+            positions[key] = position, len(data) // 4096
+            position += len(data) // 4096
+
+        header = pack_header(positions)
+        committed = False
+
+        try:
+            with self._file("r+") as handle:
+                handle.seek(start * 4096)
+                handle.write("".join(data for key, data in batch))
+                handle.flush()
+                os.fsync(handle.fileno())
+
+                # Commit the batch.
+                with self.journal.open("w") as journal:
+                    journal.write(header)
+                    journal.write(pack(">l", zlib.crc32(header)))
+                    journal.flush()
+                    os.fsync(journal.fileno())
+                committed = True
+
+                handle.seek(0)
+                handle.write(header)
+                handle.flush()
+                os.fsync(handle.fileno())
+        except:
+            if committed:
+                # The journal has the batch now, so let the next
+                # load_pages() finish it.
+                self.positions = None
+            elif start < end:
+                # Nothing points at the new pages, so they're free again.
+                self.free_pages.free(start, min(needed, end - start))
+            raise
+
+        self.journal.remove()
+
+        self.positions = positions
+        self.size = max(self.size, position * 4096)
+        for position, pages in old:
+            self.free_pages.free(position, pages)
+
+class RegionCache(object):
+    """
+    A cache of open regions.
+
+    Reading a chunk from a fresh region means opening its file and parsing
+    its header first, and those system calls add up when chunks are loaded
+    one at a time. Regions in the cache keep their headers, their free pages,
+    and their files open between chunks.
+
+    Only so many regions are kept. The least recently used regions are closed
+    and dropped to make room, unless they're busy.
+
+    :ivar int hits: the number of lookups which found a region
+    :ivar int misses: the number of lookups which didn't find a region
+    :ivar int evictions: the number of regions closed to make room
+    """
+
+    def __init__(self, limit=16):
+        """
+        :param int limit: the most regions to keep open
+        """
+
+        self.limit = limit
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._regions = OrderedDict()
+
+    def __len__(self):
+        return len(self._regions)
+
+    def __contains__(self, path):
+        return path in self._regions
+
+    def get(self, fp):
+        """
+        Get the region for a file.
+
+        Regions which aren't in the cache are added to it, but aren't opened;
+        whoever uses the region should ``open()`` it.
+
+        :param `FilePath` fp: the region's file
+        :returns: a ``Region``
+        """
+
+        region = self._regions.pop(fp.path, None)
+        if region is None:
+            self.misses += 1
+            region = Region(fp)
+        else:
+            self.hits += 1
+
+        # Put it at the most recently used end.
+        self._regions[fp.path] = region
+        return region
+
+    def evict(self, busy=()):
+        """
+        Close and drop the least recently used regions, until the cache is
+        back within its limit.
+
+        :param busy: the paths of regions which are in use, and must not be
+            closed
+        """
+
+        excess = len(self._regions) - self.limit
+
+        for path in self._regions.keys():
+            if excess <= 0:
+                break
+            if path in busy:
+                continue
+            self._regions.pop(path).close()
+            self.evictions += 1
+            excess -= 1
+
+    def close(self):
+        """
+        Close and drop every region.
+        """
+
+        for region in self._regions.itervalues():
+            region.close()
+        self._regions.clear()
@@ -1,59 +1,209 @@
-from ampoule import AMPChild
-import ampoule.pool
+from array import array
+from multiprocessing import Pool
+import traceback
 
-from twisted.protocols.amp import ListOf, Command, Integer, String
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred
 
 from bravo.chunk import Chunk
+from bravo.errors import ChunkGenerationError
+from bravo.geometry.section import Section
 from bravo.ibravo import ITerrainGenerator
 from bravo.plugin import retrieve_sorted_plugins
 
-class MakeChunk(Command):
-    arguments = [
-        ("x", Integer()),
-        ("z", Integer()),
-        ("seed", Integer()),
-        ("generators", ListOf(String())),
-    ]
-    response = [
-        ("blocks", String()),
-        ("metadata", String()),
-        ("skylight", String()),
-        ("blocklight", String()),
-        ("heightmap", String()),
-    ]
-    errors = {
-        Exception: "Exception",
-    }
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
 
-class Slave(AMPChild):
+# Generator pipelines, by the names of their generators. Each worker process
+# looks up its plugins once and keeps them.
+pipelines = {}
+
+def make_chunk(x, z, seed, generators):
+    """
+    Generate a chunk and pack it up.
+
+    This is run in the worker processes.
+
+    :returns: a list of the chunk's non-uniform sections, as tuples of the
+        section's index followed by its packed arrays, and the chunk's packed
+        height map
+    """
+
+    key = tuple(generators)
+    if key not in pipelines:
+        pipelines[key] = retrieve_sorted_plugins(ITerrainGenerator,
+                                                 generators)
+
+    chunk = Chunk(x, z)
+
+    for stage in pipelines[key]:
+        stage.populate(chunk, seed)
+
+    chunk.regenerate()
+
+    sections = [(i,) + section.pack()
+                for i, section in enumerate(chunk.sections)
+                if not section.is_uniform()]
+
+    return sections, chunk.heightmap.tostring()
+
+def fill_chunk(chunk, packed):
+    """
+    Fill a chunk with geometry packed up by ``make_chunk()``.
+
+    :returns: the chunk
+    """
+
+    sections, heightmap = packed
+
+    for index, blocks, metadata, skylight, blocklight in sections:
+        chunk.sections[index] = Section.from_packed(blocks, metadata,
+                                                    skylight, blocklight)
+
+    chunk.heightmap = array("B", heightmap)
+
+    return chunk
+
+def attempt(f, *args):
     """
-    Process-based peon for processing and populating.
+    Call a function, catching any exception and formatting it, since
+    exceptions don't always survive the trip back from a worker process.
+
+    :returns: a tuple of whether the call succeeded, and either the result
+        or the formatted traceback
+    """
+
+    try:
+        return True, f(*args)
+    except Exception:
+        return False, traceback.format_exc()
+
+class GenerationPool(object):
+    """
+    A pool of processes which generate chunks.
+
+    Terrain generation is pure computation, so spreading it across processes
+    puts every core to work on it. Chunks are handed back as packed sections,
+    which are cheap to send between processes and to unpack.
+
+    Only a limited number of chunks are handed to the workers at once; the
+    rest wait in a queue. Waiting chunks can be cancelled, which drops them
+    from the queue, so that chunks which nobody wants anymore don't hold up
+    the ones which are wanted. Chunks which are already being generated
+    can't be stopped, but cancelling them drops them once they're done.
+
+    :ivar int generated: the number of chunks generated
+    :ivar int cancelled: the number of chunks cancelled
     """
 
-    def make_chunk(self, x, z, seed, generators):
+    def __init__(self, workers, limit=None):
+        """
+        :param int workers: the number of worker processes
+        :param int limit: the most chunks to hand to the workers at once;
+            defaults to twice the number of workers, to keep them busy
+        """
+
+        self.workers = workers
+        self.limit = limit or workers * 2
+
+        self.generated = 0
+        self.cancelled = 0
+
+        self._pool = Pool(workers)
+        self._queue = OrderedDict()
+        self._running = {}
+        self._busy = 0
+
+    def __len__(self):
+        """
+        The number of chunks waiting for or being generated.
+        """
+
+        return len(self._queue) + len(self._running)
+
+    def generate(self, x, z, seed, generators):
+        """
+        Generate a chunk.
+
+        :param int x: X coordinate in chunk coords
+        :param int z: Z coordinate in chunk coords
+        :param int seed: the world seed
+        :param list generators: the names of the terrain generators to use
+        :returns: a ``Deferred`` which fires with the packed chunk, for
+            ``fill_chunk()``; it can be cancelled
         """
-        Create a chunk using the given parameters.
+
+        key = x, z
+        d = Deferred(lambda d: self._forget(key))
+        self._queue[key] = (x, z, seed, list(generators)), d
+        self._dispatch()
+        return d
+
+    def cancel(self, x, z):
         """
+        Stop generating a chunk.
+
+        Nothing happens if the chunk isn't being generated.
+        """
+
+        key = x, z
+        if key in self._queue:
+            args, d = self._queue[key]
+        elif key in self._running:
+            d = self._running[key]
+        else:
+            return
+
+        d.cancel()
+
+    def stop(self):
+        """
+        Stop the workers.
+
+        Chunks which haven't been generated yet are cancelled. This blocks
+        until the workers have finished the chunks they were working on,
+        which is never more than ``limit`` chunks.
+        """
+
+        for key in self._queue.keys() + self._running.keys():
+            self.cancel(*key)
+
+        # terminate() can deadlock on Python 2, so let the workers finish.
+        self._pool.close()
+        self._pool.join()
 
-        generators = retrieve_sorted_plugins(ITerrainGenerator, generators)
+    def _forget(self, key):
+        self.cancelled += 1
+        self._queue.pop(key, None)
+        self._running.pop(key, None)
 
-        chunk = Chunk(x, z)
+    def _dispatch(self):
+        while self._queue and self._busy < self.limit:
+            key, (args, d) = self._queue.popitem(last=False)
+            self._running[key] = d
+            self._busy += 1
 
-        for stage in generators:
-            stage.populate(chunk, seed)
+            def finished(result, key=key, d=d):
+                # This is called from one of the pool's threads.
+                reactor.callFromThread(self._finished, key, d, result)
 
-        chunk.regenerate()
+            self._pool.apply_async(attempt, (make_chunk,) + args,
+                                   callback=finished)
 
-        return {
-            "blocks": chunk.blocks.tostring(),
-            "metadata": chunk.metadata.tostring(),
-            "skylight": chunk.skylight.tostring(),
-            "blocklight": chunk.blocklight.tostring(),
-            "heightmap": chunk.heightmap.tostring(),
-        }
+    def _finished(self, key, d, result):
+        self._busy -= 1
+        if self._running.get(key) is d:
+            del self._running[key]
 
-    MakeChunk.responder(make_chunk)
+        # Cancelled chunks have already been fired.
+        if not d.called:
+            success, value = result
+            if success:
+                self.generated += 1
+                d.callback(value)
+            else:
+                d.errback(ChunkGenerationError(value))
 
-ampoule.pool.pp = ampoule.pool.ProcessPool(
-    ampChild=Slave,
-)
+        self._dispatch()
@@ -1,6 +1,7 @@
 from twisted.application.internet import TCPClient, TCPServer
 from twisted.application.service import MultiService
 from twisted.application.strports import service as serviceForEndpoint
+from twisted.internet.defer import DeferredList
 from twisted.internet.protocol import Factory
 from twisted.python import log
 
@@ -56,6 +57,24 @@ class BravoService(MultiService):
     def removeService(self, service):
         MultiService.removeService(self, service)
 
+    def stopService(self):
+        """
+        Stop every service, and then wait for every world to be saved.
+
+        Worlds are stopped along with their factories, once the factories'
+        ports have stopped listening, and take a while longer to save.
+        """
+
+        d = MultiService.stopService(self)
+
+        @d.addCallback
+        def cb(none):
+            return DeferredList([factory.stopping
+                                 for factory in self.factorylist
+                                 if factory.stopping is not None])
+
+        return d
+
     def configure_services(self):
         for section in self.config.sections():
             if section.startswith("world "):
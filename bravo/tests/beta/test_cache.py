@@ -0,0 +1,84 @@
+from unittest import TestCase
+
+from bravo.beta.cache import ChunkPacketCache
+from bravo.chunk import Chunk
+
+class TestChunkPacketCache(TestCase):
+
+    def setUp(self):
+        self.cache = ChunkPacketCache(1024 * 1024)
+        self.chunk = Chunk(1, 2)
+        self.chunk.set_block((1, 1, 1), 1)
+
+    def test_miss_then_hit(self):
+        first = self.cache.packet_for(self.chunk)
+        second = self.cache.packet_for(self.chunk)
+        self.assertTrue(first is second)
+        self.assertEqual(first, self.chunk.save_to_packet())
+        self.assertEqual(self.cache.misses, 1)
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_shared_between_callers(self):
+        """
+        Loading the same chunk many times only encodes it once.
+        """
+
+        for i in range(30):
+            self.cache.packet_for(self.chunk)
+        self.assertEqual(self.cache.misses, 1)
+        self.assertEqual(self.cache.hits, 29)
+
+    def test_invalidated_by_change(self):
+        first = self.cache.packet_for(self.chunk)
+        self.chunk.set_block((1, 2, 1), 1)
+        second = self.cache.packet_for(self.chunk)
+        self.assertNotEqual(first, second)
+        self.assertEqual(second, self.chunk.save_to_packet())
+        self.assertEqual(self.cache.misses, 2)
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(self.cache.size, len(second))
+
+    def test_invalidated_by_reload(self):
+        """
+        A chunk loaded again under the same coordinates doesn't get the old
+        chunk's packet.
+        """
+
+        self.cache.packet_for(self.chunk)
+        other = Chunk(1, 2)
+        packet = self.cache.packet_for(other)
+        self.assertEqual(packet, other.save_to_packet())
+        self.assertEqual(self.cache.misses, 2)
+
+    def test_bounded(self):
+        size = len(Chunk(0, 0).save_to_packet())
+        cache = ChunkPacketCache(size * 2)
+        for i in range(4):
+            cache.packet_for(Chunk(i, 0))
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.evictions, 2)
+        self.assertTrue(cache.size <= size * 2)
+
+    def test_lru(self):
+        size = len(Chunk(0, 0).save_to_packet())
+        cache = ChunkPacketCache(size * 2)
+        first, second, third = Chunk(0, 0), Chunk(1, 0), Chunk(2, 0)
+        cache.packet_for(first)
+        cache.packet_for(second)
+        cache.packet_for(first)
+        cache.packet_for(third)
+        cache.packet_for(first)
+        self.assertEqual(cache.hits, 2)
+
+    def test_disabled(self):
+        cache = ChunkPacketCache(0)
+        cache.packet_for(self.chunk)
+        cache.packet_for(self.chunk)
+        self.assertEqual(cache.misses, 2)
+        self.assertEqual(len(cache), 0)
+
+    def test_discard(self):
+        self.cache.packet_for(self.chunk)
+        self.cache.discard(self.chunk)
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.size, 0)
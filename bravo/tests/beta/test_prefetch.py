@@ -0,0 +1,139 @@
+from unittest import TestCase
+
+from twisted.internet.defer import Deferred, succeed
+from twisted.internet.task import Clock
+
+from bravo.beta.cache import ChunkPacketCache
+from bravo.beta.prefetch import PRIORITY, ChunkPrefetcher
+from bravo.chunk import Chunk
+from bravo.location import Position
+
+class MockWorld(object):
+
+    def __init__(self):
+        self.clock = Clock()
+        self.loaded = {}
+        self.requests = {}
+
+    def schedule_chunk(self, x, z, priority=0):
+        if (x, z) in self.loaded:
+            return succeed(self.loaded[x, z])
+        d = Deferred()
+        self.requests[x, z] = d, priority
+        return d
+
+    def finish(self, x, z):
+        chunk = self.loaded[x, z] = Chunk(x, z)
+        self.requests.pop((x, z))[0].callback(chunk)
+
+class TestChunkPrefetcher(TestCase):
+
+    def setUp(self):
+        self.world = MockWorld()
+        self.packets = ChunkPacketCache(1024 * 1024)
+        self.prefetcher = ChunkPrefetcher(self.world, self.packets,
+                                          lookahead=4, limit=4)
+
+    def move(self, x, z, dt=0.5):
+        """
+        Move the player to the given block coordinates, after a while.
+        """
+
+        self.world.clock.advance(dt)
+        self.prefetcher.moved("player", Position.from_player(x, 64, z), 2)
+
+    def test_velocity(self):
+        self.move(0, 0)
+        self.assertEqual(self.prefetcher.velocity("player"), None)
+        self.move(5, 0)
+        self.assertEqual(self.prefetcher.velocity("player"), (10, 0))
+
+    def test_walking(self):
+        """
+        Players who are walking aren't prefetched for.
+        """
+
+        self.move(0, 0)
+        self.move(2, 0)
+        self.assertEqual(self.world.requests, {})
+
+    def test_ahead(self):
+        """
+        Chunks are prefetched ahead of fast players, nearest first, at low
+        priority, up to the limit.
+        """
+
+        self.move(0, 0)
+        self.move(8, 0)
+        self.assertEqual(self.prefetcher.pending, 4)
+        self.assertEqual(self.prefetcher.prefetched, 4)
+        for (x, z), (d, priority) in self.world.requests.iteritems():
+            self.assertTrue(x > 2, (x, z))
+            self.assertTrue(priority > PRIORITY)
+        self.assertTrue((3, 0) in self.world.requests)
+
+    def test_warms_packets(self):
+        self.move(0, 0)
+        self.move(8, 0)
+        self.world.finish(3, 0)
+        self.assertEqual(self.packets.misses, 1)
+        self.assertEqual(self.prefetcher.pending, 3)
+
+    def test_loaded_chunks_skipped(self):
+        self.world.loaded[3, 0] = Chunk(3, 0)
+        self.move(0, 0)
+        self.move(8, 0)
+        self.assertTrue((3, 0) not in self.world.requests)
+
+    def test_used(self):
+        self.move(0, 0)
+        self.move(8, 0)
+        self.world.finish(3, 0)
+        self.prefetcher.claim(3, 0)
+        self.assertEqual(self.prefetcher.used, 1)
+        self.assertEqual(self.prefetcher.accuracy, 1.0)
+
+    def test_used_while_pending(self):
+        self.move(0, 0)
+        self.move(8, 0)
+        self.prefetcher.claim(3, 0)
+        self.assertEqual(self.prefetcher.used, 1)
+        self.world.finish(3, 0)
+        self.assertEqual(self.packets.misses, 0)
+
+    def test_wasted(self):
+        self.move(0, 0)
+        self.move(8, 0)
+        self.world.finish(3, 0)
+        self.prefetcher.claim(3, 0)
+        self.world.finish(3, 1)
+        self.move(8, 0, dt=self.prefetcher.expiry)
+        self.assertEqual(self.prefetcher.wasted, 1)
+        self.assertEqual(self.prefetcher.accuracy, 0.5)
+
+    def test_turn_away(self):
+        """
+        Prefetches are cancelled when players turn around.
+        """
+
+        self.move(0, 0)
+        self.move(8, 0)
+        d, priority = self.world.requests[3, 0]
+        self.move(8, 0, dt=2)
+        self.move(0, 0)
+        self.assertTrue(d.called)
+        self.assertEqual(self.prefetcher.cancelled, 4)
+        self.assertEqual(self.prefetcher.pending, 4)
+
+    def test_forget(self):
+        self.move(0, 0)
+        self.move(8, 0)
+        self.prefetcher.forget("player")
+        self.assertEqual(self.prefetcher.pending, 0)
+        self.assertEqual(self.prefetcher.cancelled, 4)
+
+    def test_disabled(self):
+        self.prefetcher.lookahead = 0
+        self.move(0, 0)
+        self.move(8, 0)
+        self.assertEqual(self.world.requests, {})
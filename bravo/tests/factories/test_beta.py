@@ -189,6 +189,14 @@ class TestBravoFactoryStarted(unittest.TestCase):
     def test_trivial(self):
         pass
 
+    def test_stop_waits_for_world(self):
+        d = self.f.stopFactory()
+        self.assertIs(d, self.f.stopping)
+        self.assertEqual(self.successResultOf(d), None)
+
+        # tearDown() stops the factory again.
+        self.f.startFactory()
+
     def test_create_entity_pickup(self):
         entity = self.f.create_entity(0, 0, 0, "Item")
         self.assertEqual(entity.eid, 2)
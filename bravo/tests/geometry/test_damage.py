@@ -0,0 +1,61 @@
+from unittest import TestCase
+
+from bravo.geometry import damage
+from bravo.geometry.damage import Damage, set_bits
+
+class DamageMixin(object):
+    """
+    Tests for damage, which must behave identically with and without NumPy.
+    """
+
+    def test_set_bits(self):
+        bitmap = bytearray(4)
+        bitmap[0] = 0x81
+        bitmap[3] = 0x01
+        self.assertEqual(set_bits(bitmap), [0, 7, 31])
+
+    def test_set_bits_empty(self):
+        self.assertEqual(set_bits(bytearray(512)), [])
+
+    def test_add(self):
+        self.d.add((1, 2, 3))
+        self.assertEqual(len(self.d), 1)
+        self.assertTrue((1, 2, 3) in self.d)
+        self.assertFalse((3, 2, 1) in self.d)
+
+    def test_add_twice(self):
+        self.d.add((1, 2, 3))
+        self.d.add((1, 2, 3))
+        self.assertEqual(len(self.d), 1)
+
+    def test_iter(self):
+        coords = [(0, 0, 0), (15, 255, 15), (1, 2, 3), (3, 200, 1)]
+        for c in coords:
+            self.d.add(c)
+        self.assertEqual(sorted(self.d), sorted(coords))
+
+    def test_sections(self):
+        self.d.add((1, 0, 0))
+        self.d.add((0, 17, 0))
+        self.assertEqual(list(self.d.sections()), [(0, [1]), (1, [256])])
+
+    def test_clear(self):
+        self.d.add((1, 2, 3))
+        self.d.clear()
+        self.assertFalse(self.d)
+        self.assertEqual(list(self.d), [])
+
+class TestDamage(DamageMixin, TestCase):
+
+    def setUp(self):
+        self.d = Damage()
+
+class TestDamagePurePython(DamageMixin, TestCase):
+
+    def setUp(self):
+        self.numpy = damage.numpy
+        damage.numpy = None
+        self.d = Damage()
+
+    def tearDown(self):
+        damage.numpy = self.numpy
@@ -1,5 +1,8 @@
+from array import array
+from copy import deepcopy
 from unittest import TestCase
 
+from bravo.geometry import section
 from bravo.geometry.section import Section
 
 class TestSectionInternals(TestCase):
@@ -26,3 +29,298 @@ class TestSectionInternals(TestCase):
         self.assertEqual(self.s.blocks[1], 1)
         self.assertEqual(self.s.blocks[256], 2)
         self.assertEqual(self.s.blocks[16], 3)
+
+
+class TestSectionUniform(TestCase):
+
+    def setUp(self):
+        self.s = Section()
+
+    def test_initial(self):
+        self.assertTrue(self.s.is_uniform())
+        self.assertFalse(self.s.has_blocks())
+        self.assertEqual(self.s.get_block((1, 2, 3)), 0)
+        self.assertEqual(self.s.get_skylight((1, 2, 3)), 15)
+
+    def test_shared(self):
+        """
+        Uniform sections share their arrays.
+        """
+
+        other = Section()
+        self.assertTrue(self.s._blocks is other._blocks)
+        self.assertTrue(self.s._skylight is other._skylight)
+
+    def test_read_stays_uniform(self):
+        self.s.get_block((1, 2, 3))
+        self.s.get_block_column(1, 3)
+        self.s.find_blocks(set([1]))
+        self.s.replace_blocks(1, 2)
+        self.assertTrue(self.s.is_uniform())
+
+    def test_write_default_stays_uniform(self):
+        self.s.set_block((1, 2, 3), 0)
+        self.s.set_metadata((1, 2, 3), 0)
+        self.s.set_skylight((1, 2, 3), 15)
+        self.s.set_blocklight((1, 2, 3), 0)
+        self.assertTrue(self.s.is_uniform())
+
+    def test_write_materializes(self):
+        other = Section()
+        self.s.set_block((1, 2, 3), 1)
+        self.assertFalse(self.s.is_uniform())
+        self.assertTrue(self.s.has_blocks())
+        self.assertEqual(other.get_block((1, 2, 3)), 0)
+        self.assertTrue(other.is_uniform())
+
+    def test_write_materializes_only_written(self):
+        self.s.set_skylight((1, 2, 3), 4)
+        self.assertTrue(self.s._blocks is Section()._blocks)
+
+    def test_attribute_materializes(self):
+        self.s.blocks[0] = 1
+        self.assertEqual(self.s.get_block((0, 0, 0)), 1)
+        self.assertEqual(Section().get_block((0, 0, 0)), 0)
+
+    def test_shared_never_written(self):
+        """
+        Writing to a section after giving it some other section's shared
+        array doesn't write to the shared array.
+        """
+
+        self.s.skylight = Section()._blocklight
+        self.s.set_skylight((1, 2, 3), 15)
+        self.assertEqual(self.s.get_skylight((1, 2, 3)), 15)
+        self.assertEqual(Section().get_blocklight((1, 2, 3)), 0)
+
+    def test_deepcopy_uniform(self):
+        copied = deepcopy(self.s)
+        self.assertTrue(copied.is_uniform())
+
+    def test_deepcopy_independent(self):
+        self.s.set_block((1, 2, 3), 1)
+        copied = deepcopy(self.s)
+        copied.set_block((1, 2, 3), 2)
+        self.assertEqual(self.s.get_block((1, 2, 3)), 1)
+        self.assertTrue(copied.get_metadata((1, 2, 3)) == 0)
+        self.assertTrue(copied._metadata is Section()._metadata)
+
+    def test_pack_from_packed(self):
+        self.s.set_block((1, 2, 3), 1)
+        self.s.set_metadata((1, 2, 3), 2)
+        self.s.set_blocklight((1, 2, 3), 3)
+        unpacked = Section.from_packed(*self.s.pack())
+        self.assertEqual(unpacked.get_block((1, 2, 3)), 1)
+        self.assertEqual(unpacked.get_metadata((1, 2, 3)), 2)
+        self.assertEqual(unpacked.get_blocklight((1, 2, 3)), 3)
+        self.assertEqual(unpacked.get_skylight((1, 2, 3)), 15)
+        self.assertTrue(unpacked._skylight is Section()._skylight)
+
+    def test_pack_nibbles(self):
+        """
+        Nibbles are stored packed, and come out exactly as they went in.
+        """
+
+        metadata = "".join(chr(i % 256) for i in range(2048))
+        section = Section.from_packed("\x01" * 4096, metadata, "\x00" * 2048)
+        self.assertEqual(section.pack()[1], metadata)
+        self.assertEqual(section.get_metadata((0, 0, 0)), 0)
+        self.assertEqual(section.get_metadata((2, 0, 0)), 1)
+        self.assertEqual(section.get_skylight((3, 0, 0)), 0)
+
+    def test_packed_storage_size(self):
+        self.s.set_metadata((1, 2, 3), 2)
+        self.assertEqual(len(self.s._metadata.tostring()), 2048)
+
+    def test_from_packed_uniform(self):
+        section = Section.from_packed(*Section().pack())
+        self.assertTrue(section.is_uniform())
+
+    def test_emptied_is_uniform(self):
+        self.s.set_block((1, 2, 3), 1)
+        self.s.set_block((1, 2, 3), 0)
+        self.assertTrue(self.s.is_uniform())
+
+    def test_pickle_recounts(self):
+        self.s.set_block((1, 2, 3), 1)
+        copied = deepcopy(self.s)
+        self.assertEqual(len(copied), 1)
+
+class TestSectionSnapshot(TestCase):
+
+    def setUp(self):
+        self.s = Section()
+        self.s.set_block((1, 2, 3), 1)
+        self.s.set_metadata((1, 2, 3), 2)
+
+    def test_shares_arrays(self):
+        snapshot = self.s.snapshot()
+        self.assertTrue(snapshot._blocks is self.s._blocks)
+        self.assertTrue(snapshot._metadata is self.s._metadata)
+        self.assertEqual(len(snapshot), 1)
+
+    def test_copy_on_write(self):
+        snapshot = self.s.snapshot()
+        self.s.set_block((1, 2, 3), 3)
+        self.s.set_metadata((1, 2, 3), 4)
+        self.assertEqual(snapshot.get_block((1, 2, 3)), 1)
+        self.assertEqual(snapshot.get_metadata((1, 2, 3)), 2)
+        self.assertEqual(self.s.get_block((1, 2, 3)), 3)
+
+        # Only the arrays which were written to are copied.
+        self.s.set_block((1, 2, 3), 5)
+        self.assertTrue(snapshot._skylight is self.s._skylight)
+
+    def test_snapshot_write(self):
+        """
+        Writing to a snapshot doesn't change the section it came from.
+        """
+
+        snapshot = self.s.snapshot()
+        snapshot.set_block((1, 2, 3), 3)
+        self.assertEqual(self.s.get_block((1, 2, 3)), 1)
+
+    def test_attribute_copies(self):
+        snapshot = self.s.snapshot()
+        self.s.blocks[0] = 7
+        self.assertEqual(snapshot.get_block((0, 0, 0)), 0)
+
+    def test_uniform_stays_shared(self):
+        snapshot = Section().snapshot()
+        self.assertTrue(snapshot.is_uniform())
+        self.assertFalse(snapshot._borrowed)
+
+
+
+class SectionBulkMixin(object):
+    """
+    Tests for the bulk accessors, which must behave identically with and
+    without NumPy.
+    """
+
+    def test_block_slab_readback(self):
+        self.s.set_block_slab(3, range(256))
+        self.assertEqual(self.s.get_block_slab(3), array("B", range(256)))
+        self.assertEqual(self.s.get_block((1, 3, 2)), 33)
+
+    def test_block_slab_fill(self):
+        self.s.set_block_slab(15, 7)
+        self.assertEqual(self.s.get_block((5, 15, 9)), 7)
+        self.assertEqual(self.s.get_block((5, 14, 9)), 0)
+
+    def test_block_column_readback(self):
+        self.s.set_block_column(2, 3, range(16))
+        self.assertEqual(self.s.get_block_column(2, 3), array("B", range(16)))
+        self.assertEqual(self.s.get_block((2, 5, 3)), 5)
+        self.assertEqual(self.s.get_block((3, 5, 2)), 0)
+
+    def test_skylight_slab(self):
+        self.s.set_skylight_slab(0, 0)
+        self.assertEqual(self.s.get_skylight((4, 0, 4)), 0)
+        self.assertEqual(self.s.get_skylight((4, 1, 4)), 15)
+
+    def test_find_blocks(self):
+        self.s.set_block((1, 0, 0), 1)
+        self.s.set_block((0, 1, 0), 2)
+        self.s.set_block((0, 0, 1), 3)
+        self.assertEqual(self.s.find_blocks(set([1, 2])), [1, 256])
+
+    def test_find_blocks_empty(self):
+        self.assertEqual(self.s.find_blocks(set()), [])
+
+    def test_replace_blocks(self):
+        self.s.set_block((1, 0, 0), 1)
+        self.s.set_block((0, 1, 0), 1)
+        self.assertEqual(self.s.replace_blocks(1, 2), 2)
+        self.assertEqual(self.s.get_block((1, 0, 0)), 2)
+        self.assertEqual(self.s.get_block((0, 1, 0)), 2)
+
+    def test_column_heights(self):
+        self.s.set_block((1, 4, 0), 1)
+        self.s.set_block((1, 2, 0), 1)
+        self.s.set_block((0, 15, 1), 1)
+        heights = self.s.column_heights()
+        self.assertEqual(heights[1], 4)
+        self.assertEqual(heights[16], 15)
+        self.assertEqual(heights[0], -1)
+
+    def test_column_heights_table(self):
+        """
+        A table picks which blocks count towards column heights.
+        """
+
+        table = "\x00\x01\x00" + "\x01" * 253
+        self.s.set_block((1, 4, 0), 2)
+        self.s.set_block((1, 2, 0), 1)
+        heights = self.s.column_heights(table)
+        self.assertEqual(heights[1], 2)
+        self.assertEqual(heights[0], -1)
+
+    def test_column_tops(self):
+        upper = Section()
+        upper.set_block((3, 5, 0), 1)
+        self.s.set_block((3, 9, 0), 1)
+        self.s.set_block((4, 9, 0), 1)
+        tops = section.column_tops([self.s, Section(), upper])
+        self.assertEqual(tops[3], 37)
+        self.assertEqual(tops[4], 9)
+        self.assertEqual(tops[5], -1)
+
+    def test_len_empty(self):
+        self.assertEqual(len(self.s), 0)
+        self.assertFalse(self.s)
+
+    def test_len_set_block(self):
+        self.s.set_block((1, 2, 3), 1)
+        self.s.set_block((1, 2, 3), 2)
+        self.s.set_block((3, 2, 1), 1)
+        self.assertEqual(len(self.s), 2)
+        self.s.set_block((1, 2, 3), 0)
+        self.assertEqual(len(self.s), 1)
+        self.assertTrue(self.s)
+
+    def test_len_slab_and_column(self):
+        self.s.set_block_slab(3, 1)
+        self.assertEqual(len(self.s), 256)
+        self.s.set_block_column(0, 0, 0)
+        self.assertEqual(len(self.s), 255)
+        self.s.set_block_column(1, 1, 2)
+        self.assertEqual(len(self.s), 270)
+
+    def test_len_replace_blocks(self):
+        self.s.set_block_slab(3, 1)
+        self.s.replace_blocks(1, 0)
+        self.assertFalse(self.s)
+        self.s.replace_blocks(0, 1)
+        self.assertEqual(len(self.s), 4096)
+
+    def test_len_from_packed(self):
+        self.s.set_block((1, 2, 3), 1)
+        self.assertEqual(len(Section.from_packed(*self.s.pack())), 1)
+
+    def test_len_attribute(self):
+        """
+        Writes through the blocks attribute are counted.
+        """
+
+        self.s.blocks[0] = 1
+        self.assertEqual(len(self.s), 1)
+        self.s.blocks = array("B", [2] * 4096)
+        self.assertEqual(len(self.s), 4096)
+
+
+class TestSectionBulk(SectionBulkMixin, TestCase):
+
+    def setUp(self):
+        self.s = Section()
+
+
+class TestSectionBulkPurePython(SectionBulkMixin, TestCase):
+
+    def setUp(self):
+        self.numpy = section.numpy
+        section.numpy = None
+        self.s = Section()
+
+    def tearDown(self):
+        section.numpy = self.numpy
@@ -1,9 +1,11 @@
-import unittest
+from random import Random
 import shutil
 import tempfile
 import platform
 
+from twisted.internet.defer import DeferredList, inlineCallbacks
 from twisted.python.filepath import FilePath
+from twisted.trial import unittest
 
 from bravo.chunk import Chunk
 from bravo.errors import SerializerReadException
@@ -11,6 +13,8 @@ from bravo.ibravo import ISerializer
 from bravo.nbt import TAG_Compound, TAG_List, TAG_String
 from bravo.nbt import TAG_Double, TAG_Byte, TAG_Short, TAG_Int
 from bravo.plugin import retrieve_plugins
+from bravo.region import Region
+from bravo.utilities.coords import XZ
 
 class TestAnvilSerializerInit(unittest.TestCase):
     """
@@ -46,11 +50,28 @@ class TestAnvilSerializer(unittest.TestCase):
         self.s.connect("file://" + self.folder.path)
 
     def tearDown(self):
-        shutil.rmtree(self.d)
+        d = self.s.close()
+        d.addCallback(lambda none: shutil.rmtree(self.d))
+        return d
 
     def test_trivial(self):
         pass
 
+    @inlineCallbacks
+    def test_shutdown_trigger(self):
+        """
+        Connecting again doesn't add another shutdown trigger, and closing
+        removes it.
+        """
+
+        trigger = self.s._trigger
+        self.assertNotEqual(trigger, None)
+        self.s.connect("file://" + self.folder.path)
+        self.assertIs(self.s._trigger, trigger)
+
+        yield self.s.close()
+        self.assertEqual(self.s._trigger, None)
+
     def test_load_entity_from_tag_pickup(self):
         tag = TAG_Compound()
         tag["Pos"] = TAG_List(type=TAG_Double)
@@ -98,6 +119,205 @@ class TestAnvilSerializer(unittest.TestCase):
         self.assertEqual(tag["Level"]["xPos"].value, 1)
         self.assertEqual(tag["Level"]["zPos"].value, 2)
 
+    def test_save_chunk_to_tag_skips_uniform_sections(self):
+        chunk = Chunk(1, 2)
+        chunk.set_block((0, 20, 0), 1)
+        tag = self.s._save_chunk_to_tag(chunk)
+        sections = tag["Level"]["Sections"].tags
+        self.assertEqual([section["Y"].value for section in sections], [1])
+
+    @inlineCallbacks
+    def test_save_load_chunk_roundtrip(self):
+        self.folder.child("region").makedirs()
+
+        chunk = Chunk(1, 2)
+        chunk.set_block((1, 20, 3), 1)
+        chunk.set_metadata((1, 20, 3), 5)
+        chunk.set_skylight((1, 21, 3), 7)
+        chunk.set_blocklight((1, 22, 3), 9)
+
+        yield self.s.save_chunk(chunk)
+        loaded = yield self.s.load_chunk(1, 2)
+
+        self.assertEqual(loaded.get_block((1, 20, 3)), 1)
+        self.assertEqual(loaded.get_metadata((1, 20, 3)), 5)
+        self.assertEqual(loaded.get_skylight((1, 21, 3)), 7)
+        self.assertEqual(loaded.get_blocklight((1, 22, 3)), 9)
+        self.assertTrue(loaded.sections[0].is_uniform())
+
+    @inlineCallbacks
+    def test_save_chunk_snapshot(self):
+        """
+        Chunks are written as they were when they were handed over, even if
+        they change while they're being written.
+        """
+
+        self.folder.child("region").makedirs()
+
+        chunk = Chunk(1, 2)
+        chunk.set_block((1, 20, 3), 1)
+        d = self.s.save_chunk(chunk)
+        chunk.set_block((1, 20, 3), 2)
+        yield d
+
+        loaded = yield self.s.load_chunk(1, 2)
+        self.assertEqual(loaded.get_block((1, 20, 3)), 1)
+
+    @inlineCallbacks
+    def test_region_ordering(self):
+        """
+        Reads and writes in a region happen in the order they were asked for.
+        """
+
+        self.folder.child("region").makedirs()
+
+        chunks = [Chunk(1, 2) for i in range(3)]
+        for i, chunk in enumerate(chunks):
+            chunk.set_block((1, 20, 3), i + 1)
+            self.s.save_chunk(chunk)
+        loaded = yield self.s.load_chunk(1, 2)
+
+        self.assertEqual(loaded.get_block((1, 20, 3)), 3)
+
+    @inlineCallbacks
+    def test_drain(self):
+        self.folder.child("region").makedirs()
+
+        for i in range(3):
+            self.s.save_chunk(Chunk(i, 0))
+        yield self.s.drain()
+        self.assertEqual(self.s._regions, {})
+
+    @inlineCallbacks
+    def test_regions_kept_open(self):
+        self.folder.child("region").makedirs()
+
+        yield self.s.save_chunk(Chunk(1, 2))
+        yield self.s.load_chunk(1, 2)
+        self.assertEqual(len(self.s._region_cache), 1)
+        self.assertEqual(self.s._region_cache.hits, 1)
+
+        region = self.s._region_cache.get(self.s._region_for(1, 2))
+        self.assertNotEqual(region.handle, None)
+
+        yield self.s.close()
+        self.assertEqual(region.handle, None)
+        self.assertEqual(len(self.s._region_cache), 0)
+
+        # Closed regions are opened again as needed.
+        loaded = yield self.s.load_chunk(1, 2)
+        self.assertEqual((loaded.x, loaded.z), (1, 2))
+
+    @inlineCallbacks
+    def test_regions_evicted(self):
+        self.folder.child("region").makedirs()
+        self.patch(self.s._region_cache, "limit", 2)
+
+        for i in range(4):
+            yield self.s.save_chunk(Chunk(i * 32, 0))
+        self.assertEqual(len(self.s._region_cache), 2)
+
+        for i in range(4):
+            loaded = yield self.s.load_chunk(i * 32, 0)
+            self.assertEqual(loaded.x, i * 32)
+
+    @inlineCallbacks
+    def test_save_batched(self):
+        """
+        Chunks saved together in a region are written in one batch.
+        """
+
+        self.folder.child("region").makedirs()
+        batches = []
+        put_chunks = Region.put_chunks
+        def patched(region, chunks):
+            batches.append(sorted(chunks))
+            return put_chunks(region, chunks)
+        self.patch(Region, "put_chunks", patched)
+
+        yield DeferredList([self.s.save_chunk(Chunk(i, 0)) for i in range(3)]
+                           + [self.s.save_chunk(Chunk(32, 0))])
+        self.assertEqual(sorted(batches), [[(0, 0), (1, 0), (2, 0)],
+                                           [(32, 0)]])
+
+        for i in range(3):
+            loaded = yield self.s.load_chunk(i, 0)
+            self.assertEqual(loaded.x, i)
+
+    def test_save_unthreaded(self):
+        """
+        Chunks are written right away when the serializer isn't threaded,
+        even without a reactor to wait on.
+        """
+
+        self.folder.child("region").makedirs()
+        self.patch(self.s, "threaded", False)
+
+        d = self.s.save_chunk(Chunk(1, 2))
+        self.assertEqual(self.successResultOf(d), None)
+        self.assertTrue(self.s._region_for(1, 2).exists())
+        self.assertEqual(self.s._batches, {})
+
+    @inlineCallbacks
+    def test_save_batch_split(self):
+        """
+        Chunks saved after something else is asked of their region go in
+        another batch.
+        """
+
+        self.folder.child("region").makedirs()
+        yield self.s.save_chunk(Chunk(0, 0))
+
+        chunk = Chunk(0, 0)
+        chunk.set_block((1, 20, 3), 1)
+        first = self.s.save_chunk(chunk)
+        loaded = self.s.load_chunk(0, 0)
+        chunk = Chunk(0, 0)
+        chunk.set_block((1, 20, 3), 2)
+        second = self.s.save_chunk(chunk)
+
+        loaded = yield loaded
+        self.assertEqual(loaded.get_block((1, 20, 3)), 1)
+        yield DeferredList([first, second])
+        loaded = yield self.s.load_chunk(0, 0)
+        self.assertEqual(loaded.get_block((1, 20, 3)), 2)
+
+    @inlineCallbacks
+    def test_compact(self):
+        self.folder.child("region").makedirs()
+        self.patch(self.s, "compact_waste", 0)
+
+        r = Random(0)
+        chunk = Chunk(0, 0)
+        for y in range(32):
+            for x, z in XZ:
+                chunk.set_block((x, y, z), r.randrange(256))
+        yield self.s.save_chunk(Chunk(0, 0))
+        yield self.s.save_chunk(Chunk(1, 0))
+        # Outgrowing its pages moves the chunk to the end of the region.
+        yield self.s.save_chunk(chunk)
+
+        reclaimed = yield self.s.compact()
+        self.assertTrue(reclaimed > 0)
+        region = self.s._region_cache.get(self.s._region_for(0, 0))
+        self.assertEqual(region.wasted, 0)
+
+        loaded = yield self.s.load_chunk(0, 0)
+        self.assertEqual(loaded.get_block((1, 20, 3)),
+                         chunk.get_block((1, 20, 3)))
+
+        # Nothing has been written since.
+        reclaimed = yield self.s.compact()
+        self.assertEqual(reclaimed, 0)
+
+    @inlineCallbacks
+    def test_compact_not_wasteful(self):
+        self.folder.child("region").makedirs()
+
+        yield self.s.save_chunk(Chunk(0, 0))
+        reclaimed = yield self.s.compact()
+        self.assertEqual(reclaimed, 0)
+
     def test_save_plugin_data(self):
         data = 'Foo\nbar'
         self.s.save_plugin_data('plugin1', data)
@@ -125,7 +345,8 @@ class TestAnvilSerializer(unittest.TestCase):
         Loading a non-existent chunk raises an SRE.
         """
 
-        self.assertRaises(SerializerReadException, self.s.load_chunk, 0, 0)
+        return self.assertFailure(self.s.load_chunk(0, 0),
+                                  SerializerReadException)
 
     def test_load_player_first(self):
         """
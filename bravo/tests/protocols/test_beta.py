@@ -3,8 +3,10 @@ from twisted.trial.unittest import TestCase
 import warnings
 
 from twisted.internet import reactor
+from twisted.internet.defer import Deferred
 from twisted.internet.task import deferLater
 
+from bravo.beta.prefetch import ChunkPrefetcher
 from bravo.beta.protocol import (BetaServerProtocol, BravoProtocol,
                                  STATE_LOCATED)
 from bravo.chunk import Chunk
@@ -24,9 +26,31 @@ class FakeTransport(object):
 
 class FakeFactory(object):
 
+    def __init__(self):
+        self.prefetcher = ChunkPrefetcher(None)
+
     def broadcast(self, packet):
         pass
 
+    def teardown_protocol(self, protocol):
+        pass
+
+class FakeWorld(object):
+
+    def __init__(self):
+        self.tickets = {}
+        self.requests = {}
+
+    def acquire_chunk(self, x, z):
+        self.tickets[x, z] = self.tickets.get((x, z), 0) + 1
+
+    def release_chunk(self, x, z):
+        self.tickets[x, z] -= 1
+
+    def schedule_chunk(self, x, z, priority=0):
+        d = self.requests[x, z] = Deferred()
+        return d
+
 class TestBetaServerProtocol(TestCase):
 
     def setUp(self):
@@ -132,6 +156,47 @@ class TestBravoProtocol(TestCase):
 
         self.p.disable_chunk(0, 0)
 
+    def test_disable_chunk_while_loading(self):
+        """
+        Chunks which are disabled before they've loaded give back their
+        ticket right away, and aren't sent when they show up.
+        """
+
+        self.p.factory = FakeFactory()
+        self.p.factory.world = FakeWorld()
+        self.p.transport = FakeTransport()
+
+        self.p.enable_chunk(1, 2)
+        self.assertEqual(self.p.factory.world.tickets[1, 2], 1)
+
+        self.p.disable_chunk(1, 2)
+        self.assertEqual(self.p.factory.world.tickets[1, 2], 0)
+
+        self.p.factory.world.requests[1, 2].callback(Chunk(1, 2))
+        self.assertNotIn((1, 2), self.p.chunks)
+        self.assertEqual(self.p.factory.world.tickets[1, 2], 0)
+
+    def test_connection_lost_while_loading(self):
+        """
+        Chunks which are still loading when the connection is lost are
+        given back and stop being waited on.
+        """
+
+        world = FakeWorld()
+        self.p.factory = FakeFactory()
+        self.p.factory.world = world
+        self.p.transport = FakeTransport()
+
+        d = self.p.enable_chunk(1, 2)
+        self.p.connectionLost()
+        self.assertEqual(world.tickets[1, 2], 0)
+        self.assertEqual(self.p.chunk_requests, {})
+        self.assertTrue(d.called)
+
+        # The chunk showing up later doesn't bother the lost protocol.
+        world.requests[1, 2].callback(Chunk(1, 2))
+        self.assertNotIn((1, 2), self.p.chunks)
+
 
 class TestBravoProtocolChunks(TestCase):
 
@@ -1,9 +1,17 @@
 from twisted.trial import unittest
 
+from array import array
+from copy import deepcopy
 from itertools import product
+from struct import unpack
 
+from bravo import chunk
 from bravo.blocks import blocks
-from bravo.chunk import Chunk
+from bravo.beta.packets import make_packet
+from bravo.chunk import Chunk, segment_array
+from bravo.entity import Chest
+from bravo.geometry import damage
+from bravo.geometry import section as section_module
 from bravo.utilities.coords import XZ
 
 class TestChunkBlocks(unittest.TestCase):
@@ -77,6 +85,326 @@ class TestChunkBlocks(unittest.TestCase):
         self.c.destroy((0, 30, 0))
         self.assertEqual(self.c.heightmap[0], 10)
 
+    def test_find_blocks(self):
+        self.c.set_block((1, 2, 3), 1)
+        self.c.set_block((4, 50, 6), 2)
+        self.c.set_block((7, 100, 8), 3)
+        self.assertEqual(self.c.find_blocks(set([1, 3])),
+                         [(1, 2, 3), (7, 100, 8)])
+
+    def test_sed_counts_as_damage(self):
+        self.c.set_block((1, 1, 1), 1)
+        self.c.clear_damage()
+        self.c.sed(1, 2)
+        self.assertTrue(self.c.all_damaged)
+
+    def test_sed_missing_no_damage(self):
+        self.c.sed(1, 2)
+        self.assertFalse(self.c.all_damaged)
+
+    def test_get_block_column(self):
+        self.c.set_block((2, 0, 3), 1)
+        self.c.set_block((2, 200, 3), 2)
+        column = self.c.get_block_column(2, 3)
+        self.assertEqual(len(column), 256)
+        self.assertEqual(column[0], 1)
+        self.assertEqual(column[200], 2)
+        self.assertEqual(column.count(0), 254)
+
+    def test_set_block_column_heightmap(self):
+        self.c.populated = True
+
+        self.c.set_block_column(1, 2, [1] * 40 + [0] * 216)
+        self.assertEqual(self.c.get_block((1, 39, 2)), 1)
+        self.assertEqual(self.c.get_block((1, 40, 2)), 0)
+        self.assertEqual(self.c.height_at(1, 2), 39)
+
+    def test_set_block_column_relights(self):
+        self.c.regenerate()
+        self.c.populated = True
+
+        torch = blocks["torch"].slot
+        self.c.set_block_column(1, 2, [0] * 50 + [torch] + [0] * 205)
+        self.assertEqual(self.c.get_blocklight((1, 50, 2)), 14)
+        self.assertEqual(self.c.get_blocklight((2, 50, 2)), 13)
+
+    def test_regenerate_heightmap(self):
+        self.c.set_block_column(1, 2, [1] * 40 + [0] * 216)
+        self.c.set_block((3, 200, 4), 1)
+        self.c.regenerate_heightmap()
+        self.assertEqual(self.c.height_at(1, 2), 39)
+        self.assertEqual(self.c.height_at(3, 4), 200)
+        self.assertEqual(self.c.height_at(2, 1), 0)
+
+    def test_set_block_slab(self):
+        self.c.set_block_slab(70, 1)
+        self.assertEqual(self.c.get_block((0, 70, 0)), 1)
+        self.assertEqual(self.c.get_block((15, 70, 15)), 1)
+        self.assertEqual(self.c.get_block((15, 71, 15)), 0)
+        self.assertEqual(self.c.get_block_slab(70).count(1), 256)
+
+    def test_set_block_slab_relights(self):
+        self.c.regenerate()
+        self.c.populated = True
+        self.assertEqual(self.c.get_skylight((3, 60, 3)), 15)
+
+        self.c.set_block_slab(70, blocks["stone"].slot)
+        self.assertEqual(self.c.get_skylight((3, 60, 3)), 0)
+
+    def test_set_block_slab_heightmap(self):
+        self.c.populated = True
+
+        self.c.set_block((0, 10, 0), 1)
+        self.c.set_block_slab(20, 1)
+        self.assertEqual(self.c.heightmap[0], 20)
+
+        self.c.set_block_slab(20, 0)
+        self.assertEqual(self.c.heightmap[0], 10)
+        self.assertEqual(self.c.heightmap[1], 0)
+
+
+class TestChunkVersion(unittest.TestCase):
+
+    def setUp(self):
+        self.c = Chunk(0, 0)
+
+    def test_set_block(self):
+        version = self.c.version
+        self.c.set_block((1, 1, 1), 1)
+        self.assertNotEqual(self.c.version, version)
+
+    def test_noop_set_block(self):
+        version = self.c.version
+        self.c.set_block((1, 1, 1), 0)
+        self.assertEqual(self.c.version, version)
+
+    def test_dirty(self):
+        version = self.c.version
+        self.c.dirty = True
+        self.assertNotEqual(self.c.version, version)
+
+    def test_regenerate(self):
+        version = self.c.version
+        self.c.regenerate_blocklight()
+        self.assertNotEqual(self.c.version, version)
+
+    def test_unique(self):
+        """
+        Different chunks never share versions.
+        """
+
+        self.assertNotEqual(self.c.version, Chunk(0, 0).version)
+
+class TestChunkCopy(unittest.TestCase):
+
+    def test_copy_drops_hooks(self):
+        c = Chunk(1, 2)
+        c.lookup = {}.get
+        c.dirtied = lambda chunk: None
+        c.set_block((1, 2, 3), 4)
+        copied = deepcopy(c)
+        self.assertEqual(copied.get_block((1, 2, 3)), 4)
+        self.assertIs(copied.lookup, None)
+        self.assertIs(copied.dirtied, None)
+
+class TestChunkSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.c = Chunk(1, 2)
+        self.c.populated = True
+        self.c.set_block((1, 2, 3), 4)
+        self.c.tiles[1, 2, 3] = Chest(1, 2, 3)
+        self.height = self.c.height_at(1, 3)
+
+    def test_snapshot(self):
+        snapshot = self.c.snapshot()
+        self.assertEqual(snapshot.version, self.c.version)
+        self.assertEqual(snapshot.get_block((1, 2, 3)), 4)
+        self.assertEqual(snapshot.height_at(1, 3), self.height)
+        self.assertEqual(list(snapshot.tiles), [(1, 2, 3)])
+
+    def test_snapshot_frozen(self):
+        snapshot = self.c.snapshot()
+        self.c.set_block((1, 2, 3), 0)
+        self.c.set_block((1, 9, 3), 4)
+        del self.c.tiles[1, 2, 3]
+        self.assertNotEqual(self.c.height_at(1, 3), self.height)
+
+        self.assertEqual(snapshot.get_block((1, 2, 3)), 4)
+        self.assertEqual(snapshot.get_block((1, 9, 3)), 0)
+        self.assertEqual(snapshot.height_at(1, 3), self.height)
+        self.assertEqual(list(snapshot.tiles), [(1, 2, 3)])
+
+    def test_snapshot_inventories(self):
+        snapshot = self.c.snapshot()
+        self.c.tiles[1, 2, 3].inventory.storage[0] = (1, 0, 1)
+        self.assertEqual(snapshot.tiles[1, 2, 3].inventory.storage[0], None)
+
+    def test_snapshot_drops_hooks(self):
+        self.c.dirtied = lambda chunk: None
+        self.c.begin()
+        snapshot = self.c.snapshot()
+        self.c.commit()
+        self.assertIs(snapshot.dirtied, None)
+        self.assertEqual(snapshot._batches, 0)
+
+class TestChunkBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.c = Chunk(0, 0)
+        self.c.populated = True
+        self.c.dirty = False
+
+    def test_batch_defers_heightmap(self):
+        self.c.begin()
+        self.c.set_block((1, 20, 2), 1)
+        self.assertEqual(self.c.height_at(1, 2), 0)
+        self.c.commit()
+        self.assertEqual(self.c.height_at(1, 2), 20)
+
+    def test_batch_heightmap_removal(self):
+        self.c.set_block((1, 10, 2), 1)
+        self.c.set_block((1, 20, 2), 1)
+        with self.c.batch():
+            self.c.set_block((1, 20, 2), 0)
+            self.c.set_block((1, 15, 2), 1)
+            self.c.set_block((1, 15, 2), 0)
+        self.assertEqual(self.c.height_at(1, 2), 10)
+
+    def test_batch_defers_damage(self):
+        with self.c.batch():
+            self.c.set_block((1, 2, 3), 1)
+            self.c.set_metadata((1, 2, 3), 2)
+            self.c.set_metadata((3, 2, 1), 2)
+            self.assertFalse(self.c.is_damaged())
+            self.assertFalse(self.c.dirty)
+        self.assertEqual(set(self.c.damaged), set([(1, 2, 3), (3, 2, 1)]))
+        self.assertTrue(self.c.dirty)
+
+    def test_batch_bulk_writes(self):
+        with self.c.batch():
+            self.c.set_block_slab(20, 1)
+            self.c.set_block_column(1, 2, [1] * 40 + [0] * 216)
+            self.assertEqual(self.c.height_at(1, 2), 0)
+            self.assertFalse(self.c.is_damaged())
+        self.assertEqual(self.c.height_at(1, 2), 39)
+        self.assertEqual(self.c.height_at(2, 1), 20)
+        self.assertEqual(self.c.get_skylight((2, 19, 1)), 0)
+        self.assertTrue(self.c.is_damaged())
+
+    def test_batch_nested(self):
+        with self.c.batch():
+            with self.c.batch():
+                self.c.set_block((1, 2, 3), 1)
+            self.assertFalse(self.c.is_damaged())
+        self.assertTrue(self.c.is_damaged())
+
+    def test_batch_empty(self):
+        with self.c.batch():
+            pass
+        self.assertFalse(self.c.dirty)
+
+    def test_batch_commits_on_error(self):
+        def broken():
+            with self.c.batch():
+                self.c.set_block((1, 2, 3), 1)
+                raise ValueError()
+        self.assertRaises(ValueError, broken)
+        self.assertTrue(self.c.is_damaged())
+
+    def test_commit_without_batch(self):
+        self.c.commit()
+        warnings = self.flushWarnings()
+        self.assertEqual(len(warnings), 1)
+        self.assertEqual(warnings[0]["category"], chunk.ChunkWarning)
+
+class ChunkDamageMixin(object):
+    """
+    Tests for damage, which must be sent identically with and without NumPy.
+    """
+
+    def setUp(self):
+        self.c = Chunk(1, 2)
+        self.c.populated = True
+        self.c.clear_damage()
+
+    def records(self, packet):
+        """
+        Pull the records out of the end of a batch packet.
+        """
+
+        count = len(self.c.damaged)
+        return sorted(unpack(">%dI" % count, packet[-count * 4:]))
+
+    def test_single(self):
+        self.c.set_block((1, 2, 3), 4)
+        self.c.set_metadata((1, 2, 3), 5)
+        packet = make_packet("block", x=17, y=2, z=35, type=4, meta=5)
+        self.assertEqual(self.c.get_damage_packet(), packet)
+
+    def test_batch(self):
+        self.c.set_block((1, 2, 3), 4)
+        self.c.set_metadata((1, 2, 3), 5)
+        self.c.set_block((15, 200, 14), 255)
+        self.c.set_metadata((0, 0, 0), 15)
+        packet = self.c.get_damage_packet()
+        self.assertEqual(self.records(packet), sorted([
+            1 << 28 | 3 << 24 | 2 << 16 | 4 << 4 | 5,
+            15 << 28 | 14 << 24 | 200 << 16 | 255 << 4,
+            15,
+        ]))
+
+    def test_batch_header(self):
+        self.c.set_block((1, 2, 3), 4)
+        self.c.set_block((3, 2, 1), 4)
+        packet = self.c.get_damage_packet()
+        data = packet[-8:]
+        self.assertEqual(packet, make_packet("batch", x=1, z=2, count=2,
+                                             data=data))
+
+    def test_threshold_empty(self):
+        """
+        An empty chunk is resent once its damage costs more than one section.
+        """
+
+        for i in range(176):
+            self.c.set_metadata((i & 0xf, i >> 4, 0), 1)
+        self.assertFalse(self.c.all_damaged)
+        self.c.set_metadata((0, 0, 1), 1)
+        self.assertTrue(self.c.all_damaged)
+        self.assertFalse(self.c.damaged)
+
+    def test_threshold_sections(self):
+        """
+        Chunks with more sections take more damage before being resent.
+        """
+
+        self.c.set_block((0, 0, 0), 1)
+        self.c.set_block((0, 16, 0), 1)
+        for i in range(300):
+            self.c.set_metadata((i & 0xf, i >> 4, 1), 1)
+        self.assertFalse(self.c.all_damaged)
+
+    def test_threshold_configurable(self):
+        self.c.resend_cost = 8
+        self.c.set_metadata((0, 0, 0), 1)
+        self.c.set_metadata((0, 0, 1), 1)
+        self.assertFalse(self.c.all_damaged)
+        self.c.set_metadata((0, 0, 2), 1)
+        self.assertTrue(self.c.all_damaged)
+
+class TestChunkDamage(ChunkDamageMixin, unittest.TestCase):
+    pass
+
+class TestChunkDamagePurePython(ChunkDamageMixin, unittest.TestCase):
+
+    def setUp(self):
+        ChunkDamageMixin.setUp(self)
+        self.numpy = chunk.numpy, damage.numpy, section_module.numpy
+        chunk.numpy = damage.numpy = section_module.numpy = None
+
+    def tearDown(self):
+        chunk.numpy, damage.numpy, section_module.numpy = self.numpy
 
 class TestLightmaps(unittest.TestCase):
 
@@ -118,8 +446,6 @@ class TestLightmaps(unittest.TestCase):
             self.assertEqual(self.c.get_skylight((x, 1, z)), target,
                              "%d, %d" % (x, z))
 
-    test_skylight_spread.todo = "Skylight maths is still broken"
-
     def test_skylight_arch(self):
         """
         Indirect illumination should work.
@@ -141,8 +467,6 @@ class TestLightmaps(unittest.TestCase):
 
         self.assertEqual(self.c.get_skylight((1, 1, 1)), 14)
 
-    test_skylight_arch.todo = "Skylight maths is still broken"
-
     def test_skylight_arch_leaves(self):
         """
         Indirect illumination with dimming should work.
@@ -167,8 +491,6 @@ class TestLightmaps(unittest.TestCase):
 
         self.assertEqual(self.c.get_skylight((1, 1, 1)), 13)
 
-    test_skylight_arch_leaves.todo = "Skylight maths is still broken"
-
     def test_skylight_arch_leaves_occluded(self):
         """
         Indirect illumination with dimming through occluded blocks only should
@@ -195,8 +517,6 @@ class TestLightmaps(unittest.TestCase):
 
         self.assertEqual(self.c.get_skylight((1, 1, 1)), 12)
 
-    test_skylight_arch_leaves_occluded.todo = "Skylight maths is still broken"
-
     def test_incremental_solid(self):
         """
         Regeneration isn't necessary to correctly light solid blocks.
@@ -211,8 +531,6 @@ class TestLightmaps(unittest.TestCase):
 
         self.assertEqual(self.c.get_skylight((0, 0, 0)), 0)
 
-    test_incremental_solid.todo = "Skylight maths is still broken"
-
     def test_incremental_air(self):
         """
         Regeneration isn't necessary to correctly light dug blocks, which
@@ -229,3 +547,92 @@ class TestLightmaps(unittest.TestCase):
         self.c.set_block((0, 0, 0), blocks["air"].slot)
 
         self.assertEqual(self.c.get_skylight((0, 0, 0)), 15)
+
+    def test_blocklight_torch(self):
+        """
+        Placing a torch lights up its surroundings, in nearby sections too.
+        """
+
+        self.c.populated = True
+
+        self.c.set_block((8, 16, 8), blocks["torch"].slot)
+
+        self.assertEqual(self.c.get_blocklight((8, 16, 8)), 14)
+        self.assertEqual(self.c.get_blocklight((8, 15, 8)), 13)
+        self.assertEqual(self.c.get_blocklight((8, 16, 10)), 12)
+        self.assertEqual(self.c.get_blocklight((8, 40, 8)), 0)
+        self.assertTrue(self.c.sections[3].is_uniform())
+
+    def test_regenerate_blocklight(self):
+        self.c.set_block((8, 16, 8), blocks["torch"].slot)
+        self.c.regenerate_blocklight()
+
+        self.assertEqual(self.c.get_blocklight((8, 16, 8)), 14)
+        self.assertEqual(self.c.get_blocklight((9, 17, 8)), 12)
+
+        self.c.set_block((8, 16, 8), blocks["air"].slot)
+        self.c.regenerate_blocklight()
+
+        self.assertEqual(self.c.get_blocklight((8, 16, 8)), 0)
+        self.assertEqual(self.c.get_blocklight((9, 17, 8)), 0)
+
+
+class TestChunkSparse(unittest.TestCase):
+
+    def test_new_chunk_uniform(self):
+        c = Chunk(0, 0)
+        for section in c.sections:
+            self.assertTrue(section.is_uniform())
+
+    def test_save_to_packet_empty(self):
+        """
+        Empty chunks can be packed without making copies of their sections.
+        """
+
+        c = Chunk(0, 0)
+        c.save_to_packet()
+        for section in c.sections:
+            self.assertTrue(section.is_uniform())
+
+
+class SegmentArrayMixin(object):
+
+    def test_segment_array(self):
+        a = array("B", [i % 251 for i in range(16 * 16 * 16 * 2)])
+        segments = segment_array(a)
+        self.assertEqual(len(segments), 16)
+        for index, segment in enumerate(segments):
+            self.assertEqual(len(segment), 512)
+            expected = array("B")
+            for i in range(index * 16, len(a), 256):
+                expected.extend(a[i:i + 16])
+            self.assertEqual(segment, expected)
+
+    def test_segment_array_wide(self):
+        a = array("H", range(16 * 16 * 4))
+        segments = segment_array(a)
+        self.assertEqual(segments[1][:16], a[16:32])
+        self.assertEqual(segments[1][16:32], a[272:288])
+        self.assertEqual(segments[1].typecode, "H")
+
+    def test_segment_array_ragged(self):
+        a = array("B", range(48))
+        segments = segment_array(a)
+        self.assertEqual(segments[2], a[32:48])
+        self.assertEqual(segments[3], array("B"))
+
+    def test_segment_array_empty(self):
+        segments = segment_array(array("B"))
+        self.assertEqual(segments, [array("B")] * 16)
+
+class TestSegmentArray(SegmentArrayMixin, unittest.TestCase):
+    pass
+
+class TestSegmentArrayPurePython(SegmentArrayMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.numpy = chunk.numpy
+        chunk.numpy = None
+
+    def tearDown(self):
+        chunk.numpy = self.numpy
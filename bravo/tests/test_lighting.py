@@ -0,0 +1,203 @@
+from unittest import TestCase
+
+from bravo.blocks import blocks
+from bravo.chunk import Chunk
+from bravo.lighting import Lighting
+from bravo.utilities.coords import XZ
+
+def make_chunk(x=0, z=0, floor=64):
+    """
+    Make a populated, lit chunk with a solid floor.
+    """
+
+    chunk = Chunk(x, z)
+    for bx, bz in XZ:
+        chunk.set_block_column(bx, bz, [1] * floor + [0] * (256 - floor))
+    chunk.regenerate()
+    chunk.populated = True
+    return chunk
+
+class TestLightingChunk(TestCase):
+
+    def setUp(self):
+        self.c = make_chunk()
+
+    def test_sky_above_floor(self):
+        self.assertEqual(self.c.get_skylight((3, 64, 3)), 15)
+        self.assertEqual(self.c.get_skylight((3, 200, 3)), 15)
+        self.assertEqual(self.c.get_skylight((3, 63, 3)), 0)
+
+    def test_torch_place_and_remove(self):
+        self.c.set_block((8, 64, 8), blocks["torch"].slot)
+        self.assertEqual(self.c.get_blocklight((8, 64, 8)), 14)
+        self.assertEqual(self.c.get_blocklight((8, 65, 8)), 13)
+        self.assertEqual(self.c.get_blocklight((12, 64, 8)), 10)
+        # Light doesn't go through the floor.
+        self.assertEqual(self.c.get_blocklight((8, 63, 8)), 0)
+
+        self.c.set_block((8, 64, 8), blocks["air"].slot)
+        self.assertEqual(self.c.get_blocklight((8, 64, 8)), 0)
+        self.assertEqual(self.c.get_blocklight((12, 64, 8)), 0)
+
+    def test_two_torches(self):
+        """
+        Removing one torch leaves the other's light in place.
+        """
+
+        self.c.set_block((4, 64, 8), blocks["torch"].slot)
+        self.c.set_block((8, 64, 8), blocks["torch"].slot)
+        self.c.set_block((8, 64, 8), blocks["air"].slot)
+        self.assertEqual(self.c.get_blocklight((4, 64, 8)), 14)
+        self.assertEqual(self.c.get_blocklight((8, 64, 8)), 10)
+
+    def test_torch_touches_only_nearby_sections(self):
+        self.c.set_block((8, 64, 8), blocks["torch"].slot)
+        self.assertFalse(self.c.sections[6].has_blocklight())
+        self.assertFalse(self.c.sections[2].has_blocklight())
+
+    def test_shade_column(self):
+        """
+        A block hanging in the sky shades the column under it, but light
+        still comes in from the side.
+        """
+
+        self.c.set_block((8, 70, 8), 1)
+        self.assertEqual(self.c.get_skylight((8, 70, 8)), 0)
+        self.assertEqual(self.c.get_skylight((8, 69, 8)), 14)
+        self.assertEqual(self.c.get_skylight((8, 64, 8)), 14)
+        self.assertEqual(self.c.get_skylight((8, 71, 8)), 15)
+
+    def test_dig_hole(self):
+        """
+        Digging a hole lets the sky into it, and into caves below it.
+        """
+
+        # A cave, closed off from the sky.
+        for x in range(4, 9):
+            self.c.set_block((x, 60, 8), 0)
+        self.assertEqual(self.c.get_skylight((8, 60, 8)), 0)
+
+        for y in range(61, 64):
+            self.c.set_block((8, y, 8), 0)
+
+        self.assertEqual(self.c.get_skylight((8, 61, 8)), 15)
+        self.assertEqual(self.c.get_skylight((8, 60, 8)), 15)
+        self.assertEqual(self.c.get_skylight((6, 60, 8)), 13)
+
+        # And close it back up.
+        self.c.set_block((8, 63, 8), 1)
+        self.assertEqual(self.c.get_skylight((8, 60, 8)), 0)
+        self.assertEqual(self.c.get_skylight((6, 60, 8)), 0)
+
+    def test_leaves_dim(self):
+        self.c.set_block((8, 64, 8), blocks["leaves"].slot)
+        self.assertEqual(self.c.get_skylight((8, 64, 8)), 14)
+
+class TestLightingBorders(TestCase):
+
+    def setUp(self):
+        self.chunks = {}
+        for x in range(2):
+            chunk = make_chunk(x, 0)
+            chunk.lookup = self.chunks.get
+            self.chunks[x, 0] = chunk
+        self.first = self.chunks[0, 0]
+        self.second = self.chunks[1, 0]
+        self.first.dirty = False
+        self.second.dirty = False
+
+    def test_torch_across_border(self):
+        self.first.set_block((15, 64, 8), blocks["torch"].slot)
+        self.assertEqual(self.second.get_blocklight((0, 64, 8)), 13)
+        self.assertEqual(self.second.get_blocklight((3, 64, 8)), 10)
+        self.assertTrue(self.second.dirty)
+
+        self.first.set_block((15, 64, 8), blocks["air"].slot)
+        self.assertEqual(self.second.get_blocklight((0, 64, 8)), 0)
+
+    def test_regenerate_pulls_neighbor_light(self):
+        self.second.set_block((0, 64, 8), blocks["torch"].slot)
+        Lighting(self.first).regenerate_blocklight()
+        self.assertEqual(self.first.get_blocklight((15, 64, 8)), 13)
+
+    def test_missing_neighbor(self):
+        """
+        Light stops at the edge of the loaded world.
+        """
+
+        del self.chunks[1, 0]
+        self.first.set_block((15, 64, 8), blocks["torch"].slot)
+        self.assertEqual(self.first.get_blocklight((15, 64, 8)), 14)
+        self.assertEqual(self.second.get_blocklight((0, 64, 8)), 0)
+
+    def lit_alone(self, *placed):
+        """
+        Make a chunk, as the first chunk, and light it without its neighbors.
+        """
+
+        chunk = make_chunk(0, 0)
+        for coords, block in placed:
+            chunk.set_block(coords, block)
+        chunk.regenerate()
+        chunk.lookup = self.chunks.get
+        self.chunks[0, 0] = chunk
+        return chunk
+
+    def test_relight_borders_out(self):
+        chunk = self.lit_alone(((15, 64, 8), blocks["torch"].slot))
+        self.assertEqual(self.second.get_blocklight((0, 64, 8)), 0)
+
+        chunk.relight_borders()
+        self.assertEqual(self.second.get_blocklight((0, 64, 8)), 13)
+        self.assertTrue(self.second.dirty)
+
+    def test_relight_borders_in(self):
+        self.second.set_block((0, 64, 8), blocks["torch"].slot)
+        roof = [((x, 70, z), blocks["stone"].slot) for x, z in XZ]
+        chunk = self.lit_alone(*roof)
+        self.assertEqual(chunk.get_blocklight((15, 64, 8)), 0)
+        self.assertEqual(chunk.get_skylight((15, 65, 8)), 0)
+
+        chunk.relight_borders()
+        self.assertEqual(chunk.get_blocklight((15, 64, 8)), 13)
+        self.assertEqual(chunk.get_skylight((15, 65, 8)), 14)
+
+class TestLightingBatch(TestCase):
+
+    def setUp(self):
+        self.c = make_chunk()
+
+    def test_batch_matches_regenerate(self):
+        """
+        Lighting caught up after a batch is the same as lighting from
+        scratch.
+        """
+
+        with self.c.batch():
+            self.c.set_block((4, 64, 4), blocks["torch"].slot)
+            self.c.set_block((9, 64, 9), blocks["torch"].slot)
+            for x in range(3, 12):
+                self.c.set_block((x, 68, 6), 1)
+            for y in range(60, 64):
+                self.c.set_block((12, y, 12), 0)
+            self.c.set_block((4, 64, 4), blocks["air"].slot)
+
+        fresh = Chunk(0, 0)
+        for x, z in XZ:
+            fresh.set_block_column(x, z, self.c.get_block_column(x, z))
+        fresh.regenerate()
+
+        for x, z in XZ:
+            for y in range(56, 76):
+                coords = x, y, z
+                self.assertEqual(self.c.get_blocklight(coords),
+                                 fresh.get_blocklight(coords), coords)
+                self.assertEqual(self.c.get_skylight(coords),
+                                 fresh.get_skylight(coords), coords)
+
+    def test_batch_defers_lighting(self):
+        self.c.begin()
+        self.c.set_block((8, 64, 8), blocks["torch"].slot)
+        self.assertEqual(self.c.get_blocklight((8, 64, 8)), 0)
+        self.c.commit()
+        self.assertEqual(self.c.get_blocklight((8, 64, 8)), 14)
@@ -1,8 +1,21 @@
+from random import Random
+from struct import pack
+from zlib import crc32
+
 from twisted.trial.unittest import TestCase
 
 from twisted.python.filepath import FilePath
 
-from bravo.region import Region
+from bravo.region import (FreeExtents, MissingChunk, Region, RegionCache,
+                          pack_header)
+
+def noise(length):
+    """
+    Make some chunk data which won't compress.
+    """
+
+    r = Random(length)
+    return "".join(chr(r.randrange(256)) for i in xrange(length))
 
 class TestRegion(TestCase):
 
@@ -17,3 +30,369 @@ class TestRegion(TestCase):
         self.region.create()
         with self.fp.open("r") as handle:
             self.assertEqual(handle.read(), "\x00" * 8192)
+
+    def test_put_get_chunk(self):
+        self.region.create()
+        self.region.put_chunk(1, 2, "first")
+        self.region.put_chunk(3, 4, "second" * 1000)
+
+        region = Region(self.fp)
+        self.assertEqual(region.get_chunk(1, 2), "first")
+        self.assertEqual(region.get_chunk(3, 4), "second" * 1000)
+        self.assertRaises(MissingChunk, region.get_chunk, 5, 6)
+
+    def test_open(self):
+        self.region.create()
+        self.region.open()
+        handle = self.region.handle
+        self.region.put_chunk(1, 2, "first")
+        self.assertEqual(self.region.get_chunk(1, 2), "first")
+        self.assertIs(self.region.handle, handle)
+
+        # Everything is on disk, even though the handle is still open.
+        self.assertEqual(Region(self.fp).get_chunk(1, 2), "first")
+
+        self.region.close()
+        self.assertEqual(self.region.handle, None)
+        self.assertTrue(handle.closed)
+
+    def test_size(self):
+        self.region.create()
+        self.region.put_chunk(1, 2, "first")
+        self.assertEqual(self.region.size, self.fp.getsize())
+
+        region = Region(self.fp)
+        region.load_pages()
+        self.assertEqual(region.size, self.fp.getsize())
+
+    def test_create_reopens(self):
+        self.region.create()
+        self.region.open()
+        self.region.put_chunk(1, 2, "first")
+        self.region.create()
+        self.assertNotEqual(self.region.handle, None)
+        self.assertRaises(MissingChunk, self.region.get_chunk, 1, 2)
+        self.region.close()
+
+    def test_map(self):
+        self.region.create()
+        self.region.put_chunk(1, 2, "first")
+        self.assertTrue(self.region.map())
+
+        # Chunks come straight out of the map, not the file.
+        self.patch(self.region, "_file", None)
+        self.assertEqual(self.region.get_chunk(1, 2), "first")
+        self.assertEqual(self.region.get_chunk_header(1, 2)[1], 2)
+
+        self.region.close()
+        self.assertEqual(self.region.mapping, None)
+
+    def test_map_grown(self):
+        """
+        Chunks written past the end of the map are read from the file, until
+        the region is mapped again.
+        """
+
+        self.region.create()
+        self.region.open()
+        self.region.map()
+        mapping = self.region.mapping
+
+        self.region.put_chunk(1, 2, "first")
+        self.assertTrue(self.region.size > len(mapping))
+        self.assertEqual(self.region.get_chunk(1, 2), "first")
+
+        self.region.map()
+        self.assertIsNot(self.region.mapping, mapping)
+        self.patch(self.region, "_file", None)
+        self.assertEqual(self.region.get_chunk(1, 2), "first")
+        self.region.close()
+
+    def test_map_sees_writes(self):
+        self.region.create()
+        self.region.open()
+        self.region.put_chunk(1, 2, "first")
+        self.region.map()
+        self.region.put_chunk(1, 2, "later")
+        self.patch(self.region, "_file", None)
+        self.assertEqual(self.region.get_chunk(1, 2), "later")
+        self.region.close()
+
+    def test_map_missing(self):
+        self.assertFalse(self.region.map())
+
+    def test_reuse_pages(self):
+        """
+        Chunks which outgrow their pages leave them for other chunks.
+        """
+
+        self.region.create()
+        self.region.put_chunk(0, 0, noise(5000))
+        self.region.put_chunk(1, 0, "b")
+        self.region.put_chunk(0, 0, noise(9000))
+        self.assertEqual(list(self.region.free_pages), [(2, 2)])
+
+        self.region.put_chunk(2, 0, noise(5000))
+        self.assertEqual(self.region.positions[2, 0], (2, 2))
+        self.assertEqual(list(self.region.free_pages), [])
+
+    def test_grow_into_tail(self):
+        """
+        Chunks which don't fit anywhere start in the free pages at the end
+        of the file.
+        """
+
+        self.region.create()
+        self.region.put_chunk(0, 0, "a")
+        self.region.put_chunk(1, 0, "b")
+        self.region.put_chunk(1, 0, noise(5000))
+        self.assertEqual(self.region.positions[1, 0], (3, 2))
+        self.assertEqual(list(self.region.free_pages), [])
+
+    def test_load_free_pages(self):
+        self.region.create()
+        self.region.put_chunk(0, 0, "a")
+        self.region.put_chunk(1, 0, noise(5000))
+        self.region.put_chunk(2, 0, "c")
+        self.region.put_chunk(1, 0, "b")
+
+        region = Region(self.fp)
+        region.load_pages()
+        self.assertEqual(list(region.free_pages),
+                         list(self.region.free_pages))
+        self.assertEqual(list(region.free_pages), [(4, 1)])
+
+    def fragment(self):
+        self.region.create()
+        self.region.put_chunk(0, 0, noise(5000))
+        self.region.put_chunk(1, 1, "b")
+        self.region.put_chunk(1, 0, "c")
+        self.region.put_chunk(0, 0, noise(9000))
+
+    def test_compact(self):
+        self.fragment()
+        size = self.fp.getsize()
+
+        reclaimed = self.region.compact()
+        self.assertEqual(list(self.region.free_pages), [])
+        self.assertEqual(self.fp.getsize(), size - reclaimed)
+        self.assertEqual(self.region.size, self.fp.getsize())
+        self.assertFalse(self.fp.siblingExtension(".compact").exists())
+
+        region = Region(self.fp)
+        self.assertEqual(region.get_chunk(0, 0), noise(9000))
+        self.assertEqual(region.get_chunk(1, 1), "b")
+        self.assertEqual(region.get_chunk(1, 0), "c")
+        self.assertEqual(region.positions, self.region.positions)
+        self.assertEqual(list(region.free_pages), [])
+
+    def test_compact_order(self):
+        """
+        Chunks are packed along a Z-order curve.
+        """
+
+        self.fragment()
+        self.region.compact()
+        self.assertEqual(self.region.positions[0, 0], (2, 3))
+        self.assertEqual(self.region.positions[1, 0], (5, 1))
+        self.assertEqual(self.region.positions[1, 1], (6, 1))
+
+    def test_compact_spare_page(self):
+        self.fragment()
+        with self.fp.open("r+") as handle:
+            handle.seek(4096)
+            handle.write("timestamps")
+
+        self.region.compact()
+        with self.fp.open("r") as handle:
+            handle.seek(4096)
+            self.assertEqual(handle.read(10), "timestamps")
+
+    def test_compact_open_mapped(self):
+        self.fragment()
+        self.region.open()
+        self.region.map()
+        self.region.compact()
+
+        self.assertNotEqual(self.region.handle, None)
+        self.assertNotEqual(self.region.mapping, None)
+        self.assertEqual(self.region.get_chunk(1, 1), "b")
+        self.region.put_chunk(2, 2, "d")
+        self.assertEqual(Region(self.fp).get_chunk(2, 2), "d")
+        self.region.close()
+
+    def test_put_chunks(self):
+        self.region.create()
+        self.region.put_chunks({(0, 0): "a", (1, 0): noise(5000)})
+        self.assertFalse(self.region.journal.exists())
+
+        region = Region(self.fp)
+        self.assertEqual(region.get_chunk(0, 0), "a")
+        self.assertEqual(region.get_chunk(1, 0), noise(5000))
+
+        # The chunks were written together, one after the other.
+        self.assertEqual(list(region.free_pages), [])
+        self.assertEqual(region.size, 5 * 4096)
+
+    def test_put_chunks_moves(self):
+        """
+        Batches never overwrite the chunks they replace.
+        """
+
+        self.region.create()
+        self.region.put_chunk(0, 0, "a")
+        self.region.put_chunks({(0, 0): "b"})
+        self.assertEqual(self.region.positions[0, 0], (3, 1))
+        self.assertEqual(list(self.region.free_pages), [(2, 1)])
+        self.assertEqual(Region(self.fp).get_chunk(0, 0), "b")
+
+    def test_put_chunks_empty(self):
+        self.region.create()
+        self.region.put_chunks({})
+        self.assertEqual(self.fp.getsize(), 8192)
+
+    def test_recover(self):
+        """
+        Journaled batches are finished when the region is loaded.
+        """
+
+        self.region.create()
+        self.region.put_chunk(0, 0, "a")
+        header = pack_header({(1, 1): (2, 1)})
+        self.region.journal.setContent(header + pack(">l", crc32(header)))
+
+        region = Region(self.fp)
+        self.assertEqual(region.get_chunk(1, 1), "a")
+        self.assertRaises(MissingChunk, region.get_chunk, 0, 0)
+        self.assertFalse(region.journal.exists())
+
+    def test_recover_torn(self):
+        """
+        Journals which weren't completely written are thrown away.
+        """
+
+        self.region.create()
+        self.region.put_chunk(0, 0, "a")
+        header = pack_header({(1, 1): (2, 1)})
+        self.region.journal.setContent(header[:1000])
+
+        region = Region(self.fp)
+        self.assertFalse(region.recover())
+        self.assertEqual(region.get_chunk(0, 0), "a")
+        self.assertFalse(region.journal.exists())
+
+    def test_load_pages_without_recovery(self):
+        """
+        Regions can be loaded without finishing journaled batches.
+        """
+
+        self.region.create()
+        self.region.put_chunk(0, 0, "a")
+        header = pack_header({(1, 1): (2, 1)})
+        journal = header + pack(">l", crc32(header))
+        self.region.journal.setContent(journal)
+
+        region = Region(self.fp)
+        region.load_pages(recover=False)
+        self.assertEqual(region.positions, {(0, 0): (2, 1)})
+        self.assertEqual(region.journal.getContent(), journal)
+
+class TestFreeExtents(TestCase):
+
+    def setUp(self):
+        self.extents = FreeExtents()
+
+    def test_empty(self):
+        self.assertEqual(len(self.extents), 0)
+        self.assertEqual(self.extents.allocate(1), None)
+
+    def test_free(self):
+        self.extents.free(2, 3)
+        self.assertEqual(list(self.extents), [(2, 3)])
+        self.assertEqual(len(self.extents), 3)
+        self.assertTrue(4 in self.extents)
+        self.assertFalse(5 in self.extents)
+        self.assertFalse(1 in self.extents)
+
+    def test_coalesce(self):
+        self.extents.free(2, 1)
+        self.extents.free(6, 2)
+        self.extents.free(4, 1)
+        self.assertEqual(list(self.extents), [(2, 1), (4, 1), (6, 2)])
+        self.extents.free(3, 1)
+        self.assertEqual(list(self.extents), [(2, 3), (6, 2)])
+        self.extents.free(5, 1)
+        self.assertEqual(list(self.extents), [(2, 6)])
+
+    def test_best_fit(self):
+        self.extents.free(2, 4)
+        self.extents.free(10, 2)
+        self.extents.free(20, 2)
+        self.assertEqual(self.extents.allocate(2), 10)
+        self.assertEqual(self.extents.allocate(3), 2)
+        self.assertEqual(list(self.extents), [(5, 1), (20, 2)])
+        self.assertEqual(self.extents.allocate(3), None)
+
+    def test_from_used(self):
+        extents = FreeExtents.from_used([(6, 2), (2, 1), (3, 2), (4, 1)], 2,
+                                        12)
+        self.assertEqual(list(extents), [(5, 1), (8, 4)])
+
+    def test_from_used_past_end(self):
+        extents = FreeExtents.from_used([(4, 10)], 2, 8)
+        self.assertEqual(list(extents), [(2, 2)])
+        extents = FreeExtents.from_used([(3, 1)], 2, 2)
+        self.assertEqual(list(extents), [])
+
+    def test_take_tail(self):
+        self.extents.free(2, 2)
+        self.extents.free(6, 2)
+        self.assertEqual(self.extents.take_tail(10), None)
+        self.assertEqual(self.extents.take_tail(8), 6)
+        self.assertEqual(list(self.extents), [(2, 2)])
+
+class TestRegionCache(TestCase):
+
+    def setUp(self):
+        self.cache = RegionCache(2)
+        self.fps = [FilePath(self.mktemp()) for i in range(3)]
+        for fp in self.fps:
+            region = self.cache.get(fp)
+            region.create()
+            region.open()
+
+    def tearDown(self):
+        self.cache.close()
+
+    def test_get(self):
+        first = self.cache.get(self.fps[0])
+        self.assertIs(self.cache.get(self.fps[0]), first)
+        self.assertEqual(self.cache.misses, 3)
+        self.assertEqual(self.cache.hits, 2)
+
+    def test_evict(self):
+        first = self.cache.get(self.fps[0])
+        self.cache.evict()
+        self.assertEqual(len(self.cache), 2)
+        self.assertNotIn(self.fps[1].path, self.cache)
+        self.assertIn(first.fp.path, self.cache)
+        self.assertEqual(self.cache.evictions, 1)
+
+    def test_evict_busy(self):
+        self.cache.evict(busy=[self.fps[0].path])
+        self.assertIn(self.fps[0].path, self.cache)
+        self.assertNotIn(self.fps[1].path, self.cache)
+
+    def test_evict_closes(self):
+        region = self.cache.get(self.fps[0])
+        self.cache.get(self.fps[1])
+        self.cache.get(self.fps[2])
+        self.cache.evict()
+        self.assertEqual(region.handle, None)
+
+    def test_close(self):
+        regions = [self.cache.get(fp) for fp in self.fps]
+        self.cache.close()
+        self.assertEqual(len(self.cache), 0)
+        for region in regions:
+            self.assertEqual(region.handle, None)
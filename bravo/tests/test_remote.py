@@ -0,0 +1,66 @@
+from twisted.internet.defer import CancelledError, inlineCallbacks
+from twisted.trial import unittest
+
+from bravo.chunk import Chunk
+from bravo.errors import ChunkGenerationError
+from bravo.remote import GenerationPool, fill_chunk, make_chunk
+from bravo.utilities.coords import XZ
+
+class TestPacking(unittest.TestCase):
+
+    def test_roundtrip(self):
+        chunk = fill_chunk(Chunk(1, 2), make_chunk(1, 2, 0, ["boring"]))
+
+        self.assertEqual(chunk.get_block((1, 2, 3)), 1)
+        self.assertEqual(chunk.get_block((1, 200, 3)), 0)
+        self.assertEqual(chunk.height_at(1, 3), 127)
+        self.assertEqual(chunk.get_skylight((1, 128, 3)), 15)
+        self.assertTrue(chunk.sections[15].is_uniform())
+
+class TestGenerationPool(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = GenerationPool(1, limit=1)
+
+    def tearDown(self):
+        self.pool.stop()
+
+    @inlineCallbacks
+    def test_generate(self):
+        packed = yield self.pool.generate(0, 0, 0, ["boring"])
+        chunk = fill_chunk(Chunk(0, 0), packed)
+
+        expected = Chunk(0, 0)
+        fill_chunk(expected, make_chunk(0, 0, 0, ["boring"]))
+        for x, z in XZ:
+            self.assertEqual(chunk.get_block_column(x, z),
+                             expected.get_block_column(x, z))
+        self.assertEqual(self.pool.generated, 1)
+        self.assertEqual(len(self.pool), 0)
+
+    @inlineCallbacks
+    def test_cancel_queued(self):
+        first = self.pool.generate(0, 0, 0, ["boring"])
+        second = self.pool.generate(1, 0, 0, ["boring"])
+        self.assertEqual(len(self.pool), 2)
+
+        self.pool.cancel(1, 0)
+        yield self.assertFailure(second, CancelledError)
+        self.assertEqual(len(self.pool), 1)
+
+        yield first
+        self.assertEqual(self.pool.generated, 1)
+        self.assertEqual(self.pool.cancelled, 1)
+
+    @inlineCallbacks
+    def test_cancel_running(self):
+        d = self.pool.generate(0, 0, 0, ["boring"])
+        self.pool.cancel(0, 0)
+        yield self.assertFailure(d, CancelledError)
+
+        # The worker is freed up for the next chunk once it's done.
+        yield self.pool.generate(1, 0, 0, ["boring"])
+
+    def test_error(self):
+        d = self.pool.generate(0, 0, 0, ["nonexistent"])
+        return self.assertFailure(d, ChunkGenerationError)
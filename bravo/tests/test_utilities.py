@@ -4,7 +4,8 @@ import unittest
 
 from array import array
 
-from bravo.utilities.bits import unpack_nibbles, pack_nibbles
+from bravo.utilities import bits
+from bravo.utilities.bits import NibbleArray, unpack_nibbles, pack_nibbles
 from bravo.utilities.chat import sanitize_chat
 from bravo.utilities.coords import split_coords, taxicab2, taxicab3
 from bravo.utilities.temporal import split_time
@@ -40,7 +41,11 @@ class TestCoordHandling(unittest.TestCase):
         for case in cases:
             self.assertEqual(taxicab3(*case), cases[case])
 
-class TestBitTwiddling(unittest.TestCase):
+class BitTwiddlingMixin(object):
+    """
+    Tests for the nibble kernels, which must behave identically with and
+    without NumPy.
+    """
 
     def test_unpack_nibbles_single(self):
         self.assertEqual(unpack_nibbles("a"), array("B", [1, 6]))
@@ -70,6 +75,99 @@ class TestBitTwiddling(unittest.TestCase):
 
         self.assertEqual(pack_nibbles(array("B", [0xff, 0xff])), "\xff")
 
+    def test_pack_nibbles_odd(self):
+        self.assertEqual(pack_nibbles(array("B", [1, 6, 3])), "a\x03")
+
+    def test_pack_nibbles_list(self):
+        self.assertEqual(pack_nibbles([14, 6, 9, 6, 2, 0x16, 3, 7]), "nibs")
+
+    def test_nibbles_empty(self):
+        self.assertEqual(pack_nibbles(array("B")), "")
+        self.assertEqual(unpack_nibbles(""), array("B"))
+
+    def test_nibbles_all_bytes(self):
+        """
+        Every byte survives a round trip, at section size.
+        """
+
+        packed = "".join(chr(i) for i in range(256)) * 8
+        unpacked = unpack_nibbles(packed)
+        self.assertEqual(len(unpacked), 4096)
+        self.assertEqual(unpacked[2 * 0x5a], 0xa)
+        self.assertEqual(unpacked[2 * 0x5a + 1], 0x5)
+        self.assertEqual(pack_nibbles(unpacked), packed)
+
+class TestBitTwiddling(BitTwiddlingMixin, unittest.TestCase):
+    pass
+
+class TestBitTwiddlingPurePython(BitTwiddlingMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.numpy = bits.numpy
+        bits.numpy = None
+
+    def tearDown(self):
+        bits.numpy = self.numpy
+
+class TestNibbleArray(unittest.TestCase):
+
+    def setUp(self):
+        self.a = NibbleArray("nibbles")
+
+    def test_len(self):
+        self.assertEqual(len(self.a), 14)
+
+    def test_getitem(self):
+        self.assertEqual(list(self.a), list(unpack_nibbles("nibbles")))
+        self.assertEqual(self.a[0], 14)
+        self.assertEqual(self.a[1], 6)
+        self.assertEqual(self.a[-1], 7)
+
+    def test_setitem(self):
+        self.a[0] = 1
+        self.a[1] = 2
+        self.assertEqual(self.a.tostring()[0], "!")
+        self.assertEqual(self.a.tostring()[1:], "ibbles")
+
+    def test_setitem_truncates(self):
+        self.a[2] = 0x1f
+        self.assertEqual(self.a[2], 0xf)
+        self.assertEqual(self.a[3], 6)
+
+    def test_slice_aligned(self):
+        self.assertEqual(self.a[2:6], array("B", [9, 6, 2, 6]))
+        self.a[2:6] = array("B", [1, 2, 3, 4])
+        self.assertEqual(self.a[2:6], array("B", [1, 2, 3, 4]))
+        self.assertEqual(self.a[:2], array("B", [14, 6]))
+
+    def test_slice_unaligned(self):
+        self.assertEqual(self.a[1::4], array("B", [6, 6, 6, 7]))
+        self.a[1::4] = [1, 2, 3, 4]
+        self.assertEqual(self.a[1::4], array("B", [1, 2, 3, 4]))
+        self.assertEqual(self.a[0], 14)
+
+    def test_slice_resize(self):
+        self.assertRaises(ValueError, self.a.__setitem__, slice(0, 2), [1])
+
+    def test_from_nibbles(self):
+        a = NibbleArray.from_nibbles(array("B", [1, 6]))
+        self.assertEqual(a.tostring(), "a")
+
+    def test_filled(self):
+        a = NibbleArray.filled(0xf, 4)
+        self.assertEqual(a.tostring(), "\xff\xff")
+        self.assertEqual(a.count(0xf), 4)
+
+    def test_copy(self):
+        copied = self.a.copy()
+        copied[0] = 0
+        self.assertEqual(self.a[0], 14)
+        self.assertNotEqual(self.a, copied)
+
+    def test_equality(self):
+        self.assertEqual(self.a, NibbleArray("nibbles"))
+        self.assertEqual(self.a, unpack_nibbles("nibbles"))
+
 class TestStringMunging(unittest.TestCase):
 
     def test_sanitize_chat_color_control_at_end(self):
@@ -1,14 +1,18 @@
 from twisted.trial import unittest
 
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet.defer import (CancelledError, Deferred,
+                                    inlineCallbacks, returnValue)
+from twisted.internet.task import Clock
 
 from array import array
 from itertools import product
 import os
 
+from bravo.chunk import Chunk
 from bravo.config import BravoConfigParser
 from bravo.errors import ChunkNotLoaded
-from bravo.world import ChunkCache, World
+from bravo.world import (ChunkCache, ChunkScheduler, ImpossibleCoordinates,
+                         World)
 
 
 class MockChunk(object):
@@ -40,6 +44,430 @@ class TestChunkCache(unittest.TestCase):
         cc.unpin(chunk)
         self.assertIs(cc.get((1, 2)), chunk)
 
+    def test_cleaned_stays(self):
+        cc = ChunkCache()
+        chunk = MockChunk(1, 2)
+        cc.dirtied(chunk)
+        cc.cleaned(chunk)
+        self.assertIs(cc.get((1, 2)), chunk)
+        self.assertEqual(len(cc), 1)
+
+    def test_put_evicts_oldest(self):
+        cc = ChunkCache(2)
+        for i in range(3):
+            cc.put(MockChunk(i, 0))
+        self.assertIs(cc.get((0, 0)), None)
+        self.assertIsNot(cc.get((1, 0)), None)
+        self.assertIsNot(cc.get((2, 0)), None)
+        self.assertEqual(cc.evictions, 1)
+
+    def test_get_refreshes(self):
+        cc = ChunkCache(2)
+        cc.put(MockChunk(0, 0))
+        cc.put(MockChunk(1, 0))
+        cc.get((0, 0))
+        cc.put(MockChunk(2, 0))
+        self.assertIsNot(cc.get((0, 0)), None)
+        self.assertIs(cc.get((1, 0)), None)
+
+    def test_peek_doesnt_refresh(self):
+        cc = ChunkCache(2)
+        cc.put(MockChunk(0, 0))
+        cc.put(MockChunk(1, 0))
+        cc.peek((0, 0))
+        cc.put(MockChunk(2, 0))
+        self.assertIs(cc.peek((0, 0)), None)
+        self.assertEqual(cc.hits, 0)
+        self.assertEqual(cc.misses, 0)
+
+    def test_tickets(self):
+        cc = ChunkCache()
+        cc.acquire((1, 2))
+        cc.acquire((1, 2))
+        self.assertFalse(cc.release((1, 2)))
+        self.assertTrue(cc.in_use((1, 2)))
+        self.assertTrue(cc.release((1, 2)))
+        self.assertFalse(cc.in_use((1, 2)))
+
+    def test_in_use_never_evicted(self):
+        cc = ChunkCache(2)
+        cc.acquire((0, 0))
+        for i in range(3):
+            cc.put(MockChunk(i, 0))
+        self.assertIsNot(cc.get((0, 0)), None)
+        self.assertIsNot(cc.get((2, 0)), None)
+        self.assertIs(cc.get((1, 0)), None)
+
+    def test_in_use_evicts_just_enough(self):
+        cc = ChunkCache(10)
+        for i in range(4):
+            cc.acquire((i, 0))
+            cc.put(MockChunk(i, 0))
+        for i in range(4, 11):
+            cc.put(MockChunk(i, 0))
+        self.assertEqual(len(cc._clean), 10)
+        self.assertEqual(cc.evictions, 1)
+        self.assertIs(cc.peek((4, 0)), None)
+        self.assertIsNot(cc.peek((5, 0)), None)
+
+    def test_dirty_never_evicted(self):
+        cc = ChunkCache(1)
+        chunk = MockChunk(0, 0)
+        cc.put(chunk)
+        cc.dirtied(chunk)
+        cc.put(MockChunk(1, 0))
+        cc.put(MockChunk(2, 0))
+        self.assertIs(cc.get((0, 0)), chunk)
+
+    def test_stats(self):
+        cc = ChunkCache()
+        cc.put(MockChunk(0, 0))
+        cc.get((0, 0))
+        cc.get((1, 0))
+        self.assertEqual(cc.hits, 1)
+        self.assertEqual(cc.misses, 1)
+
+    def test_dirty_oldest_first(self):
+        cc = ChunkCache()
+        cc.clock = Clock()
+        first, second = MockChunk(0, 0), MockChunk(1, 0)
+        cc.dirtied(first)
+        cc.clock.advance(1)
+        cc.dirtied(second)
+        cc.clock.advance(1)
+        # Dirtying a chunk again doesn't move it to the back of the line.
+        cc.dirtied(first)
+        self.assertEqual(list(cc.iterdirty()), [first, second])
+        self.assertEqual(cc.dirty_since((0, 0)), 0)
+        self.assertEqual(cc.dirty_since((1, 0)), 1)
+        self.assertEqual(cc.dirty_count(), 2)
+
+        cc.cleaned(first)
+        self.assertIs(cc.dirty_since((0, 0)), None)
+        self.assertEqual(cc.dirty_count(), 1)
+
+
+class TestChunkFlusher(unittest.TestCase):
+
+    def setUp(self):
+        self.bcp = BravoConfigParser()
+
+        self.bcp.add_section("world unittest")
+        self.bcp.set("world unittest", "url", "")
+        self.bcp.set("world unittest", "serializer", "memory")
+        self.bcp.set("world unittest", "flush_chunks", "2")
+
+        self.w = World(self.bcp, "unittest")
+        self.w.clock = Clock()
+        self.w.pipeline = []
+        self.w.start()
+        self.flusher = self.w.flusher
+
+    def tearDown(self):
+        self.w.stop()
+
+    @inlineCallbacks
+    def dirty_chunks(self, count):
+        chunks = []
+        for i in range(count):
+            chunk = yield self.w.request_chunk(i, 0)
+            chunk.set_block((0, 0, 0), 1)
+            chunks.append(chunk)
+            self.w.clock.advance(0.25)
+        self.assertEqual(self.flusher.backlog, count)
+        returnValue(chunks)
+
+    @inlineCallbacks
+    def test_oldest_first(self):
+        chunks = yield self.dirty_chunks(3)
+
+        self.w.clock.advance(0.25)
+        self.assertEqual([c.dirty for c in chunks], [False, False, True])
+        self.assertEqual(self.flusher.backlog, 1)
+        self.assertEqual(self.flusher.flushed, 2)
+        self.assertEqual(self.flusher.max_latency, 1)
+
+        self.w.clock.advance(1)
+        self.assertFalse(chunks[2].dirty)
+        self.assertEqual(self.flusher.backlog, 0)
+
+    @inlineCallbacks
+    def test_size_budget(self):
+        chunks = yield self.dirty_chunks(2)
+        self.flusher.size = 1
+
+        # At least one chunk is always written.
+        self.w.clock.advance(1)
+        self.assertEqual([c.dirty for c in chunks], [False, True])
+
+    @inlineCallbacks
+    def test_coalesce(self):
+        chunk = yield self.w.request_chunk(0, 0)
+        for i in range(10):
+            chunk.set_block((i, 0, 0), 1)
+        self.assertEqual(self.flusher.backlog, 1)
+
+        self.w.clock.advance(1)
+        self.assertFalse(chunk.dirty)
+        self.assertEqual(self.flusher.flushed, 1)
+
+    @inlineCallbacks
+    def test_save_off(self):
+        chunks = yield self.dirty_chunks(2)
+
+        self.w.save_off()
+        self.w.clock.advance(5)
+        self.assertTrue(all(c.dirty for c in chunks))
+
+        self.w.save_on()
+        self.w.clock.advance(1)
+        self.assertFalse(any(c.dirty for c in chunks))
+
+    @inlineCallbacks
+    def test_estimate(self):
+        yield self.dirty_chunks(3)
+        self.assertEqual(self.flusher.estimate(), 2)
+        self.flusher.chunks = 1
+        self.assertEqual(self.flusher.estimate(), 3)
+
+    @inlineCallbacks
+    def test_changed_during_save(self):
+        """
+        Chunks which change while being written out stay dirty.
+        """
+
+        chunk = yield self.w.request_chunk(0, 0)
+        chunk.set_block((0, 0, 0), 1)
+
+        save = self.w.serializer.save_chunk
+        def save_chunk(c):
+            save(c)
+            c.set_block((1, 0, 0), 1)
+        self.w.serializer.save_chunk = save_chunk
+
+        yield self.w.save_chunk(chunk)
+        self.assertTrue(chunk.dirty)
+
+
+class TestCompactor(unittest.TestCase):
+
+    def setUp(self):
+        self.bcp = BravoConfigParser()
+
+        self.bcp.add_section("world unittest")
+        self.bcp.set("world unittest", "url", "")
+        self.bcp.set("world unittest", "serializer", "memory")
+        self.bcp.set("world unittest", "compact_interval", "10")
+
+        self.w = World(self.bcp, "unittest")
+        self.w.clock = Clock()
+        self.w.pipeline = []
+        self.w.start()
+        self.compactor = self.w.compactor
+        self.patch(self.w.serializer, "compact", lambda: 8192)
+
+    def tearDown(self):
+        self.w.stop()
+
+    def test_interval(self):
+        self.w.clock.advance(9)
+        self.assertEqual(self.compactor.compactions, 0)
+        self.w.clock.advance(1)
+        self.assertEqual(self.compactor.compactions, 1)
+        self.assertEqual(self.compactor.reclaimed, 8192)
+
+    def test_waits(self):
+        """
+        Compaction doesn't start again until the last one is done.
+        """
+
+        d = Deferred()
+        self.patch(self.w.serializer, "compact", lambda: d)
+        self.w.clock.advance(30)
+        self.assertEqual(self.compactor.compactions, 1)
+        d.callback(0)
+        self.w.clock.advance(10)
+        self.assertEqual(self.compactor.compactions, 2)
+
+    def test_failure(self):
+        def compact():
+            raise IOError()
+        self.patch(self.w.serializer, "compact", compact)
+        self.w.clock.advance(10)
+        self.w.clock.advance(10)
+        self.assertEqual(self.compactor.compactions, 2)
+        self.assertEqual(len(self.flushLoggedErrors(IOError)), 2)
+
+    def test_save_off(self):
+        self.w.save_off()
+        self.w.clock.advance(30)
+        self.assertEqual(self.compactor.compactions, 0)
+
+        self.w.save_on()
+        self.w.clock.advance(10)
+        self.assertEqual(self.compactor.compactions, 1)
+
+class MockWorld(object):
+
+    def __init__(self):
+        self.clock = Clock()
+        self.requests = {}
+        self.order = []
+
+    def request_chunk(self, x, z):
+        self.order.append((x, z))
+        d = self.requests[x, z] = Deferred()
+        return d
+
+
+class TestChunkScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.w = MockWorld()
+        self.s = ChunkScheduler(self.w, concurrency=2)
+
+    def test_priority(self):
+        for i, priority in enumerate([5, 1, 3, 0]):
+            self.s.schedule(i, 0, priority)
+        self.w.clock.advance(0)
+        self.assertEqual(self.w.order, [(3, 0), (1, 0)])
+
+        self.w.requests[3, 0].callback(None)
+        self.w.clock.advance(self.s.interval)
+        self.assertEqual(self.w.order, [(3, 0), (1, 0), (2, 0)])
+
+    def test_deduplicate(self):
+        first = self.s.schedule(0, 0, 4)
+        second = self.s.schedule(0, 0, 2)
+        self.assertEqual(self.s.priority_of(0, 0), 2)
+        self.w.clock.advance(0)
+        self.assertEqual(self.w.order, [(0, 0)])
+        self.assertEqual(self.s.deduplicated, 1)
+
+        chunk = MockChunk(0, 0)
+        self.w.requests[0, 0].callback(chunk)
+        self.assertIs(self.successResultOf(first), chunk)
+        self.assertIs(self.successResultOf(second), chunk)
+        self.assertEqual(self.s.running, 0)
+
+    def test_prioritize(self):
+        self.s.concurrency = 1
+        self.s.schedule(0, 0, 1)
+        d = self.s.schedule(1, 0, 2)
+        self.s.prioritize(d, 0)
+        self.w.clock.advance(0)
+        self.assertEqual(self.w.order, [(1, 0)])
+
+    def test_cancel_before_start(self):
+        d = self.s.schedule(0, 0)
+        d.cancel()
+        self.failureResultOf(d, CancelledError)
+        self.w.clock.advance(0)
+        self.assertEqual(self.w.order, [])
+        self.assertEqual(self.s.queued, 0)
+        self.assertEqual(self.s.cancelled, 1)
+
+    def test_cancel_one_of_two(self):
+        first = self.s.schedule(0, 0)
+        second = self.s.schedule(0, 0)
+        first.cancel()
+        self.w.clock.advance(0)
+        self.assertEqual(self.w.order, [(0, 0)])
+
+        self.w.requests[0, 0].callback(None)
+        self.failureResultOf(first, CancelledError)
+        self.assertEqual(self.successResultOf(second), None)
+
+    def test_concurrency(self):
+        for i in range(5):
+            self.s.schedule(i, 0)
+        self.w.clock.advance(0)
+        self.assertEqual(self.s.running, 2)
+        self.assertEqual(self.s.queued, 3)
+
+        # Nothing more is started until something finishes.
+        self.w.clock.advance(1)
+        self.assertEqual(self.s.running, 2)
+
+    def test_error(self):
+        d = self.s.schedule(0, 0)
+        self.w.clock.advance(0)
+        self.w.requests[0, 0].errback(ValueError())
+        self.failureResultOf(d, ValueError)
+
+    def test_stop(self):
+        d = self.s.schedule(0, 0)
+        self.s.stop()
+        self.failureResultOf(d, CancelledError)
+        self.assertEqual(self.w.clock.getDelayedCalls(), [])
+
+
+class TestWorldWorkers(unittest.TestCase):
+
+    def setUp(self):
+        self.bcp = BravoConfigParser()
+
+        self.bcp.add_section("world unittest")
+        self.bcp.set("world unittest", "url", "")
+        self.bcp.set("world unittest", "serializer", "memory")
+        self.bcp.set("world unittest", "workers", "1")
+
+        self.w = World(self.bcp, "unittest")
+        self.w.pipeline = []
+        self.w.start()
+
+    def tearDown(self):
+        self.w.stop()
+
+    @inlineCallbacks
+    def test_request_chunk(self):
+        self.assertTrue(self.w.async)
+        chunk = yield self.w.request_chunk(0, 0)
+        self.assertTrue(chunk.populated)
+        self.assertIs(self.w._cache.peek((0, 0)), chunk)
+
+    def test_release_cancels(self):
+        self.w.acquire_chunk(0, 0)
+        d = self.w.schedule_chunk(0, 0)
+        self.w.scheduler.tick()
+        self.assertTrue(self.w.scheduler.requested(0, 0))
+
+        d.cancel()
+        self.w.release_chunk(0, 0)
+        self.assertNotIn((0, 0), self.w._pending_chunks)
+        self.assertEqual(self.w._generator.cancelled, 1)
+        return self.assertFailure(d, CancelledError)
+
+    @inlineCallbacks
+    def test_request_after_cancel(self):
+        """
+        Cancelled generations don't leave empty chunks behind.
+        """
+
+        self.w.acquire_chunk(0, 0)
+        d = self.w.schedule_chunk(0, 0)
+        self.w.scheduler.tick()
+        d.cancel()
+        self.failureResultOf(d, CancelledError)
+        self.w.release_chunk(0, 0)
+        self.assertEqual(self.w._cache.peek((0, 0)), None)
+
+        chunk = yield self.w.request_chunk(0, 0)
+        self.assertTrue(chunk.populated)
+
+    @inlineCallbacks
+    def test_release_awaited(self):
+        """
+        Chunks which somebody is still waiting for aren't cancelled.
+        """
+
+        self.w.acquire_chunk(0, 0)
+        d = self.w.request_chunk(0, 0)
+        self.w.release_chunk(0, 0)
+        self.assertIn((0, 0), self.w._pending_chunks)
+
+        chunk = yield d
+        self.assertTrue(chunk.populated)
 
 class TestWorldChunks(unittest.TestCase):
 
@@ -67,6 +495,31 @@ class TestWorldChunks(unittest.TestCase):
         second = yield self.w.request_chunk(0, 0)
         self.assertIs(first, second)
 
+    @inlineCallbacks
+    def test_request_chunk_concurrent_identity(self):
+        """
+        Chunks which are asked for again while they are being loaded are
+        only loaded once.
+        """
+
+        loads = []
+        def load_chunk(x, z):
+            d = Deferred()
+            loads.append(d)
+            return d
+        self.patch(self.w.serializer, "load_chunk", load_chunk)
+
+        first = self.w.request_chunk(0, 0)
+        second = self.w.request_chunk(0, 0)
+        self.assertEqual(len(loads), 1)
+
+        loads[0].callback(Chunk(0, 0))
+        first = yield first
+        second = yield second
+        self.assertIs(first, second)
+        self.assertIs(self.w._cache.peek((0, 0)), first)
+        self.assertEqual(self.w._pending_chunks, {})
+
     @inlineCallbacks
     def test_request_chunk_cached_identity(self):
         # Turn on the cache and get a few chunks in there, then request a
@@ -76,6 +529,92 @@ class TestWorldChunks(unittest.TestCase):
         second = yield self.w.request_chunk(0, 0)
         self.assertIs(first, second)
 
+    @inlineCallbacks
+    def test_schedule_chunk(self):
+        first = yield self.w.schedule_chunk(0, 0)
+        second = yield self.w.request_chunk(0, 0)
+        self.assertIs(first, second)
+
+    @inlineCallbacks
+    def test_schedule_chunk_cached(self):
+        """
+        Chunks which are already in memory don't go through the scheduler.
+        """
+
+        yield self.w.enable_cache(1)
+        first = yield self.w.request_chunk(0, 0)
+        d = self.w.schedule_chunk(0, 0)
+        self.assertIs(self.successResultOf(d), first)
+        self.assertEqual(self.w.scheduler.scheduled, 0)
+
+    @inlineCallbacks
+    def test_batch_across_chunks(self):
+        first = yield self.w.request_chunk(0, 0)
+        second = yield self.w.request_chunk(1, 0)
+
+        with self.w.batch():
+            self.w.sync_set_block((15, 70, 0), 1)
+            self.w.sync_set_block((16, 70, 0), 1)
+            self.assertFalse(first.is_damaged())
+            self.assertFalse(second.is_damaged())
+
+        self.assertEqual(first.height_at(15, 0), 70)
+        self.assertEqual(second.height_at(0, 0), 70)
+        self.assertTrue(first.is_damaged())
+        self.assertTrue(second.is_damaged())
+
+    @inlineCallbacks
+    def test_request_chunk_clean_identity(self):
+        """
+        Chunks which have been written out are still served from memory.
+        """
+
+        first = yield self.w.request_chunk(0, 0)
+        yield self.w.save_chunk(first)
+        self.w._cache.cleaned(first)
+        second = yield self.w.request_chunk(0, 0)
+        self.assertIs(first, second)
+
+    @inlineCallbacks
+    def test_release_unloads(self):
+        self.w.clock = Clock()
+        self.w.acquire_chunk(0, 0)
+        chunk = yield self.w.request_chunk(0, 0)
+        chunk.set_block((1, 2, 3), 4)
+
+        self.w.release_chunk(0, 0)
+        self.assertIs(self.w._cache.peek((0, 0)), chunk)
+
+        self.w.clock.advance(self.w.unload_grace)
+        self.assertIs(self.w._cache.peek((0, 0)), None)
+
+        # It was written out on the way.
+        chunk = yield self.w.request_chunk(0, 0)
+        self.assertEqual(chunk.get_block((1, 2, 3)), 4)
+
+    @inlineCallbacks
+    def test_acquire_cancels_unload(self):
+        self.w.clock = Clock()
+        self.w.acquire_chunk(0, 0)
+        chunk = yield self.w.request_chunk(0, 0)
+
+        self.w.release_chunk(0, 0)
+        self.w.clock.advance(1)
+        self.w.acquire_chunk(0, 0)
+        self.w.clock.advance(self.w.unload_grace)
+        self.assertIs(self.w._cache.peek((0, 0)), chunk)
+
+    @inlineCallbacks
+    def test_pinned_not_unloaded(self):
+        self.w.clock = Clock()
+        self.w.acquire_chunk(0, 0)
+        chunk = yield self.w.request_chunk(0, 0)
+        self.w._cache.pin(chunk)
+
+        self.w.release_chunk(0, 0)
+        self.w.clock.advance(self.w.unload_grace)
+        self.assertIs(self.w._cache.peek((0, 0)), chunk)
+
     @inlineCallbacks
     def test_get_block(self):
         chunk = yield self.w.request_chunk(0, 0)
@@ -221,6 +760,131 @@ class TestWorldChunks(unittest.TestCase):
 
         return d
 
+    @inlineCallbacks
+    def test_get_blocks(self):
+        coords = [(-1, 64, 0), (0, 64, 0), (17, 64, 3), (0, 65, 0)]
+        for x, y, z in coords:
+            yield self.w.set_block((x, y, z), x + y)
+
+        blocks = yield self.w.get_blocks(coords)
+        self.assertEqual(blocks, [63, 64, 81, 65])
+
+    @inlineCallbacks
+    def test_set_blocks(self):
+        coords = [(-1, 64, 0), (0, 64, 0), (17, 64, 3)]
+        chunks = yield self.w.set_blocks(coords, [1, 2, 3], 4)
+
+        self.assertEqual(sorted((c.x, c.z) for c in chunks),
+                         [(-1, 0), (0, 0), (1, 0)])
+        for (x, y, z), block in zip(coords, [1, 2, 3]):
+            self.assertEqual(self.w.sync_get_block((x, y, z)), block)
+            self.assertEqual(self.w.sync_get_metadata((x, y, z)), 4)
+
+    @inlineCallbacks
+    def test_set_blocks_batch(self):
+        """
+        Bulk changes are made in one batch.
+        """
+
+        chunk = yield self.w.request_chunk(0, 0)
+        chunk.populated = True
+        calls = []
+        chunk.commit = lambda: calls.append(chunk)
+
+        yield self.w.set_blocks([(1, 64, 1), (2, 64, 2)], 1)
+        self.assertEqual(calls, [chunk])
+
+    def test_set_blocks_wrong_count(self):
+        self.assertRaises(ValueError, self.w.set_blocks,
+                          [(0, 64, 0), (1, 64, 0)], [1])
+
+    def test_set_blocks_impossible(self):
+        self.assertRaises(ImpossibleCoordinates, self.w.set_blocks,
+                          [(0, 64, 0), (1, 256, 0)], 1)
+
+    @inlineCallbacks
+    def test_destroy_blocks(self):
+        coords = [(0, 64, 0), (16, 64, 0)]
+        yield self.w.set_blocks(coords, 1)
+        yield self.w.destroy_blocks(coords)
+        blocks = yield self.w.get_blocks(coords)
+        self.assertEqual(blocks, [0, 0])
+
+    @inlineCallbacks
+    def test_sync_set_blocks(self):
+        yield self.w.request_chunk(0, 0)
+        self.w.sync_set_blocks([(0, 64, 0), (1, 64, 0)], [5, 6])
+        self.assertEqual(self.w.sync_get_blocks([(1, 64, 0), (0, 64, 0)]),
+                         [6, 5])
+
+    @inlineCallbacks
+    def test_sync_set_blocks_unloaded(self):
+        """
+        Nothing is changed unless every chunk is loaded.
+        """
+
+        yield self.w.request_chunk(0, 0)
+        self.assertRaises(ChunkNotLoaded, self.w.sync_set_blocks,
+                          [(0, 64, 0), (16, 64, 0)], 1)
+        self.assertEqual(self.w.sync_get_block((0, 64, 0)), 0)
+
+    @inlineCallbacks
+    def test_cursor_matches_world(self):
+        for i, j in product((-1, 0), repeat=2):
+            chunk = yield self.w.request_chunk(i, j)
+            for x, y, z in product(xrange(0, 16, 5), xrange(60, 70, 3),
+                                   xrange(0, 16, 5)):
+                chunk.set_block((x, y, z), x + z + 1)
+                chunk.set_metadata((x, y, z), (x + y) % 16)
+
+        cursor = self.w.cursor()
+        for coords in product(xrange(-16, 16), xrange(58, 72),
+                              xrange(-16, 16)):
+            self.assertEqual(cursor.sync_get_block(coords),
+                             self.w.sync_get_block(coords))
+            self.assertEqual(cursor.sync_get_metadata(coords),
+                             self.w.sync_get_metadata(coords))
+
+    @inlineCallbacks
+    def test_cursor_set_block(self):
+        chunk = yield self.w.request_chunk(-1, 0)
+        cursor = self.w.cursor()
+        cursor.sync_set_block((-1, 64, 3), 1)
+        cursor.sync_set_metadata((-1, 64, 3), 2)
+        self.assertEqual(chunk.get_block((15, 64, 3)), 1)
+        self.assertEqual(chunk.get_metadata((15, 64, 3)), 2)
+        self.assertEqual(cursor.sync_get_block((-1, 64, 3)), 1)
+        self.assertIs(cursor.sync_request_chunk((-1, 64, 3)), chunk)
+
+    @inlineCallbacks
+    def test_cursor_batch(self):
+        chunk = yield self.w.request_chunk(0, 0)
+        chunk.populated = True
+        with self.w.batch():
+            self.w.cursor().sync_set_block((8, 64, 8), 1)
+            self.assertFalse(chunk.is_damaged())
+        self.assertTrue(chunk.is_damaged())
+
+    @inlineCallbacks
+    def test_cursor_unloaded(self):
+        yield self.w.request_chunk(0, 0)
+        cursor = self.w.cursor()
+        cursor.sync_get_block((0, 0, 0))
+        self.assertRaises(ChunkNotLoaded, cursor.sync_get_block, (16, 0, 0))
+        self.assertRaises(ChunkNotLoaded, cursor.sync_set_block,
+                          (16, 0, 0), 1)
+        # The cursor still works after a miss.
+        self.assertEqual(cursor.sync_get_block((0, 0, 0)), 0)
+
+    @inlineCallbacks
+    def test_cursor_impossible(self):
+        yield self.w.request_chunk(0, 0)
+        cursor = self.w.cursor()
+        self.assertRaises(ImpossibleCoordinates, cursor.sync_get_block,
+                          (0, 256, 0))
+        self.assertRaises(ImpossibleCoordinates, cursor.sync_get_metadata,
+                          (0, -1, 0))
+
 
 class TestWorld(unittest.TestCase):
 
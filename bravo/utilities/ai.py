@@ -3,6 +3,7 @@ from math import sin, cos, floor, ceil
 from bravo.simplex import dot3
 
 def check_collision(vector, offsetlist, factory):
+    cursor = factory.world.cursor()
     cont = True
     for offset_x, offset_y, offset_z in offsetlist:
         calculated_x = vector[0] + offset_x
@@ -24,7 +25,8 @@ def check_collision(vector, offsetlist, factory):
         else:
             calculated_z = ceil(calculated_z)
 
-        b = factory.world.sync_get_block((calculated_x,calculated_y,calculated_z))
+        b = cursor.sync_get_block((int(calculated_x), int(calculated_y),
+                                   int(calculated_z)))
         if b == 0:
             continue
         else:
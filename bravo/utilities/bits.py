@@ -1,6 +1,12 @@
 from array import array
+from binascii import hexlify, unhexlify
 from itertools import izip_longest
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 def grouper(n, iterable, fillvalue=None):
     "grouper(3, 'ABCDEFG', 'x') --> ABC DEF Gxx"
     args = [iter(iterable)] * n
@@ -8,43 +14,211 @@ def grouper(n, iterable, fillvalue=None):
 
 """
 Bit-twiddling devices.
+
+The nibble functions here work on whole buffers at once. They use NumPy when
+it is available; otherwise, they are built from string translation, extended
+slicing, and hex conversion, all of which run in C, rather than a loop over
+every byte.
 """
 
+# Translation tables for the pure-Python nibble kernels.
+LOW_NIBBLES = "".join(chr(i & 0xf) for i in range(256))
+HIGH_NIBBLES = "".join(chr(i >> 4) for i in range(256))
+
 def unpack_nibbles(l):
     """
     Unpack bytes into pairs of nibbles.
 
     Nibbles are half-byte quantities. The nibbles unpacked by this function
-    are returned as unsigned numeric values.
+    are returned as unsigned numeric values, with the low nibble of each byte
+    first.
 
     >>> unpack_nibbles("a")
-    [6, 1]
+    array('B', [1, 6])
     >>> unpack_nibbles("nibbles")
-    [6, 14, 6, 9, 6, 2, 6, 2, 6, 12, 6, 5, 7, 3]
+    array('B', [14, 6, 9, 6, 2, 6, 2, 6, 12, 6, 5, 6, 3, 7])
 
-    :param list l: bytes
+    :param str l: bytes
 
-    :returns: list of nibbles
+    :returns: array of nibbles
     """
 
-    data = array("B")
-    for d in l:
-        i = ord(d)
-        data.append(i & 0xf)
-        data.append(i >> 4)
+    if numpy is not None:
+        packed = numpy.frombuffer(l, dtype=numpy.uint8)
+        unpacked = numpy.empty(len(packed) * 2, dtype=numpy.uint8)
+        unpacked[0::2] = packed & 0xf
+        unpacked[1::2] = packed >> 4
+        return array("B", unpacked.tostring())
+
+    data = array("B", "\x00") * (len(l) * 2)
+    data[0::2] = array("B", l.translate(LOW_NIBBLES))
+    data[1::2] = array("B", l.translate(HIGH_NIBBLES))
     return data
 
 def pack_nibbles(a):
     """
     Pack pairs of nibbles into bytes.
 
-    Bytes are returned as characters.
+    Bytes are returned as characters. Only the low four bits of each nibble
+    are used. If there are an odd number of nibbles, the last byte is padded
+    with a zero nibble.
 
     :param `array` a: nibbles to pack
 
     :returns: packed nibbles as a string of bytes
     """
 
-    packed = array("B",
-                   (((y & 0xf) << 4) | (x & 0xf) for x, y in grouper(2, a)))
-    return packed.tostring()
+    if not isinstance(a, array) or a.typecode != "B":
+        a = array("B", (i & 0xf for i in a))
+    if len(a) % 2:
+        a = a + array("B", [0])
+
+    if numpy is not None:
+        unpacked = numpy.frombuffer(a, dtype=numpy.uint8)
+        packed = (unpacked[0::2] & 0xf) | ((unpacked[1::2] & 0xf) << 4)
+        return packed.tostring()
+
+    # Hexlify the masked nibbles, which gives "0n" for every nibble, and keep
+    # the hex digits. Each pair of digits is then swapped, so that the high
+    # nibble comes first, and turned back into bytes.
+    digits = hexlify(a.tostring().translate(LOW_NIBBLES))[1::2]
+    swapped = bytearray(len(digits))
+    swapped[0::2] = digits[1::2]
+    swapped[1::2] = digits[0::2]
+    return unhexlify(str(swapped))
+
+class NibbleArray(object):
+    """
+    An array of nibbles, stored packed two to a byte.
+
+    The packing is the same as that of ``pack_nibbles()``: even indices live
+    in the low nibble of each byte, and odd indices live in the high nibble.
+    This is the packing used by both the Anvil format and the wire protocol,
+    so nibble arrays can be loaded, saved, and sent without being repacked.
+
+    Nibble arrays may be indexed and sliced like any other array. Single
+    indices are read and written in place; slices are unpacked and packed as
+    needed, and slices which line up with whole bytes touch only those bytes.
+    """
+
+    __slots__ = ("data",)
+
+    # Mutable, so not hashable.
+    __hash__ = None
+
+    def __init__(self, packed=""):
+        """
+        :param packed: packed nibbles, as a string or byte array; this is
+            always copied
+        """
+
+        self.data = array("B", packed)
+
+    @classmethod
+    def from_nibbles(cls, nibbles):
+        """
+        Make a nibble array from a sequence of unpacked nibbles.
+        """
+
+        return cls(pack_nibbles(nibbles))
+
+    @classmethod
+    def filled(cls, value, length):
+        """
+        Make a nibble array of a single value.
+
+        :param int length: the number of nibbles, which must be even
+        """
+
+        return cls(chr((value & 0xf) * 0x11) * (length // 2))
+
+    def __getstate__(self):
+        return self.data.tostring()
+
+    def __setstate__(self, state):
+        self.data = array("B", state)
+
+    def __len__(self):
+        return len(self.data) * 2
+
+    def __iter__(self):
+        return iter(self.unpack())
+
+    def __eq__(self, other):
+        if isinstance(other, NibbleArray):
+            return self.data == other.data
+        if not hasattr(other, "__len__"):
+            return NotImplemented
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "NibbleArray(%r)" % self.tostring()
+
+    def _byte_slice(self, s):
+        """
+        Get the byte bounds of a slice, if it covers only whole bytes.
+        """
+
+        start, stop, step = s.indices(len(self))
+        if step == 1 and not start & 1 and not stop & 1 and start <= stop:
+            return start >> 1, stop >> 1
+        return None
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            bounds = self._byte_slice(i)
+            if bounds is not None:
+                start, stop = bounds
+                return unpack_nibbles(self.data[start:stop].tostring())
+            return array("B", [self[j] for j in xrange(*i.indices(len(self)))])
+
+        b = self.data[i >> 1]
+        return b >> 4 if i & 1 else b & 0xf
+
+    def __setitem__(self, i, value):
+        if isinstance(i, slice):
+            bounds = self._byte_slice(i)
+            indices = xrange(*i.indices(len(self)))
+            if len(value) != len(indices):
+                raise ValueError("Can't resize a nibble array")
+            if bounds is not None:
+                start, stop = bounds
+                self.data[start:stop] = array("B", pack_nibbles(value))
+            else:
+                for j, v in zip(indices, value):
+                    self[j] = v
+            return
+
+        j = i >> 1
+        b = self.data[j]
+        if i & 1:
+            self.data[j] = (b & 0xf) | ((value & 0xf) << 4)
+        else:
+            self.data[j] = (b & 0xf0) | (value & 0xf)
+
+    def copy(self):
+        return NibbleArray(self.data)
+
+    def count(self, value):
+        """
+        Count the nibbles of a given value.
+        """
+
+        return self.unpack().count(value)
+
+    def unpack(self):
+        """
+        Unpack this array into an array of one nibble per byte.
+        """
+
+        return unpack_nibbles(self.data.tostring())
+
+    def tostring(self):
+        """
+        Get the packed nibbles as a string of bytes.
+        """
+
+        return self.data.tostring()
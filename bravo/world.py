@@ -1,14 +1,16 @@
-from array import array
+from contextlib import contextmanager
 from functools import wraps
 from itertools import imap, product
 import random
 import sys
+from time import time
 
 from twisted.internet import reactor
-from twisted.internet.defer import (inlineCallbacks, maybeDeferred,
-                                    returnValue, succeed)
+from twisted.internet.defer import (Deferred, DeferredList, inlineCallbacks,
+                                    maybeDeferred, returnValue, succeed)
 from twisted.internet.task import LoopingCall, coiterate
 from twisted.python import log
+from twisted.python.failure import Failure
 
 from bravo.beta.structures import Level
 from bravo.chunk import Chunk, CHUNK_HEIGHT
@@ -21,51 +23,609 @@ from bravo.utilities.coords import split_coords
 from bravo.utilities.temporal import PendingEvent
 from bravo.mobmanager import MobManager
 
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
+
 
 class ChunkCache(object):
     """
     A cache which holds references to all chunks which should be held in
     memory.
 
-    This cache remembers chunks that were recently used, that are in permanent
-    residency, and so forth. Its exact caching algorithm is currently null.
+    Chunks are held in one of three tiers. Pinned chunks are in permanent
+    residency. Dirty chunks are held until they have been written out, and
+    are then moved to the clean tier. Clean chunks are kept for as long as
+    there is room for them; once there are too many, the least recently used
+    clean chunks are evicted. Chunks which are still in use count against
+    the size of the clean tier, but are never evicted.
+
+    Chunks are in use while they have tickets. Anything which needs a chunk to
+    stay in memory, like a player who can see it, should acquire a ticket for
+    it, and release the ticket when it's done with the chunk.
 
     When chunks dirty themselves, they are expected to notify the cache, which
     will then schedule an eviction for the chunk.
+
+    :ivar int hits: the number of lookups which found a chunk
+    :ivar int misses: the number of lookups which didn't find a chunk
+    :ivar int evictions: the number of clean chunks evicted to make room
+    """
+
+    clock = reactor
+    """
+    The clock used to note when chunks become dirty.
     """
 
-    def __init__(self):
+    def __init__(self, limit=256):
+        """
+        :param int limit: the maximum number of clean chunks to keep; chunks
+            which are in use count towards it, but are never evicted
+        """
+
+        self.limit = limit
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
         self._perm = {}
-        self._dirty = {}
+        self._dirty = OrderedDict()
+        self._dirty_since = {}
+        self._clean = OrderedDict()
+        self._tickets = {}
+
+    def __len__(self):
+        dirty = sum(1 for key in self._dirty if key not in self._perm)
+        return len(self._perm) + dirty + len(self._clean)
+
+    def acquire(self, coords):
+        """
+        Take a ticket for a chunk.
+        """
+
+        self._tickets[coords] = self._tickets.get(coords, 0) + 1
+
+    def release(self, coords):
+        """
+        Give back a ticket for a chunk.
+
+        :returns: whether that was the last ticket for the chunk
+        """
+
+        count = self._tickets.get(coords, 0) - 1
+        if count > 0:
+            self._tickets[coords] = count
+            return False
+
+        self._tickets.pop(coords, None)
+        return True
+
+    def in_use(self, coords):
+        """
+        Whether a chunk has any tickets.
+        """
+
+        return coords in self._tickets
 
     def pin(self, chunk):
-        self._perm[chunk.x, chunk.z] = chunk
+        key = chunk.x, chunk.z
+        self._clean.pop(key, None)
+        self._perm[key] = chunk
 
     def unpin(self, chunk):
         del self._perm[chunk.x, chunk.z]
+        if (chunk.x, chunk.z) not in self._dirty:
+            self.put(chunk)
 
     def put(self, chunk):
-        # XXX expand caching strategy
-        pass
+        """
+        Keep a clean chunk in the cache.
+        """
+
+        key = chunk.x, chunk.z
+        if key in self._perm or key in self._dirty:
+            return
+
+        self._clean.pop(key, None)
+        self._clean[key] = chunk
+        self._evict()
+
+    def peek(self, coords):
+        """
+        Get a chunk without counting the lookup or refreshing the chunk.
+
+        This is for looking around at neighboring chunks, which shouldn't keep
+        chunks alive.
+        """
 
-    def get(self, coords):
         if coords in self._perm:
             return self._perm[coords]
+        if coords in self._dirty:
+            return self._dirty[coords]
         # Returns None if not found!
-        return self._dirty.get(coords)
+        return self._clean.get(coords)
+
+    def get(self, coords):
+        if coords in self._clean:
+            # Refresh it, at the most recently used end.
+            chunk = self._clean.pop(coords)
+            self._clean[coords] = chunk
+        else:
+            chunk = self.peek(coords)
+
+        if chunk is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        # Returns None if not found!
+        return chunk
+
+    def discard(self, chunk):
+        """
+        Drop a clean chunk from the cache.
+        """
+
+        self._clean.pop((chunk.x, chunk.z), None)
+
+    def pinned(self, coords):
+        """
+        Whether a chunk is in permanent residency.
+        """
+
+        return coords in self._perm
 
     def cleaned(self, chunk):
-        del self._dirty[chunk.x, chunk.z]
+        # The chunk might have been cleaned already, if it was written out
+        # twice at once.
+        self._dirty.pop((chunk.x, chunk.z), None)
+        self._dirty_since.pop((chunk.x, chunk.z), None)
+        if (chunk.x, chunk.z) not in self._perm:
+            self.put(chunk)
 
     def dirtied(self, chunk):
-        self._dirty[chunk.x, chunk.z] = chunk
+        key = chunk.x, chunk.z
+        self._clean.pop(key, None)
+        # Chunks which are already dirty keep their place in line.
+        if key not in self._dirty:
+            self._dirty[key] = chunk
+            self._dirty_since[key] = self.clock.seconds()
+
+    def dirty_count(self):
+        """
+        The number of dirty chunks.
+        """
+
+        return len(self._dirty)
+
+    def dirty_since(self, coords):
+        """
+        When a dirty chunk first became dirty, or None if it isn't dirty.
+        """
+
+        return self._dirty_since.get(coords)
 
     def iterperm(self):
         return self._perm.itervalues()
 
     def iterdirty(self):
+        """
+        Iterate over the dirty chunks, from the one which has been dirty the
+        longest onwards.
+        """
+
         return self._dirty.itervalues()
 
+    def _evict(self):
+        if len(self._clean) <= self.limit:
+            return
+
+        # Oldest first, skipping anything which is still in use.
+        idle = [key for key in self._clean if key not in self._tickets]
+
+        for key in idle[:len(self._clean) - self.limit]:
+            del self._clean[key]
+            self.evictions += 1
+
+
+class ChunkFlusher(object):
+    """
+    A write-behind flusher for dirty chunks.
+
+    Every interval, the flusher writes out the chunks which have been dirty
+    the longest, up to a budget of chunks and of bytes. Chunks which are
+    dirtied again before they are written out keep their place in line and
+    are only written once, so busy chunks don't crowd out everything else.
+
+    Since the budget is fixed, the time needed to write out the backlog can
+    be estimated, which is useful for knowing how long shutting down or
+    turning saving off for a backup will take.
+
+    :ivar int flushed: the number of chunks written out
+    :ivar float latency: the total time, in seconds, that written chunks
+        spent dirty
+    :ivar float max_latency: the longest time that a written chunk spent
+        dirty
+    """
+
+    section_size = 10240
+    """
+    The estimated size, in bytes, of a section which has blocks, for
+    budgeting writes.
+    """
+
+    def __init__(self, world, chunks=4, size=512 * 1024, interval=1):
+        """
+        :param `World` world: the world to write chunks for
+        :param int chunks: how many chunks to write out per interval
+        :param int size: about how many bytes to write out per interval;
+            at least one chunk is written each interval regardless
+        :param int interval: how often to write out chunks, in seconds
+        """
+
+        self.world = world
+        self.chunks = chunks
+        self.size = size
+        self.interval = interval
+
+        self.flushed = 0
+        self.latency = 0.0
+        self.max_latency = 0.0
+
+        self._flushing = set()
+        self._loop = LoopingCall(self.flush)
+        self._loop.clock = world.clock
+
+    @property
+    def backlog(self):
+        """
+        The number of chunks waiting to be written out.
+        """
+
+        cache = self.world._cache
+        return cache.dirty_count() if cache is not None else 0
+
+    @property
+    def average_latency(self):
+        """
+        The average time, in seconds, that written chunks spent dirty.
+        """
+
+        return self.latency / self.flushed if self.flushed else 0.0
+
+    def estimate(self):
+        """
+        Estimate how long it will take to write out the backlog, in seconds.
+
+        This only accounts for the chunk budget, not the byte budget.
+        """
+
+        if not self.chunks:
+            return 0
+        intervals = -(-self.backlog // self.chunks)
+        return intervals * self.interval
+
+    def chunk_size(self, chunk):
+        """
+        Estimate how many bytes writing out a chunk will take.
+        """
+
+        return 256 + self.section_size * sum(1 for s in chunk.sections if s)
+
+    def start(self):
+        if not self._loop.running:
+            self._loop.start(self.interval, now=False)
+
+    def stop(self):
+        if self._loop.running:
+            self._loop.stop()
+
+    def flush(self):
+        """
+        Write out the oldest dirty chunks, within the budget.
+
+        :returns: a ``Deferred`` which fires when the chunks are written
+        """
+
+        cache = self.world._cache
+        if cache is None or not self.world.saving:
+            return succeed(None)
+
+        # Pick the chunks first, since writing them out changes the cache.
+        picked = []
+        budget = self.size
+        for chunk in cache.iterdirty():
+            if len(picked) >= self.chunks:
+                break
+            key = chunk.x, chunk.z
+            if key in self._flushing:
+                continue
+            size = self.chunk_size(chunk)
+            if picked and size > budget:
+                break
+            budget -= size
+            picked.append(chunk)
+
+        return DeferredList([self._flush(chunk) for chunk in picked])
+
+    def _flush(self, chunk):
+        key = chunk.x, chunk.z
+        cache = self.world._cache
+        since = cache.dirty_since(key)
+        self._flushing.add(key)
+
+        d = self.world.save_chunk(chunk)
+
+        @d.addBoth
+        def cb(result):
+            self._flushing.discard(key)
+            cache = self.world._cache
+            if cache is None or chunk.dirty:
+                return result
+
+            if since is not None:
+                latency = self.world.clock.seconds() - since
+                self.latency += latency
+                self.max_latency = max(self.max_latency, latency)
+            self.flushed += 1
+            cache.cleaned(chunk)
+            return result
+
+        return d
+
+
+class Compactor(object):
+    """
+    A background task which reclaims wasted space in the world's files.
+
+    Every interval, the compactor asks the serializer to compact a little of
+    the world, and waits for that to finish before asking again, so that
+    compaction never takes more than its share of the disk.
+
+    :ivar int compactions: the number of times the serializer was asked to
+        compact
+    :ivar int reclaimed: the number of bytes reclaimed
+    """
+
+    def __init__(self, world, interval=60):
+        """
+        :param `World` world: the world to compact
+        :param int interval: how often to compact, in seconds
+        """
+
+        self.world = world
+        self.interval = interval
+
+        self.compactions = 0
+        self.reclaimed = 0
+
+        self._loop = LoopingCall(self.compact)
+        self._loop.clock = world.clock
+
+    def start(self):
+        if self.interval and not self._loop.running:
+            self._loop.start(self.interval, now=False)
+
+    def stop(self):
+        if self._loop.running:
+            self._loop.stop()
+
+    def compact(self):
+        """
+        Compact a little of the world.
+
+        :returns: a ``Deferred`` which fires when the serializer is done
+        """
+
+        if not self.world.saving:
+            return succeed(None)
+
+        self.compactions += 1
+        d = maybeDeferred(self.world.serializer.compact)
+
+        @d.addCallback
+        def cb(reclaimed):
+            if reclaimed:
+                self.reclaimed += reclaimed
+                log.msg("Compacted world, reclaiming %d KiB" %
+                        (reclaimed // 1024))
+
+        # Keep compacting later, even if this went wrong.
+        d.addErrback(log.err, "Couldn't compact world")
+
+        return d
+
+
+class ChunkScheduler(object):
+    """
+    A scheduler for chunk requests.
+
+    Everybody who wants a chunk asks for it with a priority; lower numbers
+    are more urgent. Each chunk is only requested once, no matter how many
+    people are waiting on it, and its priority is that of the most urgent of
+    them. Chunks are requested most urgent first, a few at a time, so that
+    the chunks right around a player aren't stuck behind chunks at the edge
+    of somebody else's view.
+
+    Requests can be cancelled. Chunks which nobody is waiting on anymore are
+    never requested.
+
+    Since loading and generating chunks can be expensive, each round of
+    requests is held to a budget: only so many chunks may be outstanding at
+    once, and no more chunks are started once a round has run for long
+    enough.
+
+    :ivar int scheduled: the number of requests made
+    :ivar int deduplicated: the number of requests for chunks which were
+        already requested
+    :ivar int cancelled: the number of requests cancelled
+    """
+
+    def __init__(self, world, concurrency=4, budget=0.01, interval=0.05):
+        """
+        :param `World` world: the world to request chunks from
+        :param int concurrency: the most chunks to have outstanding at once
+        :param float budget: how long, in seconds, to spend starting
+            requests in each round
+        :param float interval: how long, in seconds, to wait between rounds
+            while requests are waiting
+        """
+
+        self.world = world
+        self.concurrency = concurrency
+        self.budget = budget
+        self.interval = interval
+
+        self.scheduled = 0
+        self.deduplicated = 0
+        self.cancelled = 0
+
+        self._waiting = {}
+        self._keys = {}
+        self._running = {}
+        self._call = None
+
+    @property
+    def queued(self):
+        """
+        The number of chunks waiting to be requested.
+        """
+
+        return len([key for key in self._waiting
+                    if key not in self._running])
+
+    @property
+    def running(self):
+        """
+        The number of chunks which have been requested, but haven't shown up
+        yet.
+        """
+
+        return len(self._running)
+
+    def schedule(self, x, z, priority=0):
+        """
+        Ask for a chunk.
+
+        :param int x: X coordinate in chunk coords
+        :param int z: Z coordinate in chunk coords
+        :param priority: how urgently the chunk is needed; lower is sooner
+        :returns: a ``Deferred`` which fires with the chunk; cancel it to
+            stop waiting
+        """
+
+        key = x, z
+        d = Deferred(self._cancel)
+
+        waiters = self._waiting.setdefault(key, {})
+        if waiters:
+            self.deduplicated += 1
+        waiters[d] = priority
+        self._keys[d] = key
+        self.scheduled += 1
+
+        self._wake()
+        return d
+
+    def prioritize(self, d, priority):
+        """
+        Change the priority of a request.
+
+        :param d: a ``Deferred`` from ``schedule()``
+        """
+
+        key = self._keys.get(d)
+        if key is not None:
+            self._waiting[key][d] = priority
+
+    def priority_of(self, x, z):
+        """
+        The priority of a chunk, or None if nobody is waiting on it.
+        """
+
+        waiters = self._waiting.get((x, z))
+        return min(waiters.itervalues()) if waiters else None
+
+    def requested(self, x, z):
+        """
+        Whether a chunk has been requested from the world, and hasn't shown
+        up yet.
+        """
+
+        return (x, z) in self._running
+
+    def stop(self):
+        """
+        Stop requesting chunks, and cancel every request.
+        """
+
+        if self._call is not None and self._call.active():
+            self._call.cancel()
+        self._call = None
+
+        for d in self._keys.keys():
+            d.cancel()
+
+    def tick(self):
+        """
+        Run a round of requests.
+        """
+
+        self._call = None
+
+        queued = [key for key in self._waiting if key not in self._running]
+        queued.sort(key=lambda key: self.priority_of(*key))
+
+        before = time()
+        for key in queued:
+            if len(self._running) >= self.concurrency:
+                break
+            if time() - before > self.budget:
+                break
+            # Earlier requests might have fired and cancelled waiters.
+            if key in self._waiting:
+                self._start(key)
+
+        self._wake()
+
+    def _wake(self):
+        if self._call is not None or len(self._running) >= self.concurrency:
+            return
+
+        if any(key not in self._running for key in self._waiting):
+            # Go right away if there's nothing going on, and take a break
+            # between rounds otherwise, to let everything else happen too.
+            delay = self.interval if self._running else 0
+            self._call = self.world.clock.callLater(delay, self.tick)
+
+    def _start(self, key):
+        d = self.world.request_chunk(*key)
+        self._running[key] = d
+        d.addBoth(self._finished, key)
+
+    def _finished(self, result, key):
+        del self._running[key]
+
+        waiters = self._waiting.pop(key, {})
+        for d in waiters:
+            del self._keys[d]
+            if isinstance(result, Failure):
+                d.errback(result)
+            else:
+                d.callback(result)
+
+        self._wake()
+
+    def _cancel(self, d):
+        key = self._keys.pop(d)
+        waiters = self._waiting[key]
+        del waiters[d]
+        if not waiters:
+            del self._waiting[key]
+        self.cancelled += 1
+
 
 class ImpossibleCoordinates(Exception):
     """
@@ -99,6 +659,50 @@ def coords_to_chunk(f):
     return decorated
 
 
+def group_by_chunk(coords):
+    """
+    Sort world coordinates by the chunks which hold them.
+
+    :param coords: an iterable of world coordinates
+    :returns: an ``OrderedDict`` of chunk coordinates to lists of pairs of the
+        position of each coordinate in ``coords`` and its chunk-local
+        coordinates, in the order that the chunks were first seen
+    :raises ImpossibleCoordinates: if any Y value is impossible
+    """
+
+    groups = OrderedDict()
+
+    for i, (x, y, z) in enumerate(coords):
+        if not 0 <= y < CHUNK_HEIGHT:
+            raise ImpossibleCoordinates("Y value %d is impossible" % y)
+
+        bigx, smallx, bigz, smallz = split_coords(int(x), int(z))
+        groups.setdefault((bigx, bigz), []).append((i, (smallx, int(y),
+                                                        smallz)))
+
+    return groups
+
+
+def spread(values, count):
+    """
+    Make a list of values, one for each of a number of coordinates.
+
+    :param values: either a sequence of values, or a single value for
+        everything
+    :param int count: how many values are needed
+    :raises ValueError: if there are the wrong number of values
+    """
+
+    if isinstance(values, (int, long)):
+        return [values] * count
+
+    values = list(values)
+    if len(values) != count:
+        raise ValueError("Got %d values for %d coordinates"
+                         % (len(values), count))
+    return values
+
+
 def sync_coords_to_chunk(f):
     """
     Either get a chunk for the coordinates, or raise an exception.
@@ -125,6 +729,139 @@ def sync_coords_to_chunk(f):
     return decorated
 
 
+class BlockCursor(object):
+    """
+    A quick way to look at lots of blocks which are near each other.
+
+    Every ``sync_*`` call on a world has to find its chunk in the cache all
+    over again. A cursor remembers the chunk and section which it last looked
+    at, so that looking at the next block over, which is what automatons and
+    collision checks spend their time doing, usually skips straight to the
+    section.
+
+    Cursors have the same ``sync_*`` methods as worlds, and raise the same
+    exceptions, so they can stand in for a world anywhere only those methods
+    are used.
+
+    A cursor hangs onto the chunk which it last looked at, so it must not be
+    kept past the current reactor turn, since chunks may be unloaded in the
+    meantime. Get a new one from ``World.cursor()`` each time.
+    """
+
+    def __init__(self, world):
+        self.world = world
+
+        self._x = None
+        self._z = None
+        self._index = None
+        self._chunk = None
+        self._section = None
+
+    def _seek(self, x, y, z):
+        """
+        Move to the chunk and section holding a block.
+        """
+
+        if not 0 <= y < CHUNK_HEIGHT:
+            raise ImpossibleCoordinates("Y value %d is impossible" % y)
+
+        bigx, bigz = x >> 4, z >> 4
+        if bigx != self._x or bigz != self._z:
+            chunk = self.world._cache.get((bigx, bigz))
+            if chunk is None:
+                raise ChunkNotLoaded("Chunk (%d, %d) isn't loaded"
+                                     % (bigx, bigz))
+            self._x, self._z, self._chunk = bigx, bigz, chunk
+
+        self._index = y >> 4
+        self._section = self._chunk.sections[self._index]
+
+    def _chunk_at(self, x, y, z):
+        if x >> 4 != self._x or z >> 4 != self._z or y >> 4 != self._index:
+            self._seek(x, y, z)
+        return self._chunk
+
+    def sync_get_block(self, coords):
+        """
+        Get a block.
+
+        :returns: the requested block
+        """
+
+        x, y, z = coords
+        if x >> 4 != self._x or z >> 4 != self._z or y >> 4 != self._index:
+            self._seek(x, y, z)
+        return self._section.get_block((x & 0xf, y & 0xf, z & 0xf))
+
+    def sync_set_block(self, coords, value):
+        """
+        Set a block.
+
+        :returns: None
+        """
+
+        x, y, z = coords
+        chunk = self._chunk_at(x, y, z)
+        self.world._enlist(chunk)
+        chunk.set_block((x & 0xf, y, z & 0xf), value)
+
+    def sync_get_metadata(self, coords):
+        """
+        Get a block's metadata.
+
+        :returns: the requested metadata
+        """
+
+        x, y, z = coords
+        if x >> 4 != self._x or z >> 4 != self._z or y >> 4 != self._index:
+            self._seek(x, y, z)
+        return self._section.get_metadata((x & 0xf, y & 0xf, z & 0xf))
+
+    def sync_set_metadata(self, coords, value):
+        """
+        Set a block's metadata.
+
+        :returns: None
+        """
+
+        x, y, z = coords
+        chunk = self._chunk_at(x, y, z)
+        self.world._enlist(chunk)
+        chunk.set_metadata((x & 0xf, y, z & 0xf), value)
+
+    def sync_destroy(self, coords):
+        """
+        Destroy a block.
+
+        :returns: None
+        """
+
+        x, y, z = coords
+        chunk = self._chunk_at(x, y, z)
+        self.world._enlist(chunk)
+        chunk.destroy((x & 0xf, y, z & 0xf))
+
+    def sync_mark_dirty(self, coords):
+        """
+        Mark a block's chunk dirty.
+
+        :returns: None
+        """
+
+        x, y, z = coords
+        self._chunk_at(x, y, z).dirty = True
+
+    def sync_request_chunk(self, coords):
+        """
+        Get the chunk holding a block.
+
+        :returns: the requested ``Chunk``
+        """
+
+        x, y, z = coords
+        return self._chunk_at(x, y, z)
+
+
 class World(object):
     """
     Object representing a world on disk.
@@ -156,6 +893,16 @@ class World(object):
     Whether this world is using multiprocessing methods to generate geometry.
     """
 
+    _generator = None
+    """
+    The pool of processes generating chunks, if there is one.
+    """
+
+    scheduler = None
+    """
+    The scheduler for chunk requests, once the world has started.
+    """
+
     dimension = "earth"
     """
     The world dimension. Valid values are earth, sky, and nether.
@@ -171,6 +918,22 @@ class World(object):
     The chunk cache.
     """
 
+    _batches = 0
+    """
+    How deeply nested the batch in progress is, or zero if there isn't one.
+    """
+
+    clock = reactor
+    """
+    The clock used to schedule unloading and writing out chunks.
+    """
+
+    unload_grace = 30
+    """
+    How long, in seconds, chunks stay in memory after their last ticket is
+    released.
+    """
+
     def __init__(self, config, name):
         """
         :Parameters:
@@ -182,6 +945,8 @@ class World(object):
         self.config_name = "world %s" % name
 
         self._pending_chunks = dict()
+        self._batched = set()
+        self._unloads = dict()
 
     @property
     def season(self):
@@ -229,7 +994,12 @@ class World(object):
         self.connect()
 
         # Create our cache.
-        self._cache = ChunkCache()
+        limit = self.config.getintdefault(self.config_name, "chunk_cache",
+                                          256)
+        self._cache = ChunkCache(limit)
+        self._cache.clock = self.clock
+        self.unload_grace = self.config.getintdefault(self.config_name,
+            "unload_grace", self.unload_grace)
 
         # Pick a random number for the seed. Use the configured value if one
         # is present.
@@ -238,18 +1008,25 @@ class World(object):
 
         self.level = self.level._replace(seed=seed)
 
-        # Check if we should offload chunk requests to ampoule.
-        if self.config.getbooleandefault("bravo", "ampoule", False):
+        # How much it costs to resend a chunk, for deciding when damage
+        # should be sent as a whole chunk.
+        self.resend_cost = self.config.getintdefault(self.config_name,
+            "resend_cost", Chunk.resend_cost)
+
+        # Check if we should generate chunks in other processes.
+        workers = self.config.getintdefault(self.config_name, "workers", 0)
+        if workers > 0:
             try:
-                import ampoule
-                if ampoule:
-                    self.async = True
-            except ImportError:
-                pass
+                from bravo.remote import GenerationPool
+                self._generator = GenerationPool(workers)
+                self.async = True
+            except (ImportError, OSError), e:
+                log.msg("Couldn't start chunk generation workers: %s" % e)
 
         log.msg("World is %s" %
                 ("read-write" if self.saving else "read-only"))
-        log.msg("Using Ampoule: %s" % self.async)
+        if self.async:
+            log.msg("Generating chunks in %d processes" % workers)
 
         # First, try loading the level, to see if there's any data out there
         # which we can use. If not, don't worry about it.
@@ -276,8 +1053,29 @@ class World(object):
             cache_level = self.config.getint(self.config_name, "perm_cache")
             self.enable_cache(cache_level)
 
-        self.chunk_management_loop = LoopingCall(self.flush_chunk)
-        self.chunk_management_loop.start(1)
+        # Start writing out dirty chunks in the background.
+        chunks = self.config.getintdefault(self.config_name, "flush_chunks",
+                                           4)
+        size = self.config.getintdefault(self.config_name, "flush_size", 512)
+        interval = self.config.getintdefault(self.config_name,
+                                             "flush_interval", 1)
+        self.flusher = ChunkFlusher(self, chunks, size * 1024, interval)
+        if self.saving:
+            self.flusher.start()
+
+        # Reclaim the space which chunks leave behind as they're rewritten.
+        interval = self.config.getintdefault(self.config_name,
+                                             "compact_interval", 60)
+        self.compactor = Compactor(self, interval)
+        if self.saving:
+            self.compactor.start()
+
+        # Schedule chunk requests, so that the most urgent ones go first.
+        concurrency = self.config.getintdefault(self.config_name,
+                                                "request_concurrency", 4)
+        budget = self.config.getintdefault(self.config_name,
+                                           "request_budget", 10)
+        self.scheduler = ChunkScheduler(self, concurrency, budget / 1000.0)
 
         # XXX Put this in init or here?
         self.mob_manager = MobManager()
@@ -298,10 +1096,24 @@ class World(object):
         :returns: A ``Deferred`` that fires after the world has stopped.
         """
 
-        self.chunk_management_loop.stop()
+        self.flusher.stop()
+        self.compactor.stop()
+        self.scheduler.stop()
+
+        if self._generator is not None:
+            self._generator.stop()
+            self._generator = None
+            self.async = False
+
+        # Everything is about to be written out anyway.
+        for call in self._unloads.itervalues():
+            if call.active():
+                call.cancel()
+        self._unloads.clear()
 
-        # Flush all dirty chunks to disk. Don't bother cleaning them off.
-        for chunk in self._cache.iterdirty():
+        # Flush all dirty chunks to disk, oldest first. Don't bother cleaning
+        # them off.
+        for chunk in list(self._cache.iterdirty()):
             yield self.save_chunk(chunk)
 
         # Destroy the cache.
@@ -310,6 +1122,9 @@ class World(object):
         # Save the level data.
         yield maybeDeferred(self.serializer.save_level, self.level)
 
+        # And let the serializer finish up and close its files.
+        yield maybeDeferred(self.serializer.close)
+
     def enable_cache(self, size):
         """
         Set the permanent cache size.
@@ -350,19 +1165,121 @@ class World(object):
 
         return d
 
-    def flush_chunk(self):
+    def schedule_chunk(self, x, z, priority=0):
+        """
+        Ask for a chunk, through the scheduler.
+
+        Unlike ``request_chunk()``, requests made this way are ordered by
+        priority against every other scheduled request, and can be cancelled
+        before the chunk is loaded or generated.
+
+        :param priority: how urgently the chunk is needed; lower is sooner
+        :returns: a ``Deferred`` which fires with the chunk
+        """
+
+        # Chunks which are already loaded don't need to wait their turn.
+        cached = self._cache.get((x, z))
+        if cached is not None:
+            return succeed(cached)
+
+        return self.scheduler.schedule(x, z, priority)
+
+    def acquire_chunk(self, x, z):
+        """
+        Take a ticket for a chunk, keeping it in memory once it is loaded.
+
+        Tickets don't load chunks; use ``request_chunk()`` for that. Every
+        ticket must eventually be given back with ``release_chunk()``.
+        """
+
+        key = x, z
+        self._cache.acquire(key)
+
+        call = self._unloads.pop(key, None)
+        if call is not None and call.active():
+            call.cancel()
+
+    def release_chunk(self, x, z):
+        """
+        Give back a ticket for a chunk.
+
+        Once a chunk's last ticket is given back, the chunk is written out and
+        dropped from memory after a grace period, unless somebody takes a new
+        ticket for it in the meantime. Chunks which are still being generated
+        in other processes are cancelled instead, unless somebody is still
+        waiting for them.
+        """
+
+        key = x, z
+        if self._cache is None or not self._cache.release(key):
+            return
+
+        # If the chunk is still being generated, and nobody is waiting for
+        # it, then nobody wants it anymore.
+        if (key in self._pending_chunks and self._generator is not None and
+            not self._awaited(key)):
+            self._generator.cancel(x, z)
+            return
+
+        if key not in self._unloads:
+            self._unloads[key] = self.clock.callLater(self.unload_grace,
+                                                      self.unload_chunk, x, z)
+
+    def _awaited(self, key):
         """
-        Flush a dirty chunk.
+        Whether anybody is waiting for a pending chunk.
+        """
+
+        waiting = len(self._pending_chunks[key].listeners)
+
+        scheduler = self.scheduler
+        if scheduler is not None and scheduler.requested(*key):
+            if scheduler.priority_of(*key) is not None:
+                return True
+            # The scheduler's own request doesn't count once everybody has
+            # stopped waiting on the scheduler.
+            waiting -= 1
+
+        return waiting > 0
+
+    def unload_chunk(self, x, z):
+        """
+        Write out a chunk and drop it from memory.
+
+        Chunks which are in use or pinned are left alone, as are dirty chunks
+        while saving is off, since they couldn't be written out.
 
-        This method will always block when there are dirty chunks.
+        :returns: a ``Deferred`` which fires when the chunk has been unloaded
         """
 
-        for chunk in self._cache.iterdirty():
-            # Save a single chunk, and add a callback to remove it from the
-            # cache when it's been cleaned.
-            d = self.save_chunk(chunk)
-            d.addCallback(self._cache.cleaned)
-            break
+        key = x, z
+        self._unloads.pop(key, None)
+
+        chunk = self._cache.peek(key) if self._cache else None
+        if (chunk is None or self._cache.in_use(key) or
+            self._cache.pinned(key)):
+            return succeed(None)
+
+        if not chunk.dirty:
+            self._cache.discard(chunk)
+            return succeed(None)
+
+        if not self.saving:
+            return succeed(None)
+
+        d = self.save_chunk(chunk)
+
+        @d.addCallback
+        def cb(chunk):
+            # Somebody might have wanted the chunk again while it was being
+            # written out, or changed it again.
+            if chunk is None or chunk.dirty or self._cache is None:
+                return
+            self._cache.cleaned(chunk)
+            if not self._cache.in_use(key):
+                self._cache.discard(chunk)
+
+        return d
 
     def save_off(self):
         """
@@ -375,7 +1292,8 @@ class World(object):
         if not self.saving:
             return
 
-        self.chunk_management_loop.stop()
+        self.flusher.stop()
+        self.compactor.stop()
         self.saving = False
 
     def save_on(self):
@@ -386,8 +1304,9 @@ class World(object):
         if self.saving:
             return
 
-        self.chunk_management_loop.start(1)
         self.saving = True
+        self.flusher.start()
+        self.compactor.start()
 
     def postprocess_chunk(self, chunk):
         """
@@ -454,6 +1373,46 @@ class World(object):
             retval = yield self._pending_chunks[x, z].deferred()
             returnValue(retval)
 
+        # Nobody is making this chunk yet. Set up our event before starting,
+        # so that everybody who asks for the chunk while it is being loaded
+        # or generated waits on us, and the chunk is only made once. It has
+        # to be done early because PendingEvents only fire exactly once and
+        # it might fire immediately in certain cases.
+        pe = PendingEvent()
+        # This one is for our return value.
+        retval = pe.deferred()
+        self._pending_chunks[x, z] = pe
+
+        def forget(result):
+            if self._pending_chunks.get((x, z)) is pe:
+                del self._pending_chunks[x, z]
+            return result
+
+        d = self._make_chunk(x, z)
+        d.addBoth(forget)
+        d.chainDeferred(pe)
+
+        # Because multiple people might be attached to this event, we're
+        # going to do something magical here. We will yield a forked version
+        # of our Deferred. This means that we will wait right here, for a
+        # long, long time, before actually returning with the chunk, *but*,
+        # when we actually finish, we'll be ready to return the chunk
+        # immediately. Our caller cannot possibly care because they only see a
+        # Deferred either way.
+        chunk = yield retval
+
+        if self.factory:
+            self.factory.scan_chunk(chunk)
+
+        returnValue(chunk)
+
+    @inlineCallbacks
+    def _make_chunk(self, x, z):
+        """
+        Load a chunk, or generate it if it has never been generated, and put
+        it in the cache.
+        """
+
         # Create a new chunk object, since the cache turned up empty.
         try:
             chunk = yield maybeDeferred(self.serializer.load_chunk, x, z)
@@ -465,90 +1424,57 @@ class World(object):
         # Add in our magic dirtiness hook so that the cache can be aware of
         # chunks who have been...naughty.
         chunk.dirtied = self._cache.dirtied
-        if chunk.dirty:
-            # The chunk was already dirty!? Oh, naughty indeed!
-            self._cache.dirtied(chunk)
+        # And let the chunk find its neighbors, so that light can cross
+        # between chunks.
+        chunk.lookup = self._cache.peek
+        chunk.resend_cost = self.resend_cost
 
         if chunk.populated:
+            if chunk.dirty:
+                # The chunk was already dirty!? Oh, naughty indeed!
+                self._cache.dirtied(chunk)
             self._cache.put(chunk)
             self.postprocess_chunk(chunk)
-            if self.factory:
-                self.factory.scan_chunk(chunk)
             returnValue(chunk)
 
+        # Unpopulated chunks stay out of the cache until they're filled, so
+        # that a generation which fails or is cancelled doesn't leave an
+        # empty chunk behind.
         if self.async:
-            from ampoule import deferToAMPProcess
-            from bravo.remote import MakeChunk
+            from bravo.remote import fill_chunk
 
             generators = [plugin.name for plugin in self.pipeline]
 
-            d = deferToAMPProcess(MakeChunk, x=x, z=z, seed=self.level.seed,
-                                  generators=generators)
-
-            # Get chunk data into our chunk object.
-            def fill_chunk(kwargs):
-                chunk.blocks = array("B")
-                chunk.blocks.fromstring(kwargs["blocks"])
-                chunk.heightmap = array("B")
-                chunk.heightmap.fromstring(kwargs["heightmap"])
-                chunk.metadata = array("B")
-                chunk.metadata.fromstring(kwargs["metadata"])
-                chunk.skylight = array("B")
-                chunk.skylight.fromstring(kwargs["skylight"])
-                chunk.blocklight = array("B")
-                chunk.blocklight.fromstring(kwargs["blocklight"])
-                return chunk
-            d.addCallback(fill_chunk)
+            packed = yield self._generator.generate(x, z, self.level.seed,
+                                                    generators)
+
+            # Get chunk data into our chunk object. It was lit without its
+            # neighbors, so let light across its borders now.
+            fill_chunk(chunk, packed)
+            chunk.relight_borders()
         else:
             # Populate the chunk the slow way. :c
             for stage in self.pipeline:
                 stage.populate(chunk, self.level.seed)
 
             chunk.regenerate()
-            d = succeed(chunk)
-
-        # Set up our event and generate our return-value Deferred. It has to
-        # be done early becaues PendingEvents only fire exactly once and it
-        # might fire immediately in certain cases.
-        pe = PendingEvent()
-        # This one is for our return value.
-        retval = pe.deferred()
-        # This one is for scanning the chunk for automatons.
-        if self.factory:
-            pe.deferred().addCallback(self.factory.scan_chunk)
-        self._pending_chunks[x, z] = pe
-
-        def pp(chunk):
-            chunk.populated = True
-            chunk.dirty = True
 
-            self.postprocess_chunk(chunk)
-
-            self._cache.dirtied(chunk)
-            del self._pending_chunks[x, z]
+        chunk.populated = True
+        chunk.dirty = True
 
-            return chunk
+        self.postprocess_chunk(chunk)
 
-        # Set up callbacks.
-        d.addCallback(pp)
-        d.chainDeferred(pe)
+        self._cache.dirtied(chunk)
 
-        # Because multiple people might be attached to this callback, we're
-        # going to do something magical here. We will yield a forked version
-        # of our Deferred. This means that we will wait right here, for a
-        # long, long time, before actually returning with the chunk, *but*,
-        # when we actually finish, we'll be ready to return the chunk
-        # immediately. Our caller cannot possibly care because they only see a
-        # Deferred either way.
-        retval = yield retval
-        returnValue(retval)
+        returnValue(chunk)
 
     def save_chunk(self, chunk):
         """
         Write a chunk to the serializer.
 
         Note that this method does nothing when the given chunk is not dirty
-        or saving is off!
+        or saving is off! Chunks which change while they are being written
+        out stay dirty.
 
         :returns: A ``Deferred`` which will fire after the chunk has been
         saved with the chunk.
@@ -557,11 +1483,13 @@ class World(object):
         if not chunk.dirty or not self.saving:
             return succeed(chunk)
 
+        version = chunk.version
         d = maybeDeferred(self.serializer.save_chunk, chunk)
 
         @d.addCallback
         def cb(none):
-            chunk.dirty = False
+            if chunk.version == version:
+                chunk.dirty = False
             return chunk
 
         @d.addErrback
@@ -602,6 +1530,59 @@ class World(object):
         if self.saving:
             self.serializer.save_player(player)
 
+    # Batches of changes.
+
+    def begin(self):
+        """
+        Start a batch of changes.
+
+        Every chunk changed through the world's geometry methods during the
+        batch is put into a batch of its own, and they are all committed
+        together by ``commit()``. See ``Chunk.begin()``.
+        """
+
+        self._batches += 1
+
+    def commit(self):
+        """
+        Finish a batch of changes, and commit the batches of all of the chunks
+        which were changed.
+        """
+
+        if not self._batches:
+            return
+
+        self._batches -= 1
+        if self._batches:
+            return
+
+        batched, self._batched = self._batched, set()
+        for chunk in batched:
+            chunk.commit()
+
+    @contextmanager
+    def batch(self):
+        """
+        Make a batch of changes in a ``with`` block.
+
+        The batch is committed when the block is left, even if it raised.
+        """
+
+        self.begin()
+        try:
+            yield self
+        finally:
+            self.commit()
+
+    def _enlist(self, chunk):
+        """
+        Put a chunk into the batch in progress, if there is one.
+        """
+
+        if self._batches and chunk not in self._batched:
+            chunk.begin()
+            self._batched.add(chunk)
+
     # World-level geometry access.
     # These methods let external API users refrain from going through the
     # standard motions of looking up and loading chunk information.
@@ -624,6 +1605,7 @@ class World(object):
         :returns: a ``Deferred`` that will fire on completion
         """
 
+        self._enlist(chunk)
         chunk.set_block(coords, value)
 
     @coords_to_chunk
@@ -644,6 +1626,7 @@ class World(object):
         :returns: a ``Deferred`` that will fire on completion
         """
 
+        self._enlist(chunk)
         chunk.set_metadata(coords, value)
 
     @coords_to_chunk
@@ -654,6 +1637,7 @@ class World(object):
         :returns: a ``Deferred`` that will fire on completion
         """
 
+        self._enlist(chunk)
         chunk.destroy(coords)
 
     @coords_to_chunk
@@ -666,6 +1650,191 @@ class World(object):
 
         chunk.dirty = True
 
+    def cursor(self):
+        """
+        Get a ``BlockCursor`` for looking at lots of blocks at once.
+
+        :returns: a ``BlockCursor``, good until the next reactor turn
+        """
+
+        return BlockCursor(self)
+
+    # Bulk geometry access.
+    # Each of these takes lots of coordinates at once, and only looks up
+    # each chunk once, no matter how many of the coordinates are in it.
+
+    def _load_chunks(self, groups):
+        """
+        Request every chunk in a group.
+
+        :returns: a ``Deferred`` which fires with a dict of chunks
+        """
+
+        keys = list(groups)
+        dl = DeferredList([self.request_chunk(*key) for key in keys],
+                          fireOnOneErrback=True, consumeErrors=True)
+
+        @dl.addCallback
+        def cb(results):
+            return dict(zip(keys, (chunk for success, chunk in results)))
+
+        @dl.addErrback
+        def eb(failure):
+            # Hand back the chunk's own failure, not DeferredList's wrapper.
+            return failure.value.subFailure
+
+        return dl
+
+    def _loaded_chunks(self, groups):
+        """
+        Look up every chunk in a group.
+
+        :raises ChunkNotLoaded: if any of the chunks isn't loaded
+        """
+
+        chunks = {}
+        for key in groups:
+            chunk = self._cache.get(key)
+            if chunk is None:
+                raise ChunkNotLoaded("Chunk (%d, %d) isn't loaded" % key)
+            chunks[key] = chunk
+        return chunks
+
+    def _read_blocks(self, groups, chunks):
+        count = sum(len(members) for members in groups.itervalues())
+        results = [None] * count
+
+        for key, members in groups.iteritems():
+            chunk = chunks[key]
+            for i, coords in members:
+                results[i] = chunk.get_block(coords)
+
+        return results
+
+    def _write_blocks(self, groups, chunks, blocks, metadata):
+        # All of the changes go into one batch, so that every chunk only
+        # catches up on its lighting once.
+        with self.batch():
+            for key, members in groups.iteritems():
+                chunk = chunks[key]
+                self._enlist(chunk)
+                for i, coords in members:
+                    if blocks is None:
+                        chunk.destroy(coords)
+                        continue
+                    chunk.set_block(coords, blocks[i])
+                    if metadata is not None:
+                        chunk.set_metadata(coords, metadata[i])
+
+        return [chunks[key] for key in groups]
+
+    def get_blocks(self, coords):
+        """
+        Get lots of blocks from unknown chunks.
+
+        :param coords: an iterable of coordinates
+        :returns: a ``Deferred`` which fires with a list of the blocks, in
+            the same order as the coordinates
+        """
+
+        groups = group_by_chunk(coords)
+        d = self._load_chunks(groups)
+        d.addCallback(lambda chunks: self._read_blocks(groups, chunks))
+        return d
+
+    def set_blocks(self, coords, blocks, metadata=None):
+        """
+        Set lots of blocks in unknown chunks.
+
+        Every chunk is loaded before any of the blocks are set, and then all
+        of the blocks are set in a single batch.
+
+        :param coords: an iterable of coordinates
+        :param blocks: a sequence of blocks, one for each coordinate, or a
+            single block for all of them
+        :param metadata: a sequence of metadata, one for each coordinate, or a
+            single metadata for all of them; if not given, metadata is left
+            alone
+        :returns: a ``Deferred`` which fires with a list of the chunks which
+            the blocks are in, for flushing
+        """
+
+        coords = list(coords)
+        groups = group_by_chunk(coords)
+        blocks = spread(blocks, len(coords))
+        if metadata is not None:
+            metadata = spread(metadata, len(coords))
+
+        d = self._load_chunks(groups)
+        d.addCallback(lambda chunks: self._write_blocks(groups, chunks,
+                                                        blocks, metadata))
+        return d
+
+    def destroy_blocks(self, coords):
+        """
+        Destroy lots of blocks in unknown chunks.
+
+        :param coords: an iterable of coordinates
+        :returns: a ``Deferred`` which fires with a list of the chunks which
+            the blocks are in, for flushing
+        """
+
+        groups = group_by_chunk(coords)
+        d = self._load_chunks(groups)
+        d.addCallback(lambda chunks: self._write_blocks(groups, chunks,
+                                                        None, None))
+        return d
+
+    def sync_get_blocks(self, coords):
+        """
+        Get lots of blocks from unknown chunks.
+
+        :param coords: an iterable of coordinates
+        :returns: a list of the blocks, in the same order as the coordinates
+        :raises ChunkNotLoaded: if any of the chunks isn't loaded
+        """
+
+        groups = group_by_chunk(coords)
+        return self._read_blocks(groups, self._loaded_chunks(groups))
+
+    def sync_set_blocks(self, coords, blocks, metadata=None):
+        """
+        Set lots of blocks in unknown chunks.
+
+        Nothing is changed unless every chunk is loaded.
+
+        :param coords: an iterable of coordinates
+        :param blocks: a sequence of blocks, or a single block for all of them
+        :param metadata: a sequence of metadata, or a single metadata for all
+            of them; if not given, metadata is left alone
+        :returns: a list of the chunks which the blocks are in, for flushing
+        :raises ChunkNotLoaded: if any of the chunks isn't loaded
+        """
+
+        coords = list(coords)
+        groups = group_by_chunk(coords)
+        blocks = spread(blocks, len(coords))
+        if metadata is not None:
+            metadata = spread(metadata, len(coords))
+
+        chunks = self._loaded_chunks(groups)
+        return self._write_blocks(groups, chunks, blocks, metadata)
+
+    def sync_destroy_blocks(self, coords):
+        """
+        Destroy lots of blocks in unknown chunks.
+
+        Nothing is changed unless every chunk is loaded.
+
+        :param coords: an iterable of coordinates
+        :returns: a list of the chunks which the blocks are in, for flushing
+        :raises ChunkNotLoaded: if any of the chunks isn't loaded
+        """
+
+        groups = group_by_chunk(coords)
+        chunks = self._loaded_chunks(groups)
+        return self._write_blocks(groups, chunks, None, None)
+
     @sync_coords_to_chunk
     def sync_get_block(self, chunk, coords):
         """
@@ -684,6 +1853,7 @@ class World(object):
         :returns: None
         """
 
+        self._enlist(chunk)
         chunk.set_block(coords, value)
 
     @sync_coords_to_chunk
@@ -704,6 +1874,7 @@ class World(object):
         :returns: None
         """
 
+        self._enlist(chunk)
         chunk.set_metadata(coords, value)
 
     @sync_coords_to_chunk
@@ -714,6 +1885,7 @@ class World(object):
         :returns: None
         """
 
+        self._enlist(chunk)
         chunk.destroy(coords)
 
     @sync_coords_to_chunk
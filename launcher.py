@@ -10,7 +10,6 @@ config = """# For an excellent overview of what is possible here please take a
 # https://github.com/MostAwesomeDude/bravo/blob/master/bravo.ini.example
 
 [bravo]
-ampoule = no
 fancy_console = false
 
 [world bravo]
@@ -1,16 +1,24 @@
 #!/usr/bin/env python
 
+import sys
+
 from setuptools import find_packages, setup
 
 from bravo import version
 
+install_requires = open("requirements.txt").read().split("\n")
+
+# OrderedDict is only in the standard library from Python 2.7 onwards.
+if sys.version_info < (2, 7):
+    install_requires.append("ordereddict")
+
 setup(
     name="Bravo",
     version=version.encode("utf8"),
     packages=find_packages() + [
         "twisted.plugins",
     ],
-    install_requires=open("requirements.txt").read().split("\n"),
+    install_requires=install_requires,
     author="Corbin Simpson",
     author_email="MostAwesomeDude@gmail.com",
     description="Minecraft server and utilities",
@@ -31,6 +31,8 @@ config.set("world mapgen", "serializer", "beta")
 
 world = World(config, "mapgen")
 world.connect()
+# There's no reactor running, so chunks can't be written in threads.
+world.serializer.threaded = False
 world.pipeline = pipeline
 world.season = None
 world.saving = True
@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+
+from __future__ import division
+
+import sys
+
+from twisted.python.filepath import FilePath
+
+from bravo.region import Region
+
+if len(sys.argv) < 2:
+    print "Usage: %s <region> [<region> ...]" % sys.argv[0]
+    print "Don't compact the regions of a world which a server is running."
+    sys.exit()
+
+total = 0
+
+for path in sys.argv[1:]:
+    fp = FilePath(path)
+
+    if not fp.exists():
+        print "Region %r doesn't exist!" % fp.path
+        continue
+
+    region = Region(fp)
+    region.load_pages()
+    size = region.size
+    reclaimed = region.compact()
+    total += reclaimed
+
+    print "%s: %.2fKiB -> %.2fKiB" % (fp.basename(), size / 1024,
+                                      region.size / 1024)
+
+print "Reclaimed %.2fKiB in total." % (total / 1024)
@@ -19,10 +19,12 @@ if not fp.exists():
     sys.exit()
 
 region = Region(fp)
-region.load_pages()
+region.load_pages(recover=False)
+region.map()
 
 if region.free_pages:
-    print "Free pages:", sorted(region.free_pages)
+    print "Free pages:", ", ".join("%d-%d" % (start, start + length - 1)
+                                   for start, length in region.free_pages)
 else:
     print "No free pages."
 